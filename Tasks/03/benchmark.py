@@ -0,0 +1,95 @@
+import sys
+import time
+import random
+
+import solution
+
+
+def power_law_edges(users_count, edges_per_user=3, seed=0):
+    """Return users and (follower, followee) pairs picked by
+       preferential attachment.
+
+       Each new user follows edges_per_user existing users, picked
+       proportionally to their degree, so follower counts follow a
+       power law. A fraction of the edges is followed back.
+    """
+    generator = random.Random(seed)
+    users = [solution.User(str(number)) for number in range(users_count)]
+    # Every user appears here once per incident edge:
+    endpoints = [user.uuid for user in users[:edges_per_user]]
+    pairs = []
+    for user in users[edges_per_user:]:
+        followees = {generator.choice(endpoints)
+                     for _ in range(edges_per_user)}
+        for followee in followees:
+            pairs.append((user.uuid, followee))
+            if generator.random() < 0.3:
+                pairs.append((followee, user.uuid))
+            endpoints.extend((user.uuid, followee))
+    return users, pairs
+
+
+def power_law_graph(users_count, edges_per_user=3, seed=0):
+    """Build a SocialGraph of power_law_edges."""
+    users, pairs = power_law_edges(users_count, edges_per_user, seed)
+    graph = solution.SocialGraph()
+    graph.add_users(users)
+    graph.follow_many(pairs)
+    return graph
+
+
+def build_per_call(users, pairs):
+    graph = solution.SocialGraph()
+    for user in users:
+        graph.add_user(user)
+    for follower, followee in pairs:
+        graph.follow(follower, followee)
+    return graph
+
+
+def build_in_bulk(users, pairs):
+    graph = solution.SocialGraph()
+    graph.add_users(users)
+    graph.follow_many(pairs)
+    return graph
+
+
+def read_every_set(graph):
+    """Read the following and followers sets of every user,
+       which decodes all of them after a follow_many.
+    """
+    for user in graph.users:
+        graph.following(user)
+        graph.followers(user)
+
+
+def measure(name, function):
+    start = time.perf_counter()
+    function()
+    print('{:<32} {:8.3f}s'.format(name, time.perf_counter() - start))
+
+
+def main(users_count=5000, workers=4):
+    users, pairs = power_law_edges(users_count)
+    # Building alone leaves the sets of follow_many undecoded,
+    # so both are also measured with every set read afterwards:
+    for name, build in (('add_user and follow per call', build_per_call),
+                        ('add_users and follow_many', build_in_bulk)):
+        measure(name, lambda: build(users, pairs))
+        measure('  and reading every set',
+                lambda: read_every_set(build(users, pairs)))
+    graph = power_law_graph(users_count)
+    print('{} users, {} edges'.format(
+        users_count, sum(len(graph.following(user)) for user in graph.users)
+    ))
+    measure('max_distance per user', lambda: [
+        graph.max_distance(user) for user in graph.users
+    ])
+    measure('eccentricities, 1 worker',
+            lambda: list(graph.eccentricities(workers=1)))
+    measure('eccentricities, {} workers'.format(workers),
+            lambda: list(graph.eccentricities(workers=workers)))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -1,7 +1,16 @@
+import os
 import math
 import uuid
+import struct
+import tempfile
+from operator import attrgetter
+from itertools import chain, accumulate
+from array import array
+from mmap import mmap as MemoryMap, ACCESS_READ
+from multiprocessing import Pool
 from datetime import datetime
-from collections import deque, defaultdict
+from collections import deque, defaultdict, namedtuple, OrderedDict, Counter
+from collections.abc import Sequence, MutableMapping
 
 
 class UserDoesNotExistError(Exception):
@@ -36,15 +45,19 @@ class Post:
 
 
 class User:
-    def __init__(self, full_name):
+    def __init__(self, full_name, user_uuid=None):
         self._full_name = full_name
-        self._uuid = uuid.uuid4()
+        self._uuid = user_uuid or uuid.uuid4()
         self._posts = deque([], maxlen=50)
 
     @property
     def uuid(self):
         return self._uuid
 
+    @property
+    def full_name(self):
+        return self._full_name
+
     def add_post(self, post_content):
         """Create a new post for the user."""
         self._posts.append(Post(self.uuid, post_content))
@@ -54,11 +67,294 @@ class User:
         return (post for post in self._posts)
 
 
+DistanceCacheInfo = namedtuple(
+    'DistanceCacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize']
+)
+
+
+class MappedUuids(Sequence):
+    """Sorted uuids stored as 16-byte records.
+
+       The position of a uuid is found by binary search,
+       so no index of all the users is built.
+    """
+    def __init__(self, data, offset, count):
+        self._data = data
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[index]
+                    for index in range(*position.indices(self._count))]
+        if position < 0:
+            position += self._count
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        start = self._offset + 16 * position
+        return uuid.UUID(bytes=bytes(self._data[start:start + 16]))
+
+    def position(self, user):
+        """Return the position of user or None if it is not stored."""
+        key = user.bytes
+        data, offset = self._data, self._offset
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            start = offset + 16 * middle
+            if data[start:start + 16] < key:
+                low = middle + 1
+            else:
+                high = middle
+        start = offset + 16 * low
+        if low < self._count and data[start:start + 16] == key:
+            return low
+        return None
+
+
+class MappedUsers(MutableMapping):
+    """Users stored as length-prefixed names and posts.
+
+       A user is decoded on first access and kept afterwards.
+       Users added or deleted later are tracked apart from the
+       stored ones, which are never changed.
+    """
+    def __init__(self, uuids, offsets, data, offset):
+        self._uuids = uuids
+        self._offsets = offsets
+        self._data = data
+        self._offset = offset
+        self._decoded = {}
+        self._added = {}
+        self._deleted = set()
+
+    def __decode(self, user_uuid, position):
+        data = self._data
+        offset = self._offset + self._offsets[position]
+        name_length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        user = User(bytes(data[offset:offset + name_length]).decode(),
+                    user_uuid)
+        offset += name_length
+        posts_count, = struct.unpack_from('<B', data, offset)
+        offset += 1
+        for _ in range(posts_count):
+            published_at, content_length = \
+                SocialGraph.SNAPSHOT_POST.unpack_from(data, offset)
+            offset += SocialGraph.SNAPSHOT_POST.size
+            post = Post(user_uuid, bytes(
+                data[offset:offset + content_length]
+            ).decode())
+            post._published_at = datetime.fromtimestamp(published_at)
+            user._posts.append(post)
+            offset += content_length
+        return user
+
+    def __getitem__(self, user):
+        try:
+            return self._decoded[user]
+        except KeyError:
+            pass
+        try:
+            return self._added[user]
+        except KeyError:
+            pass
+        position = self._uuids.position(user)
+        if position is None or user in self._deleted:
+            raise KeyError(user)
+        decoded = self._decoded[user] = self.__decode(user, position)
+        return decoded
+
+    def __contains__(self, user):
+        if user in self._decoded or user in self._added:
+            return True
+        return (isinstance(user, uuid.UUID) and user not in self._deleted
+                and self._uuids.position(user) is not None)
+
+    def __setitem__(self, user, value):
+        if self._uuids.position(user) is None:
+            self._added[user] = value
+        else:
+            self._deleted.discard(user)
+            self._decoded[user] = value
+
+    def __delitem__(self, user):
+        if user in self._added:
+            del self._added[user]
+        elif user in self:
+            self._decoded.pop(user, None)
+            self._deleted.add(user)
+        else:
+            raise KeyError(user)
+
+    def __iter__(self):
+        deleted = self._deleted
+        for user in self._uuids:
+            if user not in deleted:
+                yield user
+        yield from self._added
+
+    def __len__(self):
+        return len(self._uuids) - len(self._deleted) + len(self._added)
+
+
+class IndexedUuids(list):
+    """Uuids of a follow_many batch, indexed by their integer value."""
+    def __init__(self, uuids, index):
+        super().__init__(uuids)
+        self._index = index
+
+    def position(self, user):
+        """Return the position of user or None if it is not stored."""
+        return self._index.get(user.int)
+
+
+def _umask():
+    """Return the file mode creation mask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def _group_edges(sources, targets, count):
+    """Return offset+target arrays of the edges grouped by source.
+
+       sources and targets are positions among count uuids,
+       the edges are placed by a counting sort.
+    """
+    offsets = [0] * (count + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    offsets = list(accumulate(offsets))
+    free = offsets[:-1]
+    grouped = [0] * len(sources)
+    for source, target in zip(sources, targets):
+        grouped[free[source]] = target
+        free[source] += 1
+    return array('Q', offsets), array('I', grouped)
+
+
+class MappedAdjacency(defaultdict):
+    """Adjacency sets stored as offset+target arrays,
+       of a snapshot and of the follow_many batches.
+
+       The set of a user is decoded on first access
+       and kept afterwards, so it can be mutated as usual.
+    """
+    # Pending batches at which all of their sets are decoded,
+    # so that a miss does not look through too many of them:
+    MAX_BATCHES = 16
+
+    def __init__(self, uuids=None, offsets=None, targets=None):
+        super().__init__(set)
+        self._snapshot = None if uuids is None else (uuids, offsets, targets)
+        self._batches = []
+
+    @staticmethod
+    def __decode(source, user):
+        uuids, offsets, targets = source
+        position = uuids.position(user)
+        if position is None:
+            return ()
+        start, end = offsets[position], offsets[position + 1]
+        return map(uuids.__getitem__, targets[start:end])
+
+    def extend(self, uuids, offsets, targets):
+        """Add the edges of a batch, given as offset+target arrays."""
+        batch = (uuids, offsets, targets)
+        # The sets decoded already are updated now:
+        if len(self) < len(uuids):
+            decoded = [user for user in self
+                       if uuids.position(user) is not None]
+        else:
+            decoded = [user for user in uuids if user in self]
+        for user in decoded:
+            self[user].update(self.__decode(batch, user))
+        self._batches.append(batch)
+        if len(self._batches) > self.MAX_BATCHES:
+            # Decode the set of every user of the batches:
+            for uuids, _, _ in self._batches:
+                for user in uuids:
+                    self[user]
+            self._batches.clear()
+
+    def __missing__(self, user):
+        adjacent = set()
+        if self._snapshot is not None:
+            adjacent.update(self.__decode(self._snapshot, user))
+        for batch in self._batches:
+            adjacent.update(self.__decode(batch, user))
+        self[user] = adjacent
+        return adjacent
+
+
+# Read-only adjacency shared with the eccentricity workers:
+_eccentricity_adjacency = None
+
+
+def _init_eccentricity_worker(adjacency):
+    global _eccentricity_adjacency
+    _eccentricity_adjacency = adjacency
+
+
+def _eccentricity_batch(sources):
+    """Run a bit-parallel BFS from up to 64 sources at once.
+
+       Bit i of a vertex mask tells whether sources[i] reached it,
+       so the neighbours of a vertex are scanned once per level for
+       all sources. Return list of (source, eccentricity, layer_sizes).
+    """
+    adjacency = _eccentricity_adjacency
+    visited = [0] * len(adjacency)
+    frontier = {}
+    for bit, source in enumerate(sources):
+        visited[source] |= 1 << bit
+        frontier[source] = frontier.get(source, 0) | 1 << bit
+    layer_sizes = [[1] for _ in sources]
+    while frontier:
+        next_frontier = {}
+        for vertex, mask in frontier.items():
+            for neighbour in adjacency[vertex]:
+                reached = mask & ~visited[neighbour]
+                if reached:
+                    visited[neighbour] |= reached
+                    next_frontier[neighbour] = \
+                        next_frontier.get(neighbour, 0) | reached
+        counts = [0] * len(sources)
+        for mask in next_frontier.values():
+            while mask:
+                lowest = mask & -mask
+                counts[lowest.bit_length() - 1] += 1
+                mask ^= lowest
+        # A source stops growing at its first empty layer:
+        for bit, count in enumerate(counts):
+            if count:
+                layer_sizes[bit].append(count)
+        frontier = next_frontier
+    return [(source, len(layers) - 1, layers)
+            for source, layers in zip(sources, layer_sizes)]
+
+
 class SocialGraph:
-    def __init__(self):
+    # Snapshot layout: header, sorted user uuids, following
+    # offsets and targets, followers offsets and targets, the
+    # offsets of the users and finally their names and posts.
+    SNAPSHOT_MAGIC = b'SGRAPH02'
+    SNAPSHOT_HEADER = struct.Struct('<8sQQ')
+    SNAPSHOT_POST = struct.Struct('<dI')
+
+    def __init__(self, distance_cache_size=128):
         self.users = {}
-        self._user_followers = defaultdict(set)
-        self._user_following = defaultdict(set)
+        self._user_followers = MappedAdjacency()
+        self._user_following = MappedAdjacency()
+        # BFS levels of the most recently queried sources,
+        # kept in least recently used order:
+        self._distance_cache = OrderedDict()
+        self._distance_cache_size = distance_cache_size
+        self._distance_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
 
     def __check_user_exists(func):
         """Decorator function that checks user existance in the graph."""
@@ -77,6 +373,27 @@ class SocialGraph:
             raise UserAlreadyExistsError
         self.users[user.uuid] = user
 
+    def add_users(self, users):
+        """Add many users in the graph at once.
+
+           The whole batch is rejected if any of the users
+           already exists in the graph or is repeated in it.
+        """
+        users = list(users)
+        uuids = list(map(attrgetter('uuid'), users))
+        # Hash every uuid once, the update reuses the hashes:
+        added = dict(zip(uuids, users))
+        existing = set()
+        if self.users:
+            existing = {user for user in added if user in self.users}
+        if len(added) < len(users):
+            seen = set()
+            existing |= {user_uuid for user_uuid in uuids
+                         if user_uuid in seen or seen.add(user_uuid)}
+        if existing:
+            raise UserAlreadyExistsError(existing)
+        self.users.update(added)
+
     @__check_user_exists
     def get_user(self, user):
         """Return User object matching user."""
@@ -91,6 +408,7 @@ class SocialGraph:
             self.unfollow(follower, user)
         for followee in self.following(user).copy():
             self.unfollow(user, followee)
+        self.__invalidate_distances({user})
         del self.users[user]
 
     @__check_user_exists
@@ -98,15 +416,62 @@ class SocialGraph:
         """Make User with uuid: follower to follow
            User with uuid: followee.
         """
+        if followee not in self._user_following[follower]:
+            self.__invalidate_distances({follower})
         self._user_following[follower].add(followee)
         self._user_followers[followee].add(follower)
 
+    def follow_many(self, pairs):
+        """Make every follower follow its followee,
+           given an iterable of (follower, followee) pairs.
+
+           The whole batch is rejected if any of the uuids
+           is not present in the graph.
+        """
+        # The edges are kept as positions among the uuids of the batch
+        # and each adjacency set is decoded when it is first accessed.
+        # The uuids are told apart by their integer value, which is
+        # hashed natively, unlike the uuids themselves:
+        pairs = list(pairs)
+        if not set(map(len, pairs)) <= {2}:
+            raise TypeError('follow_many() takes (follower, followee) pairs')
+        endpoints = list(chain.from_iterable(pairs))
+        if not endpoints:
+            return
+        try:
+            keys = list(map(attrgetter('int'), endpoints))
+        except AttributeError:
+            raise UserDoesNotExistError(
+                [user for user in endpoints if type(user) is not uuid.UUID]
+            )
+        unique = dict(zip(keys, endpoints))
+        index = {key: position for position, key in enumerate(unique)}
+        uuids = IndexedUuids(unique.values(), index)
+        users = self.users
+        if not all(map(users.__contains__, uuids)):
+            raise UserDoesNotExistError(
+                {user for user in uuids if user not in users}
+            )
+        positions = list(map(index.__getitem__, keys))
+        followers, followees = positions[0::2], positions[1::2]
+        if self._distance_cache:
+            self.__invalidate_distances(
+                {uuids[follower] for follower in set(followers)}
+            )
+        self._user_following.extend(
+            uuids, *_group_edges(followers, followees, len(uuids))
+        )
+        self._user_followers.extend(
+            uuids, *_group_edges(followees, followers, len(uuids))
+        )
+
     @__check_user_exists
     def unfollow(self, follower, followee):
         """Make User with uuid: follower to unfollow
            User with uuid: followee.
         """
         if self.is_following(follower, followee):
+            self.__invalidate_distances({follower})
             self._user_following[follower].remove(followee)
             self._user_followers[followee].remove(follower)
 
@@ -135,17 +500,13 @@ class SocialGraph:
         """Return the distance to the farthest \
            user from user.
         """
-        # Return the last vertex with it`s level
-        return self.__bfs(user)[-1][1]
+        # Return the level of the last visited vertex
+        return next(reversed(self.__distances(user).values()))
 
     @__check_user_exists
     def min_distance(self, from_user, to_user):
         """Return the shortest path between two users in the graph."""
-        distance = math.inf
-        for user, level in self.__bfs(from_user):
-            if user == to_user:
-                distance = level
-                break
+        distance = self.__distances(from_user).get(to_user, math.inf)
         if distance == math.inf:
             raise UsersNotConnectedError
         return distance
@@ -156,7 +517,7 @@ class SocialGraph:
            distance n.
         """
         return {usr for usr, level
-                in self.__bfs(user)
+                in self.__distances(user).items()
                 if level == n}
 
     @__check_user_exists
@@ -174,20 +535,235 @@ class SocialGraph:
         )[offset:][0:limit]
 
     @__check_user_exists
-    def __bfs(self, start, end=None):
-        """Perform BFS on the graph."""
-        result = []
-        vertices = deque([(start, 0)])
-        visited = set()
-        while vertices:
-            vertex, level = vertices.popleft()
-            if vertex not in visited:
-                result.append((vertex, level))
-                visited.add(vertex)
-                neighbours = [
-                    (followee, level + 1)
-                    for followee in self.following(vertex)
-                    if followee not in visited
+    def recommend(self, user, k=10):
+        """Return up to k users followed by user`s followees,
+           ranked by the number of followees leading to them.
+        """
+        return self.__recommend(user, k)
+
+    def recommend_many(self, users, k=10):
+        """Return dict with the recommendations for each of users.
+
+           The followees of each user followed in the batch are read
+           once and counted by their integer value, which is hashed
+           natively, unlike the uuids themselves.
+        """
+        users = list(users)
+        missing = {user for user in users if user not in self.users}
+        if missing:
+            raise UserDoesNotExistError(missing)
+        user_following = self._user_following
+        following, uuids = {}, {}
+        recommendations = {}
+        for user in users:
+            followees = user_following[user]
+            mutual = Counter()
+            for followee in followees:
+                targets = following.get(followee.int)
+                if targets is None:
+                    others = user_following[followee]
+                    targets = following[followee.int] = [
+                        other.int for other in others
                     ]
-                vertices.extend(neighbours)
-        return result
+                    uuids.update(zip(targets, others))
+                mutual.update(targets)
+            # Existing followees and the user are not candidates:
+            for excluded in followees:
+                mutual.pop(excluded.int, None)
+            mutual.pop(user.int, None)
+            recommendations[user] = [
+                uuids[candidate] for candidate, _ in mutual.most_common(k)
+            ]
+        return recommendations
+
+    def __recommend(self, user, k):
+        user_following = self._user_following
+        followees = user_following[user]
+        mutual = Counter()
+        for followee in followees:
+            mutual.update(user_following[followee])
+        # Existing followees and the user are not candidates:
+        for excluded in followees:
+            mutual.pop(excluded, None)
+        mutual.pop(user, None)
+        return [candidate for candidate, _ in mutual.most_common(k)]
+
+    def eccentricities(self, users=None, workers=None, batch_size=64):
+        """Yield (uuid, eccentricity, layer_sizes) for each of users.
+
+           The eccentricity of a user is its max_distance and
+           layer_sizes[n] is the number of users at distance n.
+           Sources are split into batches of bit-parallel BFS runs,
+           spread over a pool of `workers` processes.
+        """
+        uuids = list(self.users)
+        index = {user: position for position, user in enumerate(uuids)}
+        if users is None:
+            sources = list(range(len(uuids)))
+        else:
+            users = list(users)
+            missing = {user for user in users if user not in index}
+            if missing:
+                raise UserDoesNotExistError(missing)
+            sources = [index[user] for user in users]
+        adjacency = [tuple(index[followee]
+                           for followee in self._user_following[user])
+                     for user in uuids]
+        batch_size = min(batch_size, 64)
+        batches = [sources[start:start + batch_size]
+                   for start in range(0, len(sources), batch_size)]
+        workers = workers or os.cpu_count()
+        if workers == 1:
+            _init_eccentricity_worker(adjacency)
+            results = map(_eccentricity_batch, batches)
+        else:
+            pool = Pool(workers, _init_eccentricity_worker, (adjacency,))
+            results = pool.imap_unordered(_eccentricity_batch, batches)
+        try:
+            for batch in results:
+                for source, eccentricity, layer_sizes in batch:
+                    yield uuids[source], eccentricity, layer_sizes
+        finally:
+            if workers != 1:
+                pool.terminate()
+
+    def save(self, path):
+        """Write a binary snapshot of the graph to path."""
+        # Sorted by their integer value, which orders them like their
+        # bytes and is hashed natively, unlike the uuids themselves:
+        uuids = sorted(self.users, key=attrgetter('int'))
+        index = {user.int: position for position, user in enumerate(uuids)}
+        sections = []
+        for adjacency in (self._user_following, self._user_followers):
+            offsets, targets = array('Q', [0]), array('I')
+            for user in uuids:
+                targets.extend([index[other.int] for other in adjacency[user]])
+                offsets.append(len(targets))
+            sections.extend((offsets, targets))
+        records, offsets = bytearray(), array('Q')
+        for user_uuid in uuids:
+            user = self.users[user_uuid]
+            offsets.append(len(records))
+            name = user.full_name.encode()
+            records += struct.pack('<I', len(name)) + name
+            records += struct.pack('<B', len(user._posts))
+            for post in user._posts:
+                content = post.content.encode()
+                records += self.SNAPSHOT_POST.pack(
+                    post.published_at.timestamp(), len(content)
+                ) + content
+        sections.append(offsets)
+        # Write a new file and replace the old one, which may
+        # still be memory-mapped by graphs loaded from it:
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as snapshot:
+                snapshot.write(self.SNAPSHOT_HEADER.pack(
+                    self.SNAPSHOT_MAGIC, len(uuids), len(sections[1])
+                ))
+                snapshot.write(b''.join(user.bytes for user in uuids))
+                for section in sections:
+                    section.tofile(snapshot)
+                    # Keep the next array 8-byte aligned:
+                    size = section.itemsize * len(section)
+                    snapshot.write(bytes(-size % 8))
+                snapshot.write(records)
+            # mkstemp makes the file private, give it the usual mode:
+            os.chmod(temporary, 0o666 & ~_umask())
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Return a graph restored from the snapshot at path.
+
+           With mmap=True the snapshot is memory-mapped and the
+           users and adjacency sets are only decoded when they
+           are accessed, so loading takes constant time.
+        """
+        with open(path, 'rb') as snapshot:
+            if mmap:
+                data = MemoryMap(snapshot.fileno(), 0, access=ACCESS_READ)
+            else:
+                data = snapshot.read()
+        buffer = memoryview(data)
+        magic, users_count, edges_count = cls.SNAPSHOT_HEADER.unpack_from(data)
+        if magic != cls.SNAPSHOT_MAGIC:
+            raise ValueError('{} is not a SocialGraph snapshot'.format(path))
+        offset = cls.SNAPSHOT_HEADER.size
+        uuids = MappedUuids(data, offset, users_count)
+        offset += 16 * users_count
+
+        def take(typecode, count):
+            nonlocal offset
+            size = struct.calcsize(typecode) * count
+            section = buffer[offset:offset + size].cast(typecode)
+            # Skip the padding after the array:
+            offset += size + -size % 8
+            return section
+
+        graph = cls()
+        for name in ('_user_following', '_user_followers'):
+            offsets = take('Q', users_count + 1)
+            targets = take('I', edges_count)
+            setattr(graph, name, MappedAdjacency(uuids, offsets, targets))
+        offsets = take('Q', users_count)
+        graph.users = MappedUsers(uuids, offsets, buffer, offset)
+        return graph
+
+    def distance_cache_info(self):
+        """Return hit, miss and eviction counters of the distance cache."""
+        return DistanceCacheInfo(
+            maxsize=self._distance_cache_size,
+            currsize=len(self._distance_cache),
+            **self._distance_cache_stats
+        )
+
+    def __distances(self, start):
+        """Return the BFS levels from start, using the distance cache."""
+        cache = self._distance_cache
+        stats = self._distance_cache_stats
+        try:
+            levels = cache[start]
+        except KeyError:
+            stats['misses'] += 1
+        else:
+            stats['hits'] += 1
+            cache.move_to_end(start)
+            return levels
+        levels = self.__bfs(start)
+        if self._distance_cache_size > 0:
+            cache[start] = levels
+            if len(cache) > self._distance_cache_size:
+                cache.popitem(last=False)
+                stats['evictions'] += 1
+        return levels
+
+    def __invalidate_distances(self, users):
+        """Drop cached BFS levels of the sources that reach any of users."""
+        cache = self._distance_cache
+        stale = [start for start, levels in cache.items()
+                 if not levels.keys().isdisjoint(users)]
+        for start in stale:
+            del cache[start]
+
+    @__check_user_exists
+    def __bfs(self, start):
+        """Perform BFS on the graph.
+
+           Return dict of the reachable vertices and their
+           levels, in the order they were visited.
+        """
+        levels = {start: 0}
+        vertices = deque([start])
+        while vertices:
+            vertex = vertices.popleft()
+            level = levels[vertex] + 1
+            for followee in self._user_following[vertex]:
+                if followee not in levels:
+                    levels[followee] = level
+                    vertices.append(followee)
+        return levels
@@ -1,4 +1,7 @@
+import os
+import uuid
 import datetime
+import tempfile
 import unittest
 
 import solution
@@ -23,6 +26,16 @@ class TestSocialGraph(unittest.TestCase):
             self.graph.add_user(self.michael)
         self.assertIn(self.michael.uuid, self.graph.users)
 
+    def test_add_users(self):
+        with self.assertRaises(solution.UserAlreadyExistsError):
+            self.graph.add_users([self.michael, self.terry])
+        self.assertNotIn(self.michael.uuid, self.graph.users)
+        with self.assertRaises(solution.UserAlreadyExistsError):
+            self.graph.add_users([self.michael, self.michael])
+        self.assertNotIn(self.michael.uuid, self.graph.users)
+        self.graph.add_users(iter([self.michael]))
+        self.assertIn(self.michael.uuid, self.graph.users)
+
     def test_get_user(self):
         with self.assertRaises(solution.UserDoesNotExistError):
             self.graph.get_user(self.michael.uuid)
@@ -47,6 +60,59 @@ class TestSocialGraph(unittest.TestCase):
         self.assertFalse(
             self.graph.is_following(self.eric.uuid, self.terry.uuid))
 
+    def test_follow_many(self):
+        with self.assertRaises(solution.UserDoesNotExistError):
+            self.graph.follow_many([(self.terry.uuid, self.eric.uuid),
+                                    (self.michael.uuid, self.eric.uuid)])
+        self.assertFalse(
+            self.graph.is_following(self.terry.uuid, self.eric.uuid))
+        self.graph.follow_many([(self.terry.uuid, self.eric.uuid),
+                                (self.john.uuid, self.eric.uuid),
+                                (self.terry.uuid, self.eric.uuid)])
+        self.assertEqual({self.terry.uuid, self.john.uuid},
+                         self.graph.followers(self.eric.uuid))
+        self.assertEqual({self.eric.uuid},
+                         self.graph.following(self.terry.uuid))
+        with self.assertRaises(TypeError):
+            self.graph.follow_many([(self.john.uuid, self.terry.uuid,
+                                     self.eric.uuid)])
+        self.assertEqual({self.eric.uuid},
+                         self.graph.following(self.john.uuid))
+        self.assertEqual(set(), self.graph.following(self.eric.uuid))
+
+    def test_follow_many_batches(self):
+        self.graph.follow_many([(self.terry.uuid, self.eric.uuid)])
+        # Decoded before the next batch:
+        self.assertEqual({self.eric.uuid},
+                         self.graph.following(self.terry.uuid))
+        self.graph.follow_many([(self.terry.uuid, self.john.uuid),
+                                (self.graham.uuid, self.john.uuid)])
+        self.graph.follow(self.graham.uuid, self.eric.uuid)
+        self.assertEqual({self.eric.uuid, self.john.uuid},
+                         self.graph.following(self.terry.uuid))
+        self.assertEqual({self.eric.uuid, self.john.uuid},
+                         self.graph.following(self.graham.uuid))
+        self.assertEqual({self.terry.uuid, self.graham.uuid},
+                         self.graph.followers(self.john.uuid))
+        self.assertEqual(self.graph.min_distance(self.terry.uuid,
+                                                 self.john.uuid), 1)
+        with self.assertRaises(solution.UserDoesNotExistError):
+            self.graph.follow_many([(self.terry.uuid, 'John Cleese')])
+
+    def test_follow_many_decodes_pending_batches(self):
+        users = [self.terry, self.eric, self.graham, self.john]
+        limit = solution.MappedAdjacency.MAX_BATCHES
+        for number in range(limit + 1):
+            follower = users[number % 4].uuid
+            followee = users[(number + 1) % 4].uuid
+            self.graph.follow_many([(follower, followee)])
+        self.assertEqual(self.graph._user_following._batches, [])
+        for number, user in enumerate(users):
+            self.assertEqual({users[(number + 1) % 4].uuid},
+                             self.graph.following(user.uuid))
+            self.assertEqual({users[(number - 1) % 4].uuid},
+                             self.graph.followers(user.uuid))
+
     def test_unfollow(self):
         with self.assertRaises(solution.UserDoesNotExistError):
             self.graph.follow(self.michael.uuid, self.eric.uuid)
@@ -88,6 +154,29 @@ class TestSocialGraph(unittest.TestCase):
         self.graph.follow(self.eric.uuid, self.john.uuid)
         self.assertEqual(self.graph.max_distance(self.terry.uuid), 2)
 
+    def test_eccentricities(self):
+        self.graph.follow(self.terry.uuid, self.eric.uuid)
+        self.graph.follow(self.terry.uuid, self.graham.uuid)
+        self.graph.follow(self.graham.uuid, self.eric.uuid)
+        self.graph.follow(self.eric.uuid, self.john.uuid)
+        expected = {
+            self.terry.uuid: (2, [1, 2, 1]),
+            self.eric.uuid: (1, [1, 1]),
+            self.graham.uuid: (2, [1, 1, 1]),
+            self.john.uuid: (0, [1]),
+        }
+        for workers in (1, 2):
+            result = {user: (eccentricity, layer_sizes)
+                      for user, eccentricity, layer_sizes
+                      in self.graph.eccentricities(workers=workers,
+                                                   batch_size=3)}
+            self.assertEqual(result, expected)
+        result = list(self.graph.eccentricities([self.graham.uuid],
+                                                workers=1))
+        self.assertEqual(result, [(self.graham.uuid, 2, [1, 1, 1])])
+        with self.assertRaises(solution.UserDoesNotExistError):
+            list(self.graph.eccentricities([self.michael.uuid]))
+
     def test_min_distance(self):
         with self.assertRaises(solution.UsersNotConnectedError):
             self.graph.min_distance(self.terry.uuid, self.eric.uuid)
@@ -109,6 +198,58 @@ class TestSocialGraph(unittest.TestCase):
         self.assertEqual(self.graph.nth_layer_followings(self.terry.uuid, 2),
                          {self.john.uuid})
 
+    def test_distance_cache(self):
+        self.graph.follow(self.terry.uuid, self.eric.uuid)
+        self.graph.follow(self.eric.uuid, self.john.uuid)
+        self.assertEqual(self.graph.max_distance(self.terry.uuid), 2)
+        self.assertEqual(self.graph.min_distance(self.terry.uuid,
+                                                 self.john.uuid), 2)
+        self.assertEqual(self.graph.max_distance(self.graham.uuid), 0)
+        info = self.graph.distance_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (1, 2, 2))
+        # Only sources reaching the follower are invalidated:
+        self.graph.follow(self.john.uuid, self.graham.uuid)
+        self.assertEqual(self.graph.distance_cache_info().currsize, 1)
+        self.assertEqual(self.graph.max_distance(self.terry.uuid), 3)
+        self.graph.unfollow(self.eric.uuid, self.john.uuid)
+        with self.assertRaises(solution.UsersNotConnectedError):
+            self.graph.min_distance(self.terry.uuid, self.john.uuid)
+        self.graph.follow(self.eric.uuid, self.john.uuid)
+        self.graph.delete_user(self.john.uuid)
+        self.assertEqual(self.graph.max_distance(self.terry.uuid), 1)
+
+    def test_distance_cache_eviction(self):
+        graph = solution.SocialGraph(distance_cache_size=1)
+        graph.add_users([self.michael, self.terry])
+        graph.max_distance(self.michael.uuid)
+        graph.max_distance(self.terry.uuid)
+        graph.max_distance(self.terry.uuid)
+        info = graph.distance_cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions,
+                          info.currsize), (1, 2, 1, 1))
+
+    def test_recommend(self):
+        self.graph.add_user(self.michael)
+        self.graph.follow_many([
+            (self.terry.uuid, self.eric.uuid),
+            (self.terry.uuid, self.graham.uuid),
+            (self.eric.uuid, self.john.uuid),
+            (self.graham.uuid, self.john.uuid),
+            (self.graham.uuid, self.michael.uuid),
+            (self.graham.uuid, self.eric.uuid),
+            (self.eric.uuid, self.terry.uuid),
+        ])
+        self.assertEqual(self.graph.recommend(self.terry.uuid),
+                         [self.john.uuid, self.michael.uuid])
+        self.assertEqual(self.graph.recommend(self.terry.uuid, 1),
+                         [self.john.uuid])
+        self.assertEqual(
+            self.graph.recommend_many([self.terry.uuid, self.john.uuid]),
+            {self.terry.uuid: [self.john.uuid, self.michael.uuid],
+             self.john.uuid: []})
+        with self.assertRaises(solution.UserDoesNotExistError):
+            self.graph.recommend_many([self.terry.uuid, uuid.uuid4()])
+
     def test_generate_feed(self):
         self.graph.follow(self.terry.uuid, self.eric.uuid)
         self.graph.follow(self.terry.uuid, self.john.uuid)
@@ -120,6 +261,82 @@ class TestSocialGraph(unittest.TestCase):
         result = list(map(lambda post: post.content, result))
         self.assertEqual(result, ["4", "3", "2", "1"])
 
+    def test_save_and_load(self):
+        self.graph.follow(self.terry.uuid, self.eric.uuid)
+        self.graph.follow(self.eric.uuid, self.terry.uuid)
+        self.graph.follow(self.graham.uuid, self.eric.uuid)
+        self.eric.add_post("1")
+        self.eric.add_post("2")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.bin')
+            self.graph.save(path)
+            for mmap in (True, False):
+                graph = solution.SocialGraph.load(path, mmap=mmap)
+                self.assertEqual(set(graph.users), set(self.graph.users))
+                self.assertEqual(graph.get_user(self.eric.uuid).full_name,
+                                 "Eric Idle")
+                self.assertEqual(graph.followers(self.eric.uuid),
+                                 {self.terry.uuid, self.graham.uuid})
+                self.assertEqual(graph.friends(self.terry.uuid),
+                                 {self.eric.uuid})
+                self.assertEqual(graph.following(self.john.uuid), set())
+                posts = list(graph.get_user(self.eric.uuid).get_post())
+                self.assertEqual([post.content for post in posts],
+                                 ["1", "2"])
+                self.assertEqual([post.published_at for post in posts],
+                                 [post.published_at
+                                  for post in self.eric.get_post()])
+                graph.unfollow(self.graham.uuid, self.eric.uuid)
+                self.assertEqual(graph.followers(self.eric.uuid),
+                                 {self.terry.uuid})
+
+    def test_load_decodes_users_on_access(self):
+        self.graph.follow(self.terry.uuid, self.eric.uuid)
+        self.eric.add_post("1")
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.bin')
+            self.graph.save(path)
+            graph = solution.SocialGraph.load(path)
+            self.assertEqual(graph.users._decoded, {})
+            self.assertIn(self.eric.uuid, graph.users)
+            self.assertNotIn(self.michael.uuid, graph.users)
+            self.assertEqual(graph.get_user(self.eric.uuid).full_name,
+                             "Eric Idle")
+            self.assertEqual(list(graph.users._decoded), [self.eric.uuid])
+            graph.add_user(self.michael)
+            graph.delete_user(self.terry.uuid)
+            self.assertEqual(len(graph.users), 4)
+            self.assertEqual(set(graph.users),
+                             {self.eric.uuid, self.graham.uuid,
+                              self.john.uuid, self.michael.uuid})
+            self.assertEqual(graph.followers(self.eric.uuid), set())
+            with self.assertRaises(solution.UserDoesNotExistError):
+                graph.get_user(self.terry.uuid)
+            graph.add_user(self.terry)
+            self.assertIs(graph.get_user(self.terry.uuid), self.terry)
+
+    def test_save_over_mapped_snapshot(self):
+        self.graph.follow(self.terry.uuid, self.eric.uuid)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'graph.bin')
+            self.graph.save(path)
+            graph = solution.SocialGraph.load(path)
+            self.graph.add_user(self.michael)
+            self.graph.follow(self.michael.uuid, self.john.uuid)
+            self.graph.save(path)
+            # The loaded graph still reads the snapshot it mapped:
+            self.assertEqual(graph.following(self.terry.uuid),
+                             {self.eric.uuid})
+            self.assertEqual(len(graph.users), 4)
+            self.assertEqual(os.listdir(directory), ['graph.bin'])
+            umask = os.umask(0o022)
+            os.umask(umask)
+            self.assertEqual(os.stat(path).st_mode & 0o777,
+                             0o666 & ~umask)
+            graph = solution.SocialGraph.load(path)
+            self.assertEqual(graph.following(self.michael.uuid),
+                             {self.john.uuid})
+
 
 class TestUser(unittest.TestCase):
     def setUp(self):
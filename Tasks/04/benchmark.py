@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import time
+import argparse
+import sysconfig
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+
+import daemon
+import solution
+
+# Rules configurations the corpus is analyzed with:
+RULE_SETS = {
+    'defaults': {},
+    'all': {'max_nesting': 3, 'methods_per_class': 10, 'max_arity': 5,
+            'max_lines_per_function': 30},
+    'lines': {'indentation_size': None, 'forbid_semicolons': False},
+}
+
+
+def synthetic_module(functions=200):
+    """Return code with many small functions."""
+    return ''.join(
+        'def function_{0}(a, b):\n'
+        '    if a > b:\n'
+        '        return a - b\n'
+        '    return b - a\n\n'.format(number)
+        for number in range(functions)
+    )
+
+
+def deep_nesting_module(depth=60, repeat=20):
+    """Return code with functions nested depth blocks deep."""
+    function = ['def nested(a):\n']
+    for level in range(1, depth + 1):
+        function.append('    ' * level + 'if a > {}:\n'.format(level))
+    function.append('    ' * (depth + 1) + 'return a\n\n')
+    return ''.join(function) * repeat
+
+
+def long_lines_module(lines=500, width=200):
+    """Return code with lines of about width characters."""
+    terms = ' + '.join(['value'] * (width // 8))
+    return ''.join('value_{} = {}\n'.format(number, terms)
+                   for number in range(lines))
+
+
+def many_methods_module(classes=20, methods=100):
+    """Return code with classes defining many methods each."""
+    return ''.join(
+        'class Class{}:\n'.format(number) + ''.join(
+            '    def method_{0}(self, a):\n'
+            '        return a * {0}\n\n'.format(method)
+            for method in range(methods)
+        )
+        for number in range(classes)
+    )
+
+
+def stdlib_corpus(limit=100):
+    """Return {path: code} of the first limit stdlib modules."""
+    directory = sysconfig.get_paths()['stdlib']
+    skipped = {'site-packages', 'test', 'tests'}
+    corpus = {}
+    # The files are walked in sorted order, so the corpus is stable:
+    for path, _ in solution.iter_source_files([directory]):
+        if len(corpus) == limit:
+            break
+        name = os.path.relpath(path, directory)
+        if skipped.intersection(name.split(os.sep)):
+            continue
+        try:
+            code = solution.read_source(path)
+            solution.CodeCritic(code)
+        except solution.READ_ERRORS + solution.PARSE_ERRORS:
+            continue
+        corpus[name] = code
+    return corpus
+
+
+def corpora(stdlib_limit=100):
+    """Return {name: {path: code}} of the benchmarked corpora."""
+    return {
+        'stdlib': stdlib_corpus(stdlib_limit),
+        'deep nesting': {'deep.py': deep_nesting_module()},
+        'long lines': {'long.py': long_lines_module()},
+        'many methods': {'methods.py': many_methods_module()},
+    }
+
+
+def throughput(corpus, rules):
+    """
+       Return the statistics of critic() over the code in corpus:
+       lines per second, the cost of each rule and the peak memory.
+       Each is measured in its own run, as profiling and tracing
+       allocations slow the analysis down.
+    """
+    codes = list(corpus.values())
+    lines = sum(len(solution.split_lines(code)) for code in codes)
+    start = time.perf_counter()
+    for code in codes:
+        solution.critic(code, **rules)
+    seconds = time.perf_counter() - start
+
+    profile = solution.Profile()
+    for code in codes:
+        solution.critic(code, profile=profile, **rules)
+
+    tracemalloc.start()
+    try:
+        for code in codes:
+            solution.critic(code, **rules)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {
+        'files': len(codes),
+        'lines': lines,
+        'seconds': seconds,
+        'lines_per_second': lines / seconds,
+        'peak_memory': peak_memory,
+        'rules': {name: stats['time']
+                  for name, stats in profile.rules.items()},
+    }
+
+
+def run_suite(stdlib_limit=100):
+    """Return {corpus: {rule set: throughput()}}."""
+    results = {}
+    for name, corpus in corpora(stdlib_limit).items():
+        results[name] = {rule_set: throughput(corpus, rules)
+                         for rule_set, rules in RULE_SETS.items()}
+    return {
+        'python': sys.version.split()[0],
+        'critic_version': solution.CodeCritic.VERSION,
+        'results': results,
+    }
+
+
+def regressions(baseline, current, tolerance=0.1):
+    """
+       Return [(corpus, rule set, baseline, current)] of the
+       lines per second which dropped by more than tolerance.
+    """
+    found = []
+    for name, rule_sets in current['results'].items():
+        for rule_set, stats in rule_sets.items():
+            try:
+                before = baseline['results'][name][rule_set]
+            except KeyError:
+                continue
+            speed = before['lines_per_second']
+            if stats['lines_per_second'] < speed * (1 - tolerance):
+                found.append((name, rule_set, speed,
+                              stats['lines_per_second']))
+    return found
+
+
+def format_results(suite):
+    rows = ['{:<14} {:<10} {:>8} {:>12} {:>10}  {}'.format(
+        'corpus', 'rules', 'lines', 'lines/s', 'peak KiB', 'slowest rule'
+    )]
+    for name, rule_sets in suite['results'].items():
+        for rule_set, stats in rule_sets.items():
+            slowest = max(stats['rules'], key=stats['rules'].get,
+                          default='')
+            rows.append('{:<14} {:<10} {:>8} {:>12.0f} {:>10.0f}  {}'.format(
+                name, rule_set, stats['lines'], stats['lines_per_second'],
+                stats['peak_memory'] / 1024, slowest
+            ))
+    return '\n'.join(rows)
+
+
+def latency(function, repeat):
+    """Return the median wall time of function in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
+
+
+def daemon_latency(repeat=20):
+    """Compare a fresh interpreter per check against the daemon."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'module.py')
+        with open(path, 'w') as source:
+            source.write(synthetic_module())
+        cold = latency(lambda: subprocess.run(
+            [sys.executable, '-c',
+             'import solution; solution.critic_file({!r})'.format(path)],
+            cwd=here, check=True
+        ), repeat)
+
+        socket_path = os.path.join(directory, 'critic.sock')
+        server = daemon.CriticServer(socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        with daemon.CriticClient(socket_path) as client:
+            client.analyze(path)
+            warm = latency(lambda: client.analyze(path), repeat)
+
+            def save_and_analyze():
+                # Touch the file so it is re-parsed:
+                os.utime(path, ns=(time.time_ns(), time.time_ns()))
+                client.analyze(path)
+            changed = latency(save_and_analyze, repeat)
+            client.shutdown()
+        thread.join()
+        server.server_close()
+    print('{:<32} {:10.2f}ms'.format('cold interpreter', cold))
+    print('{:<32} {:10.2f}ms'.format('daemon, unchanged file', warm))
+    print('{:<32} {:10.2f}ms'.format('daemon, changed file', changed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark CodeCritic.')
+    parser.add_argument('--stdlib-limit', type=int, default=100,
+                        help='number of stdlib modules in the corpus')
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--baseline',
+                        help='JSON results to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed drop of lines/s, 0.1 for 10%%')
+    parser.add_argument('--daemon', action='store_true',
+                        help='measure the daemon latency instead')
+    arguments = parser.parse_args()
+    if arguments.daemon:
+        daemon_latency()
+        return 0
+
+    suite = run_suite(arguments.stdlib_limit)
+    print(format_results(suite))
+    if arguments.output:
+        with open(arguments.output, 'w') as output:
+            json.dump(suite, output, indent=2, sort_keys=True)
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            found = regressions(json.load(baseline), suite,
+                                arguments.tolerance)
+        for name, rule_set, before, after in found:
+            print('regression: {} with {} rules: {:.0f} -> {:.0f} lines/s'
+                  .format(name, rule_set, before, after))
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import socket
+import threading
+import socketserver
+from collections import OrderedDict
+
+import solution
+
+
+class WatchedFile:
+    """A source file kept parsed between requests."""
+    def __init__(self, path):
+        self.path = path
+        self.signature = None
+        self.critic = None
+        self.error = None
+        # Issues by rules configuration, until the file changes:
+        self.results = {}
+        # Held while the file is re-parsed or analyzed:
+        self.lock = threading.Lock()
+
+    def stat(self):
+        """Return (mtime, size) of the file or None if it is missing."""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh(self):
+        """Re-read and re-parse the file, if it changed on disk."""
+        signature = self.stat()
+        if signature is not None and signature == self.signature:
+            return False
+        self.signature = signature
+        self.critic, self.error = None, None
+        self.results = {}
+        try:
+            code = solution.read_source(self.path)
+        except solution.READ_ERRORS as error:
+            self.error = solution.read_error_issue(error)
+            return True
+        try:
+            self.critic = solution.CodeCritic(code)
+        except solution.PARSE_ERRORS as error:
+            self.error = solution.parse_error_issue(error)
+        return True
+
+    def analyze(self, rules):
+        """Return sorted list of (line, message) found with rules."""
+        if self.error is not None:
+            return [self.error]
+        key = json.dumps(rules, sort_keys=True)
+        if key not in self.results:
+            try:
+                issues = self.critic.analyze(**rules)
+            except solution.PARSE_ERRORS as error:
+                return [solution.parse_error_issue(error)]
+            self.results[key] = [(line, message)
+                                 for line in sorted(issues)
+                                 for message in sorted(issues[line])]
+        return self.results[key]
+
+
+class CriticDaemon:
+    """
+       Keeps the files it was asked about parsed and polls
+       their modification times, so that a request only pays
+       for the files changed since the previous one.
+
+       At most max_files files are kept, the least recently
+       requested ones are forgotten first. Deleted files are
+       forgotten by the poller.
+    """
+    def __init__(self, poll_interval=0.5, max_files=1024):
+        self.poll_interval = poll_interval
+        self.max_files = max_files
+        # Watched files by path, the least recently requested first:
+        self.files = OrderedDict()
+        self.stats = {'requests': 0, 'reparsed': 0}
+        # Guards files and stats; each file is re-parsed under its
+        # own lock, so requests wait only for the file they ask for:
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def analyze(self, path, rules):
+        path = os.path.abspath(path)
+        with self._lock:
+            self.stats['requests'] += 1
+            watched = self.files.get(path)
+            if watched is None:
+                watched = self.files[path] = WatchedFile(path)
+                if len(self.files) > self.max_files:
+                    self.files.popitem(last=False)
+            else:
+                self.files.move_to_end(path)
+        with watched.lock:
+            # The poller may not have seen a save made just now:
+            reparsed = watched.refresh()
+            issues = watched.analyze(rules)
+        if reparsed:
+            self.__count_reparse()
+        return issues
+
+    def poll(self):
+        """Call poll_once every poll_interval seconds until stopped."""
+        while not self._stopped.wait(self.poll_interval):
+            self.poll_once()
+
+    def poll_once(self):
+        """Re-parse the watched files which changed, forget deleted ones."""
+        with self._lock:
+            watched_files = list(self.files.values())
+        for watched in watched_files:
+            with watched.lock:
+                reparsed = watched.refresh()
+                missing = watched.signature is None
+            if missing:
+                with self._lock:
+                    if self.files.get(watched.path) is watched:
+                        del self.files[watched.path]
+            elif reparsed:
+                self.__count_reparse()
+
+    def current_stats(self):
+        with self._lock:
+            return dict(self.stats, files=len(self.files))
+
+    def __count_reparse(self):
+        with self._lock:
+            self.stats['reparsed'] += 1
+
+    def stop(self):
+        self._stopped.set()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+       Serves newline-delimited JSON requests:
+
+           {"path": ..., "rules": {...}} -> {"issues": [[line, message]]}
+           {"command": "stats"}          -> {"stats": {...}}
+           {"command": "shutdown"}       -> {"stopping": true}
+    """
+    def handle(self):
+        daemon = self.server.critic_daemon
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise TypeError('expected a JSON object')
+                command = request.get('command', 'analyze')
+                if command == 'analyze':
+                    response = {'issues': daemon.analyze(
+                        request['path'], request.get('rules', {})
+                    )}
+                elif command == 'stats':
+                    response = {'stats': daemon.current_stats()}
+                elif command == 'shutdown':
+                    response = {'stopping': True}
+                    daemon.stop()
+                    threading.Thread(target=self.server.shutdown).start()
+                else:
+                    response = {'error': 'unknown command: ' + command}
+            except (ValueError, KeyError, TypeError) as error:
+                response = {'error': 'bad request: {}'.format(error)}
+            self.wfile.write(json.dumps(response).encode() + b'\n')
+            self.wfile.flush()
+
+
+class CriticServer(socketserver.ThreadingMixIn,
+                   socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, poll_interval=0.5):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, RequestHandler)
+        self.critic_daemon = CriticDaemon(poll_interval)
+
+    def serve_forever(self, *args, **kwargs):
+        poller = threading.Thread(target=self.critic_daemon.poll, daemon=True)
+        poller.start()
+        try:
+            super().serve_forever(*args, **kwargs)
+        finally:
+            self.critic_daemon.stop()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class CriticClient:
+    """Client of a running CriticServer."""
+    def __init__(self, socket_path):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._file = self._socket.makefile('rwb')
+
+    def request(self, **request):
+        self._file.write(json.dumps(request).encode() + b'\n')
+        self._file.flush()
+        response = json.loads(self._file.readline())
+        if 'error' in response:
+            raise RuntimeError(response['error'])
+        return response
+
+    def analyze(self, path, **rules):
+        """Return dict of the issues in path, like critic()."""
+        issues = {}
+        for line, message in self.request(path=os.path.abspath(path),
+                                          rules=rules)['issues']:
+            issues.setdefault(line, set()).add(message)
+        return issues
+
+    def stats(self):
+        return self.request(command='stats')['stats']
+
+    def shutdown(self):
+        self.request(command='shutdown')
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    with CriticServer(sys.argv[1]) as server:
+        server.serve_forever()
@@ -1,6 +1,16 @@
+import io
+import os
 import re
 import ast
-from collections import defaultdict
+import json
+import bisect
+import hashlib
+import tempfile
+import tokenize
+from time import perf_counter
+from functools import partial
+from multiprocessing import Pool
+from collections import defaultdict, deque
 
 
 class CodeErrors:
@@ -41,210 +51,946 @@ class CodeErrors:
         )
 
 
+# Statements with a nested block of statements:
+BLOCK_NODES = tuple(
+    getattr(ast, name) for name in (
+        'FunctionDef', 'AsyncFunctionDef', 'ClassDef', 'For', 'AsyncFor',
+        'While', 'If', 'With', 'AsyncWith', 'Try', 'TryStar', 'ExceptHandler'
+    ) if hasattr(ast, name)
+)
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef)
+LINE_BREAK = re.compile(r'\r\n|\r|\n')
+
+
+def split_lines(code):
+    """
+       Split code into lines at the same line breaks as the
+       parser. Unlike str.splitlines, form feeds and other
+       separators do not end a line.
+    """
+    lines = LINE_BREAK.split(code)
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+class Profile:
+    """
+       Cost of the analyses made with it, aggregated per rule:
+       time spent, number of analyses the rule took part in,
+       items (lines, tokens or nodes) visited and issues found.
+       Parsing and each pass over the code are timed as well.
+    """
+    def __init__(self):
+        self.files = 0
+        self.parse_time = 0.0
+        self.passes = {'lines': 0.0, 'tokens': 0.0, 'ast': 0.0}
+        self.rules = {}
+        # Statistics of the rule being run:
+        self.current = None
+
+    def rule(self, name):
+        """Return the statistics of the rule named name."""
+        if name not in self.rules:
+            self.rules[name] = {
+                'time': 0.0, 'analyses': 0, 'visited': 0, 'issues': 0
+            }
+        return self.rules[name]
+
+    def merge(self, other):
+        """Add the statistics of other profile to this one."""
+        self.files += other.files
+        self.parse_time += other.parse_time
+        for name, time in other.passes.items():
+            self.passes[name] += time
+        for name, stats in other.rules.items():
+            totals = self.rule(name)
+            for key, value in stats.items():
+                totals[key] += value
+
+    def as_dict(self):
+        return {
+            'files': self.files,
+            'parse_time': self.parse_time,
+            'passes': dict(self.passes),
+            'rules': {name: dict(stats)
+                      for name, stats in self.rules.items()},
+        }
+
+    def format_report(self):
+        """Return text table of the rules, the slowest first."""
+        rows = ['{:<32} {:>10} {:>9} {:>10} {:>8}'.format(
+            'rule', 'time (s)', 'analyses', 'visited', 'issues'
+        )]
+        rules = sorted(self.rules.items(),
+                       key=lambda item: item[1]['time'], reverse=True)
+        for name, stats in rules:
+            rows.append('{:<32} {:>10.4f} {:>9} {:>10} {:>8}'.format(
+                name, stats['time'], stats['analyses'],
+                stats['visited'], stats['issues']
+            ))
+        rows.append('{:<32} {:>10.4f} {:>9}'.format(
+            'parse', self.parse_time, self.files
+        ))
+        for name, time in self.passes.items():
+            rows.append('{:<32} {:>10.4f}'.format(name + ' pass', time))
+        return '\n'.join(rows)
+
+
+class AnalysisContext:
+    """
+       Callbacks of the rules applied to a piece of code.
+
+       Rules subscribe to lines, tokens or AST node types and
+       run() feeds them in a single pass over each of those.
+       While rule_kind is set, only that pass can be subscribed to.
+    """
+    def __init__(self, code, lines, parsed_code, profile=None):
+        self.code = code
+        self.lines = lines
+        self.parsed_code = parsed_code
+        # Statistics of the subscribing rule, when profiling:
+        self.profile = profile
+        self.rule_stats = None
+        # Kind of the subscribing rule:
+        self.rule_kind = None
+        # Top-level statement and block nesting depth
+        # of the node being visited:
+        self.statement = None
+        self.depth = 0
+        self._line_callbacks = []
+        self._token_callbacks = []
+        self._node_callbacks = defaultdict(list)
+        self._finish_callbacks = []
+
+    def __timed(self, callback, visits=1):
+        """Wrap callback to update the rule statistics, if profiling."""
+        if self.profile is None:
+            return callback
+        profile, stats = self.profile, self.rule_stats
+
+        def timed(*args):
+            profile.current = stats
+            start = perf_counter()
+            try:
+                return callback(*args)
+            finally:
+                stats['time'] += perf_counter() - start
+                stats['visited'] += visits
+                profile.current = None
+        return timed
+
+    def __expect(self, kind):
+        if self.rule_kind is not None and self.rule_kind != kind:
+            raise ValueError('{} rule cannot subscribe to the {} pass'.format(
+                self.rule_kind, kind
+            ))
+
+    def on_line(self, callback):
+        """Call callback(line_number, line) for each line."""
+        self.__expect('lines')
+        self._line_callbacks.append(self.__timed(callback))
+
+    def on_token(self, callback):
+        """Call callback(token) for each token."""
+        self.__expect('tokens')
+        self._token_callbacks.append(self.__timed(callback))
+
+    def on_node(self, node_types, callback):
+        """Call callback(node) for each node of node_types
+           or of their subclasses.
+        """
+        self.__expect('ast')
+        callback = self.__timed(callback)
+        for node_type in node_types:
+            self._node_callbacks[node_type].append(callback)
+
+    def on_finish(self, callback):
+        """Call callback() once all the passes are done."""
+        self._finish_callbacks.append(self.__timed(callback, visits=0))
+
+    def run(self):
+        for _ in self.__passes(steps=False):
+            pass
+
+    def steps(self):
+        """
+           Run the passes like run(), yielding after each line,
+           token, node and finish callback, so that the caller can
+           inspect the issues found so far or stop the analysis.
+        """
+        return self.__passes(steps=True)
+
+    def __passes(self, steps):
+        """
+           Run the passes. With steps, yield after each callback
+           round, otherwise only once per pass.
+        """
+        if self._line_callbacks:
+            start = perf_counter()
+            for line_number, line in enumerate(self.lines, start=1):
+                for callback in self._line_callbacks:
+                    callback(line_number, line)
+                if steps:
+                    yield
+            self.__time_pass('lines', start)
+        if self._token_callbacks:
+            start = perf_counter()
+            readline = io.StringIO(self.code).readline
+            for token in tokenize.generate_tokens(readline):
+                for callback in self._token_callbacks:
+                    callback(token)
+                if steps:
+                    yield
+            self.__time_pass('tokens', start)
+        if self._node_callbacks:
+            start = perf_counter()
+            yield from self.__visit(steps)
+            self.__time_pass('ast', start)
+        for callback in self._finish_callbacks:
+            callback()
+            if steps:
+                yield
+
+    def __time_pass(self, name, start):
+        if self.profile is not None:
+            self.profile.passes[name] += perf_counter() - start
+
+    @staticmethod
+    def clauses(node):
+        """
+           Return the elif and except clauses of node. They
+           are nested in node, but their blocks are not.
+        """
+        if isinstance(node, ast.If):
+            if (len(node.orelse) == 1 and isinstance(node.orelse[0], ast.If)
+                    and node.orelse[0].col_offset == node.col_offset):
+                return node.orelse
+            return []
+        return getattr(node, 'handlers', [])
+
+    def __callbacks(self, node_type):
+        return [callback for base in node_type.__mro__
+                for callback in self._node_callbacks.get(base, ())]
+
+    def __visit(self, steps):
+        """
+           Visit the AST in pre-order, keeping track of the
+           top-level statement and the depth of each node.
+           With steps, yield after each node, otherwise
+           only once the whole tree is visited.
+        """
+        dispatch = {}
+        stack = [(statement, statement, 0) for statement
+                 in reversed(self.parsed_code.body)]
+        while stack:
+            node, self.statement, self.depth = stack.pop()
+            node_type = type(node)
+            if node_type not in dispatch:
+                dispatch[node_type] = self.__callbacks(node_type)
+            for callback in dispatch[node_type]:
+                callback(node)
+            if steps:
+                yield
+            depth = self.depth + isinstance(node, BLOCK_NODES)
+            clauses = self.clauses(node)
+            for child in reversed(list(ast.iter_child_nodes(node))):
+                child_depth = self.depth if child in clauses else depth
+                stack.append((child, self.statement, child_depth))
+        yield
+
+
+class Rule:
+    """
+       Metadata of a check: the option which enables it,
+       the default value of that option and the kind of
+       input (lines, tokens or ast) it inspects, which is
+       the only pass it may subscribe to.
+    """
+    KINDS = ('lines', 'tokens', 'ast')
+
+    def __init__(self, check, option, default, kind):
+        if kind not in self.KINDS:
+            raise ValueError('unknown rule kind: {}'.format(kind))
+        self.check = check
+        self.name = check.__name__
+        self.option = option
+        self.default = default
+        self.kind = kind
+
+    def value(self, rules):
+        """Return the option value in rules, or the default one."""
+        return rules.get(self.option, self.default)
+
+    def is_enabled(self, value):
+        """Rules are disabled by None (no limit) or False."""
+        return value is not None and value is not False
+
+
+def rule(option, default=None, kind='ast'):
+    """
+       Mark check as a rule, called with the value of option.
+       The check subscribes to the passes of the context and
+       reports issues through critic.report(line, message).
+       Only reported issues are streamed by iter_issues() and
+       counted by the profile; issues added to critic.issues
+       directly show up in the result of analyze() alone.
+
+       Marked methods of CodeCritic and its subclasses are
+       registered when the class is created, other functions
+       through CodeCritic.register.
+    """
+    def mark(check):
+        check.rule = Rule(check, option, default, kind)
+        return check
+    return mark
+
+
 class CodeCritic:
-    # Set of rules with default values
-    # that apply to the code under inspection.
-    DEFAULT_RULES = {
-        'line_length': 79,
-        'forbid_semicolons': True,
-        'max_nesting': None,
-        'indentation_size': 4,
-        'methods_per_class': None,
-        'max_arity': None,
-        'forbid_trailing_whitespace': True,
-        'max_lines_per_function': None
-    }
-
-    def __init__(self, code):
+    # Changes whenever the results of the rules change,
+    # so that cached results are not reused.
+    VERSION = 4
+    # Registered rules by check name and the
+    # default values of their options.
+    RULES = {}
+    DEFAULT_RULES = {}
+
+    def __init__(self, code, profile=None):
+        start = perf_counter()
         self.parsed_code = ast.parse(code)
+        self.profile = profile
+        if profile is not None:
+            profile.files += 1
+            profile.parse_time += perf_counter() - start
         self.code = code
+        self.lines = split_lines(code)
         # Keys are the line numbers
         # at which errors were found.
         self.issues = defaultdict(set)
+        # Issues not yet yielded by iter_issues:
+        self._pending = None
         self.code_errors = CodeErrors()
 
-    def __get_instance_methods(self):
-        """Return set of all instance methods."""
-        methods = {method for method in
-                   dir(type(self)) if
-                   callable(getattr(type(self), method)) and not
-                   method.startswith('__')}
-        # Filter out only the 'check_' methods:
-        return filter(lambda method:
-                      method.startswith('check'),
-                      methods)
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Subclasses extend a copy of the parent registry:
+        cls.RULES = dict(cls.RULES)
+        cls.DEFAULT_RULES = dict(cls.DEFAULT_RULES)
+        cls._register_marked()
+
+    @classmethod
+    def _register_marked(cls):
+        for attribute in list(vars(cls).values()):
+            if hasattr(attribute, 'rule'):
+                cls.register(attribute)
+
+    @classmethod
+    def register(cls, check):
+        """Register check, marked with the rule decorator."""
+        cls.RULES[check.rule.name] = check.rule
+        cls.DEFAULT_RULES[check.rule.option] = check.rule.default
+        return check
+
+    def enabled_rules(self, **kwargs):
+        """Return list of (rule, value) enabled by kwargs."""
+        enabled = []
+        for rule in self.RULES.values():
+            value = rule.value(kwargs)
+            if rule.is_enabled(value):
+                enabled.append((rule, value))
+        return enabled
 
     def analyze(self, **kwargs):
         """
-           Inpect the code and call all instance
-           check methods on it.
+           Inpect the code with the rules enabled
+           by kwargs and return the issues found.
         """
-        methods = self.__get_instance_methods()
-        for method in methods:
-            # Call each method:
-            getattr(type(self), method)(self, **kwargs)
+        self.__subscribe(**kwargs).run()
         return self.issues
 
-    def check_line_length(self, **kwargs):
-        """Inspect the code for too long lines."""
+    def iter_issues(self, ordered=False, max_issues=None, fail_fast=False,
+                    **kwargs):
+        """
+           Yield (line, message) for each issue as soon as it
+           is found. The analysis stops once max_issues issues
+           (one with fail_fast) were yielded.
+
+           With ordered=True the issues are yielded by line, which
+           needs the whole analysis to be done first.
+        """
+        if fail_fast:
+            max_issues = 1
+        if max_issues == 0:
+            return
+        context = self.__subscribe(**kwargs)
+        if ordered:
+            context.run()
+            issues = sorted((line, message) for line in self.issues
+                            for message in self.issues[line])
+            yield from issues[:max_issues]
+            return
+        pending = self._pending = deque()
+        steps = context.steps()
+        yielded = 0
         try:
-            default_length = kwargs['line_length']
-        except KeyError:
-            # Use the default value instead:
-            default_length = self.DEFAULT_RULES['line_length']
-        code = enumerate(self.code.splitlines(), start=1)
-        for line_number, line in code:
-            line_length = len(line)
-            if line_length > default_length:
-                self.issues[line_number].add(
-                    self.code_errors.line_too_long(line_length, default_length)
-                    )
+            for _ in steps:
+                while pending:
+                    yield pending.popleft()
+                    yielded += 1
+                    if yielded == max_issues:
+                        return
+        finally:
+            steps.close()
+            self._pending = None
+
+    def __subscribe(self, **kwargs):
+        """Return context with the rules enabled by kwargs subscribed."""
+        self.issues = defaultdict(set)
+        context = AnalysisContext(self.code, self.lines, self.parsed_code,
+                                  self.profile)
+        for rule, value in self.enabled_rules(**kwargs):
+            context.rule_kind = rule.kind
+            if self.profile is None:
+                rule.check(self, context, value)
+                continue
+            stats = context.rule_stats = self.profile.rule(rule.name)
+            stats['analyses'] += 1
+            start = perf_counter()
+            rule.check(self, context, value)
+            stats['time'] += perf_counter() - start
+        context.rule_kind = None
+        return context
+
+    def report(self, line_number, message):
+        """Add an issue found at line_number."""
+        messages = self.issues[line_number]
+        if message in messages:
+            return
+        messages.add(message)
+        if self._pending is not None:
+            self._pending.append((line_number, message))
+        if self.profile is not None and self.profile.current is not None:
+            self.profile.current['issues'] += 1
 
-    def check_has_semicolons(self, **kwargs):
+    @rule('line_length', 79, kind='lines')
+    def check_line_length(self, context, line_length):
+        """Inspect the code for too long lines."""
+        def on_line(line_number, line):
+            if len(line) > line_length:
+                self.report(
+                    line_number,
+                    self.code_errors.line_too_long(len(line), line_length)
+                )
+        context.on_line(on_line)
+
+    @rule('forbid_semicolons', True, kind='tokens')
+    def check_has_semicolons(self, context, forbid_semicolons):
         """Inspect the code for semicolon separated statements."""
-        code = enumerate(self.code.splitlines(), start=1)
-        for line_number, line in code:
-            if re.search(';', line):
-                self.issues[line_number].add(
+        def on_token(token):
+            if token.type == tokenize.OP and token.string == ';':
+                self.report(
+                    token.start[0],
                     self.code_errors.multiple_expressions()
                 )
+        context.on_token(on_token)
 
-    def check_nesting(self, **kwargs):
-        """Inspect the code for too much nested expressions."""
-        try:
-            max_nesting = kwargs['max_nesting']
-        except KeyError:
-            return
-        # Traverse the nodes and find those that are nested
-        # (have 'body' attribute).
-        nodes = [(node, node.lineno) for node
-                 in ast.walk(self.parsed_code.body[0])
-                 if hasattr(node, 'body')]
-        nesting_level = len(nodes)
-        if nesting_level > max_nesting:
-            # The line number where the error was found
-            # is the next one (thus + 1):
-            line_number = nodes[-1][1] + 1
-            self.issues[line_number].add(
-                self.code_errors.nesting_too_deep(
-                    nesting_level, max_nesting
+    @rule('max_nesting')
+    def check_nesting(self, context, max_nesting):
+        """Inspect the code for too much nested blocks."""
+        def on_node(node):
+            # The body of node is one level
+            # deeper than node itself:
+            nesting_level = context.depth + 1
+            if nesting_level > max_nesting:
+                self.report(
+                    node.body[0].lineno,
+                    self.code_errors.nesting_too_deep(
+                        nesting_level, max_nesting
+                    )
                 )
-            )
+        context.on_node(BLOCK_NODES, on_node)
 
-    def check_indentation(self, **kwargs):
+    @rule('indentation_size', 4)
+    def check_indentation(self, context, indentation_size):
         """Inspect the code for indentation size errors."""
-        try:
-            indentation_size = kwargs['indentation_size']
-        except KeyError:
-            # Use the default value instead:
-            indentation_size = self.DEFAULT_RULES['indentation_size']
-        # Traverse the nodes and find those that are nested
-        # (have 'body' attribute).
-        nodes = [node for node in ast.walk(self.parsed_code.body[0])
-                 if hasattr(node, 'body')]
-        # Use the previous line offset
-        # as a guide for the next line indentation.
-        last_offset = 0
-        for node in nodes:
-            line_number = node.body[0].lineno
-            col_offset = node.body[0].col_offset
-            if col_offset > last_offset + indentation_size:
-                offset = col_offset - last_offset
-                self.issues[line_number].add(
-                    self.code_errors.indentation(offset, indentation_size)
-                )
-            last_offset = col_offset
+        def on_node(node):
+            clauses = context.clauses(node)
+            blocks = (node.body, getattr(node, 'orelse', ()),
+                      getattr(node, 'finalbody', ()))
+            for block in blocks:
+                if not block or block is clauses:
+                    continue
+                statement = block[0]
+                line = self.lines[statement.lineno - 1]
+                # Skip blocks on the same line as their header:
+                if line[:statement.col_offset].strip():
+                    continue
+                offset = statement.col_offset - node.col_offset
+                if offset != indentation_size:
+                    self.report(
+                        statement.lineno,
+                        self.code_errors.indentation(offset, indentation_size)
+                    )
+        context.on_node(BLOCK_NODES, on_node)
 
-    def check_methods_per_class(self, **kwargs):
+    @rule('methods_per_class')
+    def check_methods_per_class(self, context, methods_per_class):
         """
            Inspect the code for too many methods per
            class.
         """
-        try:
-            methods_per_class = kwargs['methods_per_class']
-        except KeyError:
-            return
-        klass = self.parsed_code.body[0]
-        if not isinstance(klass, ast.ClassDef):
-            return
-        methods = [(node, node.lineno) for node in ast.walk(klass)
-                   if isinstance(node, ast.FunctionDef)]
-        try:
-            # Get the last method of the class
-            # and its line number:
-            line_number = methods[-1][1]
-            self.issues[line_number].add(
-                self.code_errors.too_many_methods_per_class(
-                    len(methods), methods_per_class
+        def on_node(klass):
+            methods = [node for node in klass.body
+                       if isinstance(node, FUNCTION_NODES)]
+            if len(methods) > methods_per_class:
+                # Report at the line of the last method:
+                self.report(
+                    methods[-1].lineno,
+                    self.code_errors.too_many_methods_per_class(
+                        len(methods), methods_per_class
                     )
                 )
-        except IndexError:
-            return
+        context.on_node((ast.ClassDef,), on_node)
 
-    def check_arity(self, **kwargs):
+    @rule('max_arity')
+    def check_arity(self, context, max_arity):
         """
            Inspect the code for too many arguments per
            function/method.
         """
-        try:
-            max_arity = kwargs['max_arity']
-        except KeyError:
-            return
-        node = self.parsed_code.body[0]
-        if not isinstance(node, ast.FunctionDef):
-            return
-        arity = len(node.args.args)
-        if arity > max_arity:
-            line_number = node.lineno
-            self.issues[line_number].add(
-                self.code_errors.too_many_arguments(arity, max_arity)
-            )
+        def on_node(node):
+            arguments = node.args
+            arity = (len(arguments.posonlyargs) + len(arguments.args) +
+                     len(arguments.kwonlyargs))
+            if arity > max_arity:
+                self.report(
+                    node.lineno,
+                    self.code_errors.too_many_arguments(arity, max_arity)
+                )
+        context.on_node(FUNCTION_NODES, on_node)
 
-    def check_trailing_whitespace(self, **kwargs):
+    @rule('forbid_trailing_whitespace', True, kind='lines')
+    def check_trailing_whitespace(self, context, forbid_trailing_whitespace):
         """
            Inspect the code for trailing whitespace
            at the end of the line.
         """
-        try:
-            forbid_trailing_whitespace = kwargs['forbid_trailing_whitespace']
-        except KeyError:
-            forbid_trailing_whitespace = self.DEFAULT_RULES['forbid_trailing_whitespace']
-        if not forbid_trailing_whitespace:
-            return
-        code = enumerate(self.code.splitlines(), start=1)
-        for line_number, line in code:
+        def on_line(line_number, line):
             # Check whether there are trailing
             # whitespaces at the end of the line:
-            if re.search('\s$', line):
-                self.issues[line_number].add(
+            if line[-1:].isspace():
+                self.report(
+                    line_number,
                     self.code_errors.trailing_whitespace()
                 )
+        context.on_line(on_line)
 
-    def check_lines_per_function(self, **kwargs):
+    @rule('max_lines_per_function')
+    def check_lines_per_function(self, context, max_lines_per_function):
         """
-           Inspect the code for too many lines
+           Inspect the code for too many logical lines
            per function/method.
         """
-        try:
-            max_lines = kwargs['max_lines_per_function']
-        except KeyError:
-            return
-        function_definition = self.parsed_code.body[0]
-        if not isinstance(function_definition, ast.FunctionDef):
-            return
-        code_lines = self.code.splitlines()[1:]
-        # Filter out the lines, which do
-        # not consist only of whitespaces:
-        logic_lines = len(list(filter(lambda line:
-                          line != re.search('\s+', line).group(),
-                          code_lines)))
-        if logic_lines > max_lines:
-            line_number = function_definition.lineno
-            self.issues[line_number].add(
-                self.code_errors.too_many_lines(
-                    logic_lines, max_lines)
+        # Positions of all statements, which the
+        # pre-order visit yields in source order:
+        starts = []
+        functions = []
+
+        def on_statement(node):
+            if isinstance(node, FUNCTION_NODES):
+                functions.append((node, len(starts)))
+            starts.append((node.lineno, node.col_offset))
+
+        def on_finish():
+            for node, index in functions:
+                # The statements of a function are
+                # those which start before its end:
+                end = bisect.bisect_right(
+                    starts, (node.end_lineno, node.end_col_offset)
                 )
+                logic_lines = end - index - 1
+                if logic_lines > max_lines_per_function:
+                    self.report(
+                        node.lineno,
+                        self.code_errors.too_many_lines(
+                            logic_lines, max_lines_per_function
+                        )
+                    )
+        context.on_node((ast.stmt,), on_statement)
+        context.on_finish(on_finish)
+
+
+CodeCritic._register_marked()
+
+
+class ResultCache:
+    """
+       On-disk cache of analysis results.
+
+       Entries are keyed by the hash of the code and the effective
+       rules, one file per entry. Writes go through a temporary file
+       and os.replace, so parallel workers can share the directory.
+       The least recently used entries are evicted once the cache
+       grows over max_size bytes. With pruning off, as in the copies
+       sent to worker processes, they are left to the process which
+       records the writes of the workers.
+    """
+    # Number of writes between two size checks:
+    PRUNE_INTERVAL = 64
+
+    def __init__(self, directory, max_size=64 * 1024 ** 2, pruning=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.pruning = pruning
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'writes': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(code, rules):
+        """Return the cache key of code analyzed with rules."""
+        configuration = json.dumps({
+            'version': CodeCritic.VERSION,
+            'rules': dict(CodeCritic.DEFAULT_RULES, **rules),
+        }, sort_keys=True)
+        digest = hashlib.sha256(configuration.encode())
+        digest.update(code.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the cached issues for key or None."""
+        path = self.__path(key)
+        try:
+            with open(path) as entry:
+                issues = json.load(entry)
+        except (OSError, ValueError):
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        try:
+            # Mark the entry as recently used:
+            os.utime(path)
+        except OSError:
+            pass
+        result = defaultdict(set)
+        for line, messages in issues.items():
+            result[int(line)].update(messages)
+        return result
+
+    def put(self, key, issues):
+        """Store the issues for key."""
+        directory = os.path.dirname(self.__path(key))
+        os.makedirs(directory, exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(descriptor, 'w') as entry:
+            json.dump({line: sorted(messages)
+                       for line, messages in issues.items()}, entry)
+        os.replace(temporary, self.__path(key))
+        self.record_writes(1)
+
+    def record_writes(self, count):
+        """Count writes to the directory, pruning it if it is time to."""
+        before = self.stats['writes']
+        self.stats['writes'] += count
+        if self.pruning and (before // self.PRUNE_INTERVAL !=
+                             self.stats['writes'] // self.PRUNE_INTERVAL):
+            self.prune()
+
+    def prune(self):
+        """Evict the least recently used entries over max_size."""
+        entries = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # Already evicted by another worker.
+                continue
+            total -= size
+            self.stats['evictions'] += 1
+
+
+def critic(code, cache=None, profile=None, **rules):
+    """
+       Return the issues found in code, using cache if
+       given and recording the cost of the rules in profile.
+    """
+    if cache is None:
+        return CodeCritic(code, profile).analyze(**rules)
+    key = cache.key(code, rules)
+    issues = cache.get(key)
+    if issues is None:
+        issues = CodeCritic(code, profile).analyze(**rules)
+        cache.put(key, issues)
+    return issues
+
+
+def iter_critic(code, ordered=False, max_issues=None, fail_fast=False,
+                **rules):
+    """Yield (line, message) for the issues in code as they are found."""
+    return CodeCritic(code).iter_issues(ordered, max_issues, fail_fast,
+                                        **rules)
+
+
+def to_json_lines(issues, path=None):
+    """Yield a JSON document per (line, message) in issues."""
+    for line, message in issues:
+        issue = {'line': line, 'message': message}
+        if path is not None:
+            issue['path'] = path
+        yield json.dumps(issue)
+
+
+class Block:
+    """
+       Lines start to end (inclusive) of some code and
+       the issues found in them, keyed by offset from start.
+    """
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.issues = {}
+
+    def shift(self, lines):
+        self.start += lines
+        self.end += lines
+
+
+class IncrementalCritic:
+    """
+       Keeps the issues of code per top-level block, so that
+       after an edit only the changed blocks are analyzed again.
+
+       The blocks are the top-level statements and the lines in
+       between them. Rules are assumed to look no further than a
+       top-level statement, which holds for all built-in ones, so
+       the issues are the same as those of a full analysis.
+    """
+    def __init__(self, code, **rules):
+        self.rules = rules
+        self.lines = split_lines(code)
+        self.blocks = self.__analyze(self.lines, 1)
+        # Lines of the code analyzed by the last update:
+        self.last_region = (1, len(self.lines))
+
+    @property
+    def issues(self):
+        issues = defaultdict(set)
+        for block in self.blocks:
+            for offset, messages in block.issues.items():
+                issues[block.start + offset].update(messages)
+        return issues
+
+    def update(self, code):
+        """Analyze the blocks changed in code and return all issues."""
+        old, new = self.lines, split_lines(code)
+        shortest = min(len(old), len(new))
+        prefix = 0
+        while prefix < shortest and old[prefix] == new[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < shortest - prefix and
+               old[-1 - suffix] == new[-1 - suffix]):
+            suffix += 1
+        if prefix == len(old) == len(new):
+            self.last_region = (1, 0)
+            return self.issues
+        delta = len(new) - len(old)
+        # The changed lines of the old code, with a line of context,
+        # as an edit may extend the block before or after it:
+        low, high = prefix, len(old) - suffix + 1
+        blocks = self.blocks
+        first, last = 0, len(blocks) - 1
+        while first <= last and blocks[first].end < low:
+            first += 1
+        while last >= first and blocks[last].start > high:
+            last -= 1
+        while True:
+            start, end = prefix + 1, len(old) - suffix
+            if first <= last:
+                start = min(start, blocks[first].start)
+                end = max(end, blocks[last].end)
+            try:
+                region = self.__analyze(new[start - 1:end + delta], start)
+                break
+            except PARSE_ERRORS:
+                # The edit may have joined the region with its
+                # neighbours, e.g. by opening a bracket:
+                if first <= 0 and last >= len(blocks) - 1:
+                    raise
+                first, last = max(first - 1, 0), min(last + 1,
+                                                     len(blocks) - 1)
+        for block in blocks[last + 1:]:
+            block.shift(delta)
+        self.blocks = blocks[:first] + region + blocks[last + 1:]
+        self.lines = new
+        self.last_region = (start, end + delta)
+        return self.issues
+
+    def __analyze(self, lines, start):
+        """Return the blocks of lines, the first of which is line start."""
+        critic = CodeCritic('\n'.join(lines) + '\n')
+        issues = critic.analyze(**self.rules)
+        # Spans of the top-level statements, joined
+        # when they share a line:
+        spans = []
+        for statement in critic.parsed_code.body:
+            decorators = getattr(statement, 'decorator_list', [])
+            first = min([statement.lineno] +
+                        [decorator.lineno for decorator in decorators])
+            if spans and first <= spans[-1][1]:
+                spans[-1][1] = max(spans[-1][1], statement.end_lineno)
+            else:
+                spans.append([first, statement.end_lineno])
+        blocks, line = [], 1
+        for first, last in spans:
+            if first > line:
+                blocks.append(Block(line, first - 1))
+            blocks.append(Block(first, last))
+            line = last + 1
+        if line <= len(lines):
+            blocks.append(Block(line, len(lines)))
+        starts = [block.start for block in blocks]
+        for line, messages in issues.items():
+            block = blocks[bisect.bisect_right(starts, line) - 1]
+            block.issues[line - block.start] = set(messages)
+        for block in blocks:
+            block.shift(start - 1)
+        return blocks
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def iter_source_files(paths):
+    """Yield (path, size) of the python files under paths, lazily."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path, _file_size(path)
+            continue
+        for directory, subdirectories, files in os.walk(path):
+            subdirectories.sort()
+            for name in sorted(files):
+                if name.endswith('.py'):
+                    file_path = os.path.join(directory, name)
+                    yield file_path, _file_size(file_path)
+
+
+# Errors raised when reading or analyzing a source file:
+READ_ERRORS = (OSError, SyntaxError, UnicodeDecodeError)
+PARSE_ERRORS = (SyntaxError, ValueError, tokenize.TokenError)
+
+
+def read_source(path):
+    """Return the code in path, honouring its encoding declaration."""
+    with tokenize.open(path) as source:
+        return source.read()
+
+
+def read_error_issue(error):
+    """Return (line, message) reporting a file which cannot be read."""
+    return 0, 'cannot read file: {}'.format(error)
+
+
+def parse_error_issue(error):
+    """Return (line, message) reporting code which cannot be parsed."""
+    return (getattr(error, 'lineno', None) or 0,
+            'syntax error: {}'.format(getattr(error, 'msg', error)))
+
+
+def critic_file(path, cache=None, profile=None, **rules):
+    """Return sorted list of (path, line, message) found in path.
+
+       A file which cannot be read or parsed is reported
+       as a single issue instead of raising.
+    """
+    try:
+        code = read_source(path)
+    except READ_ERRORS as error:
+        return [(path,) + read_error_issue(error)]
+    try:
+        issues = critic(code, cache, profile, **rules)
+    except PARSE_ERRORS as error:
+        return [(path,) + parse_error_issue(error)]
+    return [(path, line, message)
+            for line in sorted(issues)
+            for message in sorted(issues[line])]
+
+
+def _critic_chunk(rules, cache, profile, paths):
+    """
+       Return the issues in paths, the cache statistics
+       they added and the profile of their analysis.
+    """
+    before = dict(cache.stats) if cache else {}
+    issues = [issue for path in paths
+              for issue in critic_file(path, cache, profile, **rules)]
+    return issues, {name: cache.stats[name] - count
+                    for name, count in before.items()}, profile
+
+
+def _balanced_chunks(files, chunk_size):
+    """Group (path, size) pairs into chunks of about chunk_size bytes."""
+    chunk, total = [], 0
+    for path, size in files:
+        chunk.append(path)
+        total += size
+        if total >= chunk_size:
+            yield chunk
+            chunk, total = [], 0
+    if chunk:
+        yield chunk
+
 
+def critic_paths(paths, workers=None, chunk_size=256 * 1024, cache=None,
+                 profile=None, **rules):
+    """Yield (path, line, message) for the python files under paths.
 
-def critic(code, **rules):
-    return CodeCritic(code).analyze(**rules)
+       Files are grouped in chunks of about chunk_size bytes and
+       checked by a pool of `workers` processes. Issues are yielded
+       as soon as the chunk containing them is done. The statistics
+       and profiles of the workers are added to cache and profile.
+    """
+    chunks = _balanced_chunks(iter_source_files(paths), chunk_size)
+    workers = workers or os.cpu_count()
+    if workers == 1:
+        check_chunk = partial(_critic_chunk, rules, cache, profile)
+        for chunk in chunks:
+            yield from check_chunk(chunk)[0]
+        return
+    # Each chunk is profiled separately and merged here. The workers
+    # do not prune the cache, their writes are counted here instead:
+    worker_cache = None
+    if cache is not None:
+        worker_cache = type(cache)(cache.directory, cache.max_size,
+                                   pruning=False)
+    check_chunk = partial(_critic_chunk, rules, worker_cache,
+                          Profile() if profile is not None else None)
+    with Pool(workers) as pool:
+        for issues, stats, chunk_profile in pool.imap_unordered(check_chunk,
+                                                                 chunks):
+            writes = stats.pop('writes', 0)
+            for name, count in stats.items():
+                cache.stats[name] += count
+            if writes:
+                cache.record_writes(writes)
+            if profile is not None:
+                profile.merge(chunk_profile)
+            yield from issues
@@ -1,5 +1,10 @@
+import json
+import os
+import tempfile
+import threading
 import unittest
 import solution
+import daemon
 
 
 class TestCodeCritic(unittest.TestCase):
@@ -23,6 +28,14 @@ class TestCodeCritic(unittest.TestCase):
         self.assertSetEqual(set(issues[1]),
                             {'multiple expressions on the same line'})
 
+    def test_semicolons_in_strings_and_comments(self):
+        code = ("a = 'first; second'  # third; fourth\n"
+                "b = 5; c = 6\n")
+        issues = solution.critic(code)
+        self.assertNotIn(1, issues)
+        self.assertSetEqual(set(issues[2]),
+                            {'multiple expressions on the same line'})
+
     def test_too_deep_nesting(self):
         code = ("def some_func():\n"
                 "    a = 'something'; b = 4\n"
@@ -108,6 +121,422 @@ class TestCodeCritic(unittest.TestCase):
             'trailing whitespace'
         })
 
+    def test_whole_module(self):
+        code = ("import os\n"
+                "\n"
+                "def first(a):\n"
+                "    return a\n"
+                "\n"
+                "def second(a, b, c, d):\n"
+                "    class Inner:\n"
+                "        def one(self):\n"
+                "            pass\n"
+                "        def two(self):\n"
+                "            if self:\n"
+                "                pass\n"
+                "            elif not self:\n"
+                "                return 1\n"
+                "            else:\n"
+                "                try:\n"
+                "                    pass\n"
+                "                except ValueError:\n"
+                "                    for _ in c:\n"
+                "                       pass\n"
+                "    return Inner\n")
+        issues = solution.critic(code, max_arity=3, methods_per_class=1,
+                                 max_nesting=5, max_lines_per_function=8)
+        self.assertEqual(issues, {
+            6: {'too many arguments (4 > 3)',
+                'method with too many lines (13 > 8)'},
+            10: {'too many methods in class (2 > 1)'},
+            20: {'nesting too deep (6 > 5)',
+                 'indentation is 3 instead of 4'},
+        })
+
+    def test_default_rules(self):
+        self.assertEqual(solution.CodeCritic.DEFAULT_RULES, {
+            'line_length': 79,
+            'forbid_semicolons': True,
+            'max_nesting': None,
+            'indentation_size': 4,
+            'methods_per_class': None,
+            'max_arity': None,
+            'forbid_trailing_whitespace': True,
+            'max_lines_per_function': None
+        })
+
+    def test_disabled_rules(self):
+        code = 'a = 5; b = 6 '
+        issues = solution.critic(code, forbid_semicolons=False,
+                                 forbid_trailing_whitespace=False)
+        self.assertFalse(issues)
+        critic = solution.CodeCritic(code)
+        enabled = {rule.name for rule, _ in critic.enabled_rules(max_arity=3)}
+        self.assertEqual(enabled, {
+            'check_line_length', 'check_has_semicolons', 'check_indentation',
+            'check_trailing_whitespace', 'check_arity'
+        })
+
+    def test_third_party_rules(self):
+        class PrintCritic(solution.CodeCritic):
+            @solution.rule('forbid_print', True)
+            def check_print(self, context, forbid_print):
+                def on_node(node):
+                    if getattr(node.func, 'id', None) == 'print':
+                        self.report(node.lineno, 'print call')
+                context.on_node((solution.ast.Call,), on_node)
+
+        @PrintCritic.register
+        @solution.rule('forbid_todo', False, kind='lines')
+        def check_todo(critic, context, forbid_todo):
+            def on_line(line_number, line):
+                if 'TODO' in line:
+                    critic.report(line_number, 'todo left')
+            context.on_line(on_line)
+
+        code = ("print(1)  # TODO\n"
+                "a = 5\n")
+        self.assertEqual(PrintCritic(code).analyze(), {1: {'print call'}})
+        self.assertEqual(PrintCritic(code).analyze(forbid_todo=True),
+                         {1: {'print call', 'todo left'}})
+        self.assertIn('forbid_print', PrintCritic.DEFAULT_RULES)
+        self.assertNotIn('forbid_print', solution.CodeCritic.DEFAULT_RULES)
+        self.assertFalse(solution.critic(code))
+        self.assertEqual(list(PrintCritic(code).iter_issues()),
+                         [(1, 'print call')])
+
+    def test_rule_subscribing_to_another_pass(self):
+        class LineCritic(solution.CodeCritic):
+            @solution.rule('forbid_lines', True)
+            def check_lines(self, context, forbid_lines):
+                context.on_line(lambda line_number, line: None)
+
+        with self.assertRaisesRegex(ValueError, 'ast rule'):
+            LineCritic('a = 5\n').analyze()
+
+    def test_rules_adding_to_issues(self):
+        class PrintCritic(solution.CodeCritic):
+            @solution.rule('forbid_print', True)
+            def check_print(self, context, forbid_print):
+                def on_node(node):
+                    if getattr(node.func, 'id', None) == 'print':
+                        self.issues[node.lineno].add('print call')
+                        self.issues[node.lineno] |= {'call'}
+                context.on_node((solution.ast.Call,), on_node)
+
+        code = "print(1)\n"
+        issues = PrintCritic(code).analyze()
+        self.assertEqual(issues, {1: {'print call', 'call'}})
+        self.assertIs(type(issues[1]), set)
+        # Only the issues passed to report() are streamed:
+        self.assertEqual(list(PrintCritic(code).iter_issues()), [])
+
+    def test_form_feed_does_not_end_a_line(self):
+        code = ("a = 1\n"
+                "\x0c\n"
+                "b = 2; c = 3\n")
+        issues = solution.critic(code, forbid_trailing_whitespace=False)
+        self.assertEqual(issues, {3: {'multiple expressions on the same line'}})
+
+
+class TestIterCritic(unittest.TestCase):
+    code = ("a = 1; b = 2\n"
+            "def some_func(a, b, c, d, e, f):\n"
+            "     return a   \n"
+            "x = 3; y = 4\n")
+
+    def test_same_issues_as_critic(self):
+        issues = {}
+        for line, message in solution.iter_critic(self.code):
+            issues.setdefault(line, set()).add(message)
+        self.assertEqual(issues, solution.critic(self.code))
+
+    def test_ordered(self):
+        issues = list(solution.iter_critic(self.code, ordered=True))
+        self.assertEqual(issues, sorted(issues))
+        self.assertEqual(len(issues), 4)
+        self.assertEqual(
+            list(solution.iter_critic(self.code, ordered=True, max_issues=2)),
+            issues[:2]
+        )
+
+    def test_early_exit(self):
+        critic = solution.CodeCritic(self.code)
+        issues = list(critic.iter_issues(max_issues=2))
+        self.assertEqual(len(issues), 2)
+        # The analysis stopped as soon as the limit was reached:
+        self.assertEqual(sum(map(len, critic.issues.values())), 2)
+        # The lines pass runs before the tokens and the tree:
+        self.assertEqual(list(critic.iter_issues(fail_fast=True)),
+                         [(3, 'trailing whitespace')])
+
+    def test_json_lines(self):
+        issues = [(1, 'multiple expressions on the same line')]
+        self.assertEqual(
+            list(solution.to_json_lines(issues, path='a.py')),
+            ['{"line": 1, "message": "multiple expressions on the same line", '
+             '"path": "a.py"}']
+        )
+
+
+class TestIncrementalCritic(unittest.TestCase):
+    code = ("import os\n"
+            "\n"
+            "def first(a, b, c):\n"
+            "    return a; b\n"
+            "\n"
+            "\n"
+            "@decorator\n"
+            "def second(a):\n"
+            "    if a:\n"
+            "        if a:\n"
+            "            return 1 \n"
+            "# trailing comment \n")
+    rules = {'max_arity': 2, 'max_nesting': 2}
+
+    def assertSameAsFullRun(self, critic, code):
+        self.assertEqual(critic.update(code),
+                         solution.critic(code, **self.rules))
+
+    def test_initial_issues(self):
+        critic = solution.IncrementalCritic(self.code, **self.rules)
+        self.assertEqual(critic.issues,
+                         solution.critic(self.code, **self.rules))
+
+    def test_edit_inside_block(self):
+        critic = solution.IncrementalCritic(self.code, **self.rules)
+        code = self.code.replace('return a; b', 'return a')
+        self.assertSameAsFullRun(critic, code)
+        self.assertEqual(critic.last_region, (3, 6))
+        code = code.replace('if a:\n            return 1 ',
+                            'if a:\n            return 1')
+        self.assertSameAsFullRun(critic, code)
+        self.assertEqual(critic.last_region, (7, 12))
+        self.assertSameAsFullRun(critic, code)
+        self.assertEqual(critic.last_region, (1, 0))
+
+    def test_inserted_lines_shift_issues(self):
+        critic = solution.IncrementalCritic(self.code, **self.rules)
+        code = 'import sys\nimport re\n' + self.code
+        self.assertSameAsFullRun(critic, code)
+        self.assertEqual(critic.last_region, (1, 3))
+        self.assertSameAsFullRun(critic, code.replace('@decorator\n', ''))
+
+    def test_edit_joining_blocks(self):
+        critic = solution.IncrementalCritic(self.code, **self.rules)
+        code = self.code.replace('import os', 'x = """')
+        code = code.replace('# trailing comment ', '"""')
+        self.assertSameAsFullRun(critic, code)
+        self.assertSameAsFullRun(critic, self.code)
+        with self.assertRaises(SyntaxError):
+            critic.update(self.code.replace('import os', 'x = ('))
+        self.assertSameAsFullRun(critic, self.code + 'y = 5; z = 6\n')
+
+
+class TestProfile(unittest.TestCase):
+    code = ("def f(a, b): \n"
+            "    a = 5; b = 6\n"
+            "    return a\n")
+
+    def test_profile(self):
+        profile = solution.Profile()
+        issues = solution.critic(self.code, profile=profile, max_arity=1)
+        self.assertEqual(issues, solution.critic(self.code, max_arity=1))
+        stats = profile.as_dict()
+        self.assertEqual(stats['files'], 1)
+        self.assertNotIn('check_nesting', stats['rules'])
+        line_length = stats['rules']['check_line_length']
+        self.assertEqual(line_length['analyses'], 1)
+        self.assertEqual(line_length['visited'], 3)
+        self.assertEqual(line_length['issues'], 0)
+        self.assertEqual(stats['rules']['check_arity']['visited'], 1)
+        self.assertEqual(stats['rules']['check_arity']['issues'], 1)
+        self.assertEqual(
+            stats['rules']['check_trailing_whitespace']['issues'], 1)
+        self.assertEqual(stats['rules']['check_has_semicolons']['issues'], 1)
+        report = profile.format_report().splitlines()
+        self.assertTrue(report[0].startswith('rule'))
+        times = [float(row.split()[1]) for row in report[1:6]]
+        self.assertEqual(times, sorted(times, reverse=True))
+
+    def test_merge(self):
+        profile = solution.Profile()
+        solution.critic(self.code, profile=profile)
+        other = solution.Profile()
+        solution.critic(self.code, profile=other)
+        other.merge(profile)
+        self.assertEqual(other.files, 2)
+        self.assertEqual(other.rules['check_line_length']['visited'], 6)
+
+
+class TestResultCache(unittest.TestCase):
+    code = ("def f(): \n"
+            "    a = 5; b = 6\n")
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache = solution.ResultCache(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_hits_and_misses(self):
+        issues = solution.critic(self.code, cache=self.cache)
+        self.assertEqual(solution.critic(self.code, cache=self.cache), issues)
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+        solution.critic(self.code, cache=self.cache,
+                        forbid_trailing_whitespace=False)
+        self.assertEqual(self.cache.stats['misses'], 2)
+        # Passing the default value explicitly is the same configuration:
+        solution.critic(self.code, cache=self.cache, line_length=79)
+        self.assertEqual(self.cache.stats['hits'], 2)
+
+    def test_eviction(self):
+        self.cache.max_size = 0
+        solution.critic(self.code, cache=self.cache)
+        self.cache.prune()
+        self.assertEqual(self.cache.stats['evictions'], 1)
+        solution.critic(self.code, cache=self.cache)
+        self.assertEqual(self.cache.stats['misses'], 2)
+
+
+class TestCriticPaths(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        root = self.directory.name
+        os.mkdir(os.path.join(root, 'package'))
+        files = {
+            'good.py': b'a = 5\n',
+            'semicolons.py': b'a = 5; b = 6\n',
+            'broken.py': b'def f(:\n',
+            'latin.py': b'a = "\xff"\n',
+            'notes.txt': b'a = 5; b = 6\n',
+            os.path.join('package', 'spaces.py'): b'a = 5 \n',
+        }
+        for name, content in files.items():
+            with open(os.path.join(root, name), 'wb') as source:
+                source.write(content)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_critic_paths(self):
+        root = self.directory.name
+        expected = [
+            (os.path.join(root, 'broken.py'), 1),
+            (os.path.join(root, 'latin.py'), 0),
+            (os.path.join(root, 'package', 'spaces.py'), 1),
+            (os.path.join(root, 'semicolons.py'), 1),
+        ]
+        for workers in (1, 2):
+            issues = sorted(solution.critic_paths([root], workers=workers,
+                                                  chunk_size=1))
+            self.assertEqual([issue[:2] for issue in issues], expected)
+        self.assertEqual(issues[2][2], 'trailing whitespace')
+        self.assertTrue(issues[0][2].startswith('syntax error'))
+        self.assertTrue(issues[1][2].startswith('cannot read file'))
+
+    def test_critic_paths_with_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = solution.ResultCache(directory)
+            root = self.directory.name
+            first = sorted(solution.critic_paths([root], workers=2,
+                                                 chunk_size=1, cache=cache))
+            second = sorted(solution.critic_paths([root], workers=1,
+                                                  cache=cache))
+            self.assertEqual(first, second)
+            # The unparsable file is never cached and the
+            # unreadable one is never looked up:
+            self.assertEqual(cache.stats['misses'], 5)
+            self.assertEqual(cache.stats['hits'], 3)
+
+    def test_critic_paths_prunes_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = solution.ResultCache(directory, max_size=0)
+            cache.PRUNE_INTERVAL = 2
+            list(solution.critic_paths([self.directory.name], workers=2,
+                                       chunk_size=1, cache=cache))
+            # The writes of the workers are counted and pruned here:
+            self.assertEqual(cache.stats['writes'], 3)
+            self.assertGreater(cache.stats['evictions'], 0)
+
+    def test_critic_paths_with_profile(self):
+        for workers in (1, 2):
+            profile = solution.Profile()
+            list(solution.critic_paths([self.directory.name],
+                                       workers=workers, chunk_size=1,
+                                       profile=profile))
+            # The broken file fails parsing and is not counted:
+            self.assertEqual(profile.files, 3)
+            self.assertEqual(
+                profile.rules['check_trailing_whitespace']['issues'], 1)
+
+    def test_critic_paths_with_rules(self):
+        path = os.path.join(self.directory.name, 'package', 'spaces.py')
+        issues = solution.critic_paths([path], workers=1,
+                                       forbid_trailing_whitespace=False)
+        self.assertEqual(list(issues), [])
+
+
+class TestCriticDaemon(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'module.py')
+        with open(self.path, 'w') as source:
+            source.write('a = 5; b = 6\n')
+        socket_path = os.path.join(self.directory.name, 'critic.sock')
+        self.server = daemon.CriticServer(socket_path, poll_interval=60)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.client = daemon.CriticClient(socket_path)
+
+    def tearDown(self):
+        self.client.shutdown()
+        self.client.close()
+        self.thread.join()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def test_analyze(self):
+        expected = {1: {'multiple expressions on the same line'}}
+        self.assertEqual(self.client.analyze(self.path), expected)
+        self.assertEqual(self.client.analyze(self.path), expected)
+        self.assertEqual(self.client.analyze(self.path,
+                                             forbid_semicolons=False), {})
+        self.assertEqual(self.client.stats()['reparsed'], 1)
+        with open(self.path, 'w') as source:
+            source.write('def f(:\n')
+        issues = self.client.analyze(self.path)
+        self.assertTrue(issues[1].pop().startswith('syntax error'))
+        os.remove(self.path)
+        issues = self.client.analyze(self.path)
+        self.assertTrue(issues[0].pop().startswith('cannot read file'))
+        self.assertEqual(self.client.stats()['reparsed'], 3)
+
+    def test_request_not_an_object(self):
+        self.client._file.write(b'[1]\n')
+        self.client._file.flush()
+        response = json.loads(self.client._file.readline())
+        self.assertTrue(response['error'].startswith('bad request'))
+        self.assertEqual(self.client.stats()['requests'], 0)
+
+    def test_forgotten_files(self):
+        critic_daemon = daemon.CriticDaemon(max_files=2)
+        paths = []
+        for name in 'abc':
+            paths.append(os.path.join(self.directory.name, name + '.py'))
+            with open(paths[-1], 'w') as source:
+                source.write('a = 5\n')
+        for path in paths:
+            critic_daemon.analyze(path, {})
+        self.assertEqual(list(critic_daemon.files), paths[1:])
+        critic_daemon.analyze(paths[1], {})
+        self.assertEqual(list(critic_daemon.files), [paths[2], paths[1]])
+        os.remove(paths[2])
+        critic_daemon.poll_once()
+        self.assertEqual(list(critic_daemon.files), [paths[1]])
+
 
 if __name__ == '__main__':
     unittest.main()
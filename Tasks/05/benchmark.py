@@ -0,0 +1,189 @@
+import gc
+import os
+import sys
+import time
+import argparse
+import threading
+
+import solution
+
+
+def worker(file_system, directory, operations):
+    """Create, read and remove files in directory."""
+    for number in range(operations):
+        path = '{}/{}'.format(directory, number % 64)
+        try:
+            file_system.create(path, content='data')
+        except solution.DestinationNodeExistsError:
+            try:
+                file_system.get_node(path).append('!')
+                file_system.remove(path)
+            except solution.NodeDoesNotExistError:
+                # Removed by another thread in a shared directory:
+                pass
+
+
+def throughput(threads, operations=20000, shared=False, concurrent=True):
+    """
+       Return the operations per second done by threads, each
+       working in a directory of its own or all in a shared one.
+    """
+    file_system = solution.FileSystem(10 ** 9, concurrent=concurrent)
+    directories = []
+    for number in range(threads):
+        directory = '/shared' if shared else '/thread-{}'.format(number)
+        if directory not in directories:
+            file_system.create(directory, directory=True)
+        directories.append(directory)
+    workers = [
+        threading.Thread(target=worker, args=(
+            file_system, directory, operations // threads
+        ))
+        for directory in directories
+    ]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return operations / (time.perf_counter() - start)
+
+
+def deep_path(depth=64):
+    """Return a file system with a chain of depth directories."""
+    file_system = solution.FileSystem(10 ** 9)
+    path = ''
+    for number in range(depth):
+        path += '/d{}'.format(number)
+        file_system.create(path, directory=True)
+    return file_system, path
+
+
+def wide_directory(width=100000):
+    """Return a file system with width files in one directory."""
+    file_system = solution.FileSystem(10 ** 9)
+    file_system.apply([('create', '/wide', True)] + [
+        ('create', '/wide/f{}'.format(number)) for number in range(width)
+    ])
+    return file_system, '/wide'
+
+
+def link_chain(length=32):
+    """Return a file system reaching a directory through length links."""
+    file_system = solution.FileSystem(10 ** 9)
+    file_system.create('/real', directory=True)
+    file_system.link('/real', '/l0')
+    for number in range(1, length):
+        file_system.link('/l{}'.format(number - 1), '/l{}'.format(number))
+    return file_system, '/l{}'.format(length - 1)
+
+
+def mount_crossing(mounts=16):
+    """Return a file system with mounts nested file systems."""
+    file_system = solution.FileSystem(10 ** 9)
+    path = ''
+    for number in range(mounts):
+        path += '/m{}'.format(number)
+        file_system.create(path, directory=True)
+        file_system.mount(solution.FileSystem(10 ** 8), path)
+    return file_system, path
+
+
+WORKLOADS = {
+    'deep path': deep_path,
+    'wide directory': wide_directory,
+    'link chain': link_chain,
+    'mount crossing': mount_crossing,
+}
+
+
+def operations(file_system, directory):
+    """Return the operations to time in directory, by name."""
+    file_system.create(directory + '/file', content='content')
+    file_system.create(directory + '/sub', directory=True)
+    file = directory + '/file'
+    moved = directory + '/sub/file'
+
+    def create_remove():
+        file_system.create(directory + '/new')
+        file_system.remove(directory + '/new')
+
+    def move():
+        file_system.move(file, directory + '/sub')
+        file_system.move(moved, directory)
+
+    def link():
+        file_system.link(file, directory + '/hard', symbolic=False)
+        file_system.remove(directory + '/hard')
+
+    return {
+        'get_node': lambda: file_system.get_node(file),
+        'create+remove': create_remove,
+        'append': lambda: file_system.get_node(file).append('!'),
+        'move': move,
+        'link+remove': link,
+        'list': lambda: file_system.get_node(directory).nodes,
+        'glob': lambda: list(file_system.glob(directory + '/fil*')),
+    }
+
+
+def suite(repeat=1000):
+    """Return the microseconds per operation of each workload."""
+    results = {}
+    for workload, setup in WORKLOADS.items():
+        # Collect the cycles left by the previous workload first:
+        file_system = None
+        gc.collect()
+        file_system, directory = setup()
+        for name, operation in operations(file_system, directory).items():
+            for _ in range(repeat // 10):
+                operation()
+            start = time.perf_counter()
+            for _ in range(repeat):
+                operation()
+            results[workload, name] = \
+                (time.perf_counter() - start) / repeat * 10 ** 6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark FileSystem operations.'
+    )
+    parser.add_argument('--threads', type=int,
+                        default=max(4, os.cpu_count() or 1),
+                        help='largest number of threads to run')
+    parser.add_argument('--operations', type=int, default=20000)
+    parser.add_argument('--suite', action='store_true',
+                        help='time every operation on the workloads '
+                             'instead of the threads')
+    parser.add_argument('--repeat', type=int, default=1000,
+                        help='runs of each operation in the suite')
+    arguments = parser.parse_args()
+
+    if arguments.suite:
+        for (workload, name), microseconds in suite(
+                arguments.repeat).items():
+            print('{:<16} {:<16} {:>10.2f} us/op'.format(
+                workload, name, microseconds
+            ))
+        return 0
+
+    single = throughput(1, arguments.operations, concurrent=False)
+    print('{:<32} {:>12.0f} ops/s'.format('single-threaded, no locks',
+                                          single))
+    threads = 1
+    while threads <= arguments.threads:
+        for shared in (False, True):
+            label = '{} threads, {} directories'.format(
+                threads, 'shared' if shared else 'own'
+            )
+            print('{:<32} {:>12.0f} ops/s'.format(label, throughput(
+                threads, arguments.operations, shared
+            )))
+        threads *= 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
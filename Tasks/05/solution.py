@@ -1,37 +1,1022 @@
-class NodeDoesNotExistError(Exception):
+import os
+import re
+import json
+import gc
+import copy
+import weakref
+import fnmatch
+import struct
+import tempfile
+import threading
+from contextlib import nullcontext, ExitStack
+from mmap import mmap as MemoryMap, ACCESS_READ
+from collections import namedtuple, OrderedDict
+
+
+class FileSystemError(Exception):
+    pass
+
+
+class NodeDoesNotExistError(FileSystemError):
+    pass
+
+
+class SourceNodeDoesNotExistError(NodeDoesNotExistError):
+    pass
+
+
+class DestinationNodeDoesNotExistError(NodeDoesNotExistError):
     pass
 
 
-class DestinationNodeDoesNotExistError(Exception):
+class DestinationNotADirectoryError(FileSystemError):
     pass
 
 
-class NotEnoughSpaceError(Exception):
+class NotEnoughSpaceError(FileSystemError):
     pass
 
 
-class DestinationNodeExistError(Exception):
+class DestinationNodeExistsError(FileSystemError):
     pass
 
 
-class NonExplicitDirectoryDeletionError(Exception):
+class NonExplicitDirectoryDeletionError(FileSystemError):
     pass
 
 
-class NonEmptyDirectoryDeletionError(Exception):
+class NonEmptyDirectoryDeletionError(FileSystemError):
     pass
 
 
+class DirectoryHardLinkError(FileSystemError):
+    pass
+
+
+class LinkPathError(FileSystemError):
+    pass
+
+
+class SymbolicLinkLoopError(LinkPathError):
+    pass
+
+
+class ReadOnlyFileSystemError(FileSystemError):
+    pass
+
+
+class FileSystemMountError(FileSystemError):
+    pass
+
+
+class MountPointDoesNotExistError(FileSystemMountError):
+    pass
+
+
+class MountPointNotADirectoryError(FileSystemMountError):
+    pass
+
+
+class MountPointNotEmptyError(FileSystemMountError):
+    pass
+
+
+class NotAMountpointError(FileSystemMountError):
+    pass
+
+
+DentryCacheInfo = namedtuple(
+    'DentryCacheInfo', ['hits', 'misses', 'evictions', 'maxsize', 'currsize']
+)
+
+DedupInfo = namedtuple(
+    'DedupInfo', ['blobs', 'references', 'logical_size', 'physical_size',
+                  'saved_size']
+)
+
+
+def split_path(path):
+    """Return the components of the absolute path.
+
+    Raises:
+        NodeDoesNotExistError: If path is not absolute.
+    """
+    if not path.startswith('/'):
+        raise NodeDoesNotExistError(path)
+    return tuple(name for name in path.split('/') if name and name != '.')
+
+
+def join_path(components):
+    return '/' + '/'.join(components)
+
+
+def has_wildcards(pattern):
+    """Return whether pattern has wildcards of fnmatch."""
+    return any(character in pattern for character in '*?[')
+
+
+def _umask():
+    """Return the file mode creation mask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+class _Guard:
+    """Context manager calling acquire on enter and release on exit."""
+    __slots__ = ('_acquire', '_release')
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc_info):
+        self._release()
+
+
+class ReadWriteLock:
+    """
+    Lock held by any number of readers or by a single writer.
+    Waiting writers keep new readers out, so they do not starve.
+    Use as `with lock.reading:` or `with lock.writing:`.
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self.reading = _Guard(self.acquire_read, self.release_read)
+        self.writing = _Guard(self.acquire_write, self.release_write)
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+
+    def acquire_write(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+
+
+class NullLock:
+    """ReadWriteLock of the file systems used by a single thread."""
+    reading = writing = nullcontext()
+
+
+class Generation:
+    """
+    Version of a file system tree. A fork gets a generation of its
+    own, forked from the one of its file system, and sees the state
+    of the tree at the fork until it changes it.
+
+    The states a generation has of its own, unless it made them,
+    are kept here rather than with the shared state: they go away
+    with the generation, once nothing of its file system is left.
+    """
+    __slots__ = ('parent', 'children', 'forks', 'serial', 'states',
+                 '__weakref__')
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        # References to the live generations forked from this one,
+        # in order, and the number of forks ever taken:
+        self.children = []
+        self.forks = 0
+        # Versioned -> [state, number of forks given the state]:
+        self.states = {}
+        if parent is not None:
+            self.serial = parent.forks
+            parent.forks += 1
+            parent.children.append(weakref.ref(self, parent.__forget))
+        else:
+            self.serial = 0
+
+    def __forget(self, reference):
+        """Drop the reference to a fork which is gone."""
+        try:
+            self.children.remove(reference)
+        except ValueError:
+            pass
+
+    def forked_since(self, forks):
+        """Return the live generations forked after the first forks."""
+        children = []
+        for reference in reversed(list(self.children)):
+            child = reference()
+            if child is None:
+                continue
+            if child.serial < forks:
+                break
+            children.append(child)
+        return children
+
+
+class BlobStore:
+    """
+    Reference counted texts, keyed by their content, so that
+    equal contents of different files are kept in memory once.
+    """
+    def __init__(self, concurrent=False):
+        # text -> [the shared text, references]:
+        self._blobs = {}
+        # Reentrant, as a content dropped by the garbage collector
+        # releases its text, maybe while the store is changing:
+        self._lock = threading.RLock() if concurrent else nullcontext()
+        self.references = 0
+        self.logical_size = 0
+        self.physical_size = 0
+
+    def __len__(self):
+        return len(self._blobs)
+
+    def acquire(self, text):
+        """Return the shared text equal to text."""
+        with self._lock:
+            blob = self._blobs.get(text)
+            if blob is None:
+                blob = self._blobs[text] = [text, 0]
+                self.physical_size += len(text)
+            blob[1] += 1
+            self.references += 1
+            self.logical_size += len(text)
+            return blob[0]
+
+    def release(self, text):
+        with self._lock:
+            blob = self._blobs[text]
+            blob[1] -= 1
+            self.references -= 1
+            self.logical_size -= len(text)
+            if not blob[1]:
+                del self._blobs[text]
+                self.physical_size -= len(text)
+
+
+class Content:
+    """
+    Text shared by a file and its hard links. Appended text is
+    kept as a list of chunks, joined only when the text is read.
+    With blobs, the joined text is shared with equal contents.
+    """
+    def __init__(self, text, blobs=None):
+        self._blobs = blobs
+        # Text acquired from blobs, until the content changes:
+        self._blob = None
+        self._text = self._share(text)
+        self._chunks = [self._text]
+        self.length = len(text)
+        # Number of file objects pointing to this content:
+        self.links = 0
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = self._share(''.join(self._chunks))
+            self._chunks = [self._text]
+        return self._text
+
+    def append(self, text):
+        self.release()
+        self._chunks.append(text)
+        self._text = None
+        self.length += len(text)
+
+    def replace(self, text):
+        self.release()
+        self._text = self._share(text)
+        self._chunks = [self._text]
+        self.length = len(text)
+
+    def _share(self, text):
+        if self._blobs is None or not text:
+            return text
+        self._blob = self._blobs.acquire(text)
+        return self._blob
+
+    def release(self):
+        """Stop sharing the text with the equal contents."""
+        if self._blob is not None:
+            self._blobs.release(self._blob)
+            self._blob = None
+
+    def __del__(self):
+        # The copies of a dropped fork are released with it:
+        self.release()
+
+    def encode(self):
+        return self.text.encode()
+
+    def copy(self):
+        copied = copy.copy(self)
+        copied._chunks = list(self._chunks)
+        if self._blob is not None:
+            self._blobs.acquire(self._blob)
+        return copied
+
+
+class MappedContent(Content):
+    """Content kept in a memory-mapped image until it is read."""
+    def __init__(self, memory, offset, size, length, blobs=None):
+        # Set up without Content.__init__, which would share the
+        # empty text, as images are opened with many of these:
+        self._blobs = blobs
+        self._blob = None
+        self._memory = memory
+        self._offset = offset
+        self._size = size
+        self.length = length
+        self.links = 0
+        # Text appended before the image was read:
+        self._chunks = []
+        self._text = None
+        self._loaded = False
+
+    @property
+    def text(self):
+        if not self._loaded:
+            self._chunks.insert(0, self.__read().decode())
+            self._loaded = True
+        return super().text
+
+    def replace(self, text):
+        self._loaded = True
+        super().replace(text)
+
+    def encode(self):
+        if not self._loaded and not self._chunks:
+            return self.__read()
+        return super().encode()
+
+    def __read(self):
+        return self._memory[self._offset:self._offset + self._size]
+
+
+class Versioned:
+    """
+    State shared by the generations of a file system, copied on
+    write. A generation reads the state it inherited until it
+    changes it. Before a generation changes its state in place,
+    the generations forked from it since get copies of it, so
+    that they keep seeing the state as it was at their fork.
+
+    The state of the generation which made it is kept here, the
+    states of the other generations are kept by the generations.
+    """
+    __slots__ = ('_generation', '_entry')
+    # Guards copying the states between the generations:
+    _lock = threading.Lock()
+
+    def __init__(self, state, generation):
+        self._generation = generation
+        # [state, number of forks of the generation given the state]:
+        self._entry = [state, generation.forks]
+
+    def __entry(self, generation):
+        if generation is self._generation:
+            return self._entry
+        return generation.states.get(self)
+
+    def version(self, generation):
+        """Return the state as seen by generation."""
+        if generation is self._generation:
+            return self._entry[0]
+        entry = generation.states.get(self)
+        while entry is None:
+            generation = generation.parent
+            entry = self.__entry(generation)
+        return entry[0]
+
+    def own(self, generation):
+        """Return the state which generation may change in place."""
+        if generation is self._generation:
+            entry = self._entry
+        else:
+            entry = generation.states.get(self)
+        if entry is not None and entry[1] == generation.forks:
+            return entry[0]
+        with self._lock:
+            entry = self.__entry(generation)
+            if entry is None:
+                entry = generation.states[self] = [
+                    self.version(generation).copy(), 0
+                ]
+            state = entry[0]
+            for child in generation.forked_since(entry[1]):
+                if self.__entry(child) is None:
+                    child.states[self] = [state.copy(), 0]
+            entry[1] = generation.forks
+        return state
+
+
+class Inode(Versioned):
+    """Identity of the content of a file and its hard links."""
+    __slots__ = ()
+
+
+class Node:
+    is_directory = False
+
+    def __init__(self, name, generation):
+        self.name = name
+        self._generation = generation
+
+
+class File(Node):
+    def __init__(self, name, inode, file_system):
+        super().__init__(name, file_system._generation)
+        self._inode = inode
+        self._file_system = file_system
+
+    @property
+    def _content(self):
+        return self._inode.version(self._generation)
+
+    @property
+    def content(self):
+        return self._content.text
+
+    @property
+    def size(self):
+        return self._content.length + 1
+
+    def append(self, text):
+        file_system = self._file_system
+        # Changes of contents are accounted atomically:
+        with file_system._content_lock:
+            content = self.__writable_content()
+            file_system._allocate(len(text))
+            content.append(text)
+            if file_system._journal is not None:
+                file_system._record_content('append', self._inode, text)
+
+    def truncate(self, text):
+        file_system = self._file_system
+        with file_system._content_lock:
+            content = self.__writable_content()
+            file_system._allocate(len(text) - content.length)
+            content.replace(text)
+            if file_system._journal is not None:
+                file_system._record_content('truncate', self._inode, text)
+
+    def _copy(self, file_system):
+        return File(self.name, self._inode, file_system)
+
+    def __writable_content(self):
+        if self._file_system._read_only:
+            raise ReadOnlyFileSystemError(self.name)
+        content = self._inode.own(self._generation)
+        if not content.links:
+            # The space of the content was freed with its last link:
+            raise NodeDoesNotExistError(self.name)
+        return content
+
+
+class Directory(Node):
+    is_directory = True
+    # Set once the directory is removed from its file system:
+    _removed = False
+
+    def __init__(self, name, file_system, entry=None):
+        super().__init__(name, file_system._generation)
+        self._file_system = file_system
+        # Versions of the mapping name -> node, shared with the
+        # directories of the forks:
+        if entry is None:
+            entry = Versioned({}, self._generation)
+        self._entry = entry
+        self._lock = ReadWriteLock() if file_system._concurrent \
+            else NullLock
+        # (directories, files, nodes), built on demand and
+        # dropped by every change of the directory:
+        self._listing = None
+
+    def _copy(self, file_system):
+        """Return the directory as seen by file_system, a fork."""
+        return Directory(self.name, file_system, self._entry)
+
+    @property
+    def _nodes(self):
+        """
+        The mapping name -> node as seen by the generation of the
+        directory. The nodes inherited from the generation it was
+        forked from are translated by _child() and _children().
+        """
+        return self._entry.version(self._generation)
+
+    def _child(self, name):
+        node = self._nodes.get(name)
+        if node is None or node._generation is self._generation:
+            return node
+        return self._file_system._handle(node)
+
+    def _children(self):
+        handle = self._file_system._handle
+        generation = self._generation
+        return [node if node._generation is generation else handle(node)
+                for node in self._nodes.values()]
+
+    # The listings are shared by all readers until the directory
+    # changes, so they must not be modified:
+
+    @property
+    def directories(self):
+        return self.__listing()[0]
+
+    @property
+    def files(self):
+        return self.__listing()[1]
+
+    @property
+    def nodes(self):
+        return self.__listing()[2]
+
+    def __listing(self):
+        listing = self._listing
+        if listing is None:
+            with self._lock.reading:
+                nodes = self._children()
+                listing = self._listing = (
+                    [node for node in nodes if node.is_directory],
+                    [node for node in nodes if not node.is_directory],
+                    nodes
+                )
+        return listing
+
+    def _add(self, node):
+        """Add node, the caller holding the write lock."""
+        self._entry.own(self._generation)[node.name] = node
+        self._listing = None
+
+    def _discard(self, node):
+        """Remove node, the caller holding the write lock."""
+        del self._entry.own(self._generation)[node.name]
+        self._listing = None
+
+    @property
+    def size(self):
+        return 1
+
+    def __contains__(self, node):
+        return self._child(node.name) is node
+
+
+class SymbolicLink(Node):
+    def __init__(self, name, link_path, file_system):
+        super().__init__(name, file_system._generation)
+        self.link_path = link_path
+        self._file_system = file_system
+        # (file system, components) of the node at the end of the
+        # chain of links, until a path it was resolved through changes:
+        self._resolved = None
+        # Links whose cached targets were resolved through this one:
+        self._dependents = None
+
+    @property
+    def size(self):
+        return 1
+
+    def _copy(self, file_system):
+        return SymbolicLink(self.name, self.link_path, file_system)
+
+    def _target(self):
+        file_system, components = self._file_system._follow(self)
+        return file_system._resolve(components, LinkPathError)
+
+    def _forget_target(self):
+        """Drop the cached target of the link and of its dependents."""
+        stack = [self]
+        while stack:
+            link = stack.pop()
+            link._resolved = None
+            dependents, link._dependents = link._dependents, None
+            if dependents:
+                stack.extend(dependents)
+
+    def _add_dependent(self, link):
+        if self._dependents is None:
+            self._dependents = weakref.WeakSet()
+        self._dependents.add(link)
+
+    @property
+    def content(self):
+        return self._target().content
+
+    @property
+    def files(self):
+        return self._target().files
+
+    @property
+    def directories(self):
+        return self._target().directories
+
+    @property
+    def nodes(self):
+        return self._target().nodes
+
+
+class _Dentry:
+    """Node of the trie of the cached paths."""
+    __slots__ = ('children', 'cached', 'links')
+
+    def __init__(self):
+        self.children = {}
+        self.cached = False
+        # Symbolic links whose cached targets were resolved through
+        # the path, created on demand:
+        self.links = None
+
+
+class DentryCache:
+    """
+    Bounded LRU cache from normalized paths to nodes. The cached
+    paths are indexed by a trie of their components as well, so
+    that a subtree of the namespace is invalidated without
+    scanning the whole cache.
+    """
+    def __init__(self, maxsize=4096, concurrent=False):
+        self.maxsize = maxsize
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # path -> (node, components):
+        self._entries = OrderedDict()
+        self._root = _Dentry()
+        self._lock = threading.Lock() if concurrent else nullcontext()
+        # Changed by every invalidation, so that a path resolved
+        # before a concurrent change of the namespace is not cached:
+        self.version = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        """Return the node cached for path or None."""
+        with self._lock:
+            try:
+                entry = self._entries[path]
+            except KeyError:
+                return None
+            self._entries.move_to_end(path)
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def put(self, path, components, node, version):
+        """Cache node for path, if it was resolved at version."""
+        with self._lock:
+            if version == self.version:
+                self.__put(path, components, node)
+
+    def __put(self, path, components, node):
+        if self.maxsize <= 0:
+            return
+        self._entries[path] = node, components
+        dentry = self._root
+        for name in components:
+            dentry = dentry.children.setdefault(name, _Dentry())
+        dentry.cached = True
+        if len(self._entries) > self.maxsize:
+            evicted, (_, evicted_components) = self._entries.popitem(
+                last=False
+            )
+            self.__forget(evicted_components)
+            self.stats['evictions'] += 1
+
+    def invalidate(self, components):
+        """Drop the cached paths starting with components."""
+        with self._lock:
+            self.version += 1
+            self.__invalidate(components)
+
+    def __invalidate(self, components):
+        parent, dentry = None, self._root
+        for name in components:
+            parent, dentry = dentry, dentry.children.get(name)
+            if dentry is None:
+                return
+        stack = [(dentry, components)]
+        while stack:
+            dentry, prefix = stack.pop()
+            if dentry.cached:
+                del self._entries[join_path(prefix)]
+            if dentry.links:
+                for link in list(dentry.links):
+                    link._forget_target()
+            stack.extend((child, prefix + (name,))
+                         for name, child in dentry.children.items())
+        if parent is None:
+            self._root = _Dentry()
+        else:
+            del parent.children[components[-1]]
+
+    def watch(self, components, link, version):
+        """
+        Drop the cached target of link when the path at components
+        is invalidated. Returns False, without watching, unless the
+        path was resolved at version.
+        """
+        with self._lock:
+            if version != self.version:
+                return False
+            dentry = self._root
+            for name in components:
+                dentry = dentry.children.setdefault(name, _Dentry())
+            if dentry.links is None:
+                dentry.links = weakref.WeakSet()
+            dentry.links.add(link)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self.__forget_links(self._root)
+            self._root = _Dentry()
+
+    @staticmethod
+    def __forget_links(dentry):
+        """Drop the cached targets of the links watching the subtree."""
+        stack = [dentry]
+        while stack:
+            dentry = stack.pop()
+            if dentry.links:
+                for link in list(dentry.links):
+                    link._forget_target()
+            stack.extend(dentry.children.values())
+
+    def __forget(self, components):
+        """Unmark components in the trie, pruning emptied branches."""
+        path = [self._root]
+        for name in components:
+            path.append(path[-1].children[name])
+        path[-1].cached = False
+        for index in range(len(components), 0, -1):
+            dentry = path[index]
+            if dentry.cached or dentry.children or dentry.links:
+                break
+            del path[index - 1].children[components[index - 1]]
+
+
+class _MountPoint:
+    """Node of the trie of the mount points."""
+    __slots__ = ('children', 'file_system')
+
+    def __init__(self):
+        self.children = {}
+        self.file_system = None
+
+
+class MountTable:
+    """
+    Mounted file systems indexed by a trie of the components of
+    their mount points, so that the deepest mount point on a path
+    is found in a single walk over its components.
+    """
+    def __init__(self):
+        self._root = _MountPoint()
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        """Yield the (components, file system) pairs of the mounts."""
+        stack = [((), self._root)]
+        while stack:
+            components, point = stack.pop()
+            if point.file_system is not None:
+                yield components, point.file_system
+            stack.extend((components + (name,), child)
+                         for name, child in point.children.items())
+
+    def lookup(self, components):
+        """
+        Return the file system mounted deepest on components and
+        the number of components of its mount point, or (None, 0).
+        """
+        point = self._root
+        mounted, depth = point.file_system, 0
+        for index, name in enumerate(components, 1):
+            point = point.children.get(name)
+            if point is None:
+                break
+            if point.file_system is not None:
+                mounted, depth = point.file_system, index
+        if mounted is None:
+            return None, 0
+        return mounted, depth
+
+    def add(self, components, file_system):
+        point = self._root
+        for name in components:
+            point = point.children.setdefault(name, _MountPoint())
+        if point.file_system is None:
+            self._count += 1
+        point.file_system = file_system
+
+    def pop(self, components):
+        """Remove and return the file system mounted on components."""
+        points = [self._root]
+        for name in components:
+            point = points[-1].children.get(name)
+            if point is None:
+                return None
+            points.append(point)
+        mounted = points[-1].file_system
+        if mounted is None:
+            return None
+        points[-1].file_system = None
+        self._count -= 1
+        # Prune the branches left without mount points:
+        for index in range(len(components), 0, -1):
+            point = points[index]
+            if point.file_system is not None or point.children:
+                break
+            del points[index - 1].children[components[index - 1]]
+        return mounted
+
+    def contains(self, components):
+        """Return whether a file system is mounted on or below components."""
+        point = self._root
+        for name in components:
+            point = point.children.get(name)
+            if point is None:
+                return False
+        # Emptied branches are pruned, so any point left leads to a mount:
+        return point.file_system is not None or bool(point.children)
+
+    def copy(self):
+        copied = MountTable()
+        for components, file_system in self:
+            copied.add(components, file_system)
+        return copied
+
+
+class Journal:
+    """
+    Append-only log of the changes of a file system since its image
+    was saved, one JSON list per line. The first line holds the token
+    of the image, so that the journal of an older image, left behind
+    by a crash while saving, is not replayed onto a newer one.
+
+    Files are referred to by the ids of their inodes: the indexes of
+    their contents in the image, then the order of their creation.
+    """
+    def __init__(self, path, token, inodes=()):
+        self.path = path
+        self.token = token
+        self._ids = {}
+        self._count = 0
+        # Inodes by id, kept until logging starts, for the replay:
+        self._inodes = []
+        for inode in inodes:
+            self.identify(inode)
+        self._file = None
+
+    def identify(self, inode):
+        """Return the id of inode, giving it the next one if it has none."""
+        inode_id = self._ids.get(inode)
+        if inode_id is None:
+            inode_id = self._ids[inode] = self._count
+            self._count += 1
+            if self._inodes is not None:
+                self._inodes.append(inode)
+        return inode_id
+
+    def forget(self, inode):
+        """Drop the id of inode, whose files are all removed."""
+        self._ids.pop(inode, None)
+
+    def inode(self, inode_id):
+        return self._inodes[inode_id]
+
+    def records(self):
+        """
+        Return the records logged for the image and the length of
+        their lines, or None if there is no journal of the image.
+        A line cut short by a crash ends the records.
+        """
+        try:
+            with open(self.path, 'rb') as journal:
+                lines = journal.read().splitlines(keepends=True)
+        except FileNotFoundError:
+            return None
+        records, length = [], 0
+        for line in lines:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+            length += len(line)
+        if not records or records[0] != ['image', self.token]:
+            return None
+        return records[1:], length
+
+    def start(self, length=0):
+        """
+        Start logging after the first length bytes of the journal,
+        or into a new one.
+        """
+        if length:
+            self._file = open(self.path, 'r+b')
+            self._file.truncate(length)
+            self._file.seek(length)
+        else:
+            self._file = open(self.path, 'wb')
+            self.write(['image', self.token])
+        self._inodes = None
+
+    def write(self, record):
+        """Append record, unless the journal is being replayed."""
+        if self._file is not None:
+            self._file.write(json.dumps(record).encode() + b'\n')
+            # The record survives a crash of the process:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
 class FileSystem:
-    def __init__(self, size):
+    IMAGE_MAGIC = b'FSIMAGE2'
+    IMAGE_HEADER = struct.Struct('<8sQQQQQ')
+    IMAGE_CONTENT = struct.Struct('<QQQ')
+    IMAGE_NODE = struct.Struct('<BIIIQQ')
+    IMAGE_DIRECTORY, IMAGE_FILE, IMAGE_LINK = range(3)
+    # Links followed in a single lookup before giving up, as in Linux:
+    MAX_LINK_HOPS = 40
+    JOURNAL_SUFFIX = '.journal'
+
+    def __init__(self, size, dentry_cache_size=4096, dedup=False,
+                 concurrent=False):
         """Initialize a FileSystem object.
 
         Args:
             size: The initial file system size in bytes.
+            dentry_cache_size: Number of resolved paths to cache.
+            dedup: Whether to keep equal file contents in memory once.
+            concurrent: Whether to lock the file system for use by
+                        many threads. Each directory gets its own
+                        reader-writer lock.
         """
         self._size = size
-        self._available_size = size  # remaining size
-        self._file_system = {'/': {}}
+        self._concurrent = concurrent
+        if concurrent:
+            # Guards the space accounting and the link counts:
+            self._space_lock = threading.RLock()
+            # Guards the root, the mounts and the forks:
+            self._namespace_lock = threading.RLock()
+            # Serializes moving directories between directories,
+            # so that no move can make a directory its own child:
+            self._rename_lock = threading.Lock()
+            # Serializes the changes while they are journaled:
+            self._journal_lock = threading.RLock()
+        else:
+            self._space_lock = self._namespace_lock = \
+                self._rename_lock = self._journal_lock = nullcontext()
+        self._generation = Generation()
+        self._read_only = False
+        # Nodes of this file system by the nodes of the file system
+        # it was forked from, made when first reached:
+        self._handles = {}
+        self._root = self._directory('/')
+        self._available_size = size - self._root.size  # remaining size
+        self._mounts = MountTable()
+        self._dentries = DentryCache(dentry_cache_size, concurrent)
+        self._blobs = BlobStore(concurrent) if dedup else None
+        # Journal of the changes since the image was saved, if any,
+        # and the lock under which a change is made and logged:
+        self._journal = None
+        self._journaling = nullcontext()
+        # Taken by the changes of the contents of files:
+        self._content_lock = self._space_lock
+
+    def __check_writable(func):
+        """Decorator function that rejects changes of snapshots."""
+        def checked_func(self, *args, **kwargs):
+            if self._read_only:
+                raise ReadOnlyFileSystemError('the file system is a snapshot')
+            return func(self, *args, **kwargs)
+        return checked_func
 
     @property
     def size(self):
@@ -43,6 +1028,286 @@ class FileSystem:
         """Return remaining file system`s size in bytes."""
         return self._available_size
 
+    def save(self, path):
+        """Write an image of the file system to path.
+
+        The image holds the contents, followed by a table of the
+        contents, a table of the nodes (parents before children)
+        and the names. Mounted file systems are not saved.
+
+        From then on the changes are appended to the journal of the
+        image, path + JOURNAL_SUFFIX, which open() replays, so that
+        they survive a crash. The journal starts empty at each save.
+        Changes of mounted file systems are journaled by their own.
+        """
+        # No change is made between the image and its journal:
+        with self._journal_lock:
+            self.__save(path)
+
+    def __save(self, path):
+        nodes, contents, inodes = [], {}, []
+        stack = [(self._root, 0)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(nodes)
+            nodes.append((node, parent))
+            if node.is_directory:
+                stack.extend((child, index) for child in node._children())
+            elif isinstance(node, File):
+                content = node._inode.version(self._generation)
+                if content not in contents:
+                    contents[content] = len(contents)
+                    inodes.append(node._inode)
+        token = int.from_bytes(os.urandom(8), 'little')
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as image:
+                image.write(bytes(self.IMAGE_HEADER.size))
+                offset, table = self.IMAGE_HEADER.size, []
+                for content in contents:
+                    data = content.encode()
+                    image.write(data)
+                    table.append(self.IMAGE_CONTENT.pack(
+                        offset, len(data), content.length
+                    ))
+                    offset += len(data)
+                image.write(b''.join(table))
+                strings = bytearray()
+                for node, parent in nodes:
+                    name = node.name.encode()
+                    name_offset = len(strings)
+                    strings += name
+                    if node.is_directory:
+                        kind, data, data_size = self.IMAGE_DIRECTORY, 0, 0
+                    elif isinstance(node, File):
+                        kind, data_size = self.IMAGE_FILE, 0
+                        data = contents[
+                            node._inode.version(self._generation)
+                        ]
+                    else:
+                        link_path = node.link_path.encode()
+                        kind, data_size = self.IMAGE_LINK, len(link_path)
+                        data = len(strings)
+                        strings += link_path
+                    image.write(self.IMAGE_NODE.pack(
+                        kind, parent, name_offset, len(name), data, data_size
+                    ))
+                image.write(strings)
+                image.seek(0)
+                image.write(self.IMAGE_HEADER.pack(
+                    self.IMAGE_MAGIC, self._size, token, len(contents),
+                    len(nodes), offset
+                ))
+            # mkstemp makes the file private, give it the usual mode:
+            os.chmod(temporary, 0o666 & ~_umask())
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        if self._read_only:
+            return
+        # A crash from here on leaves the old journal, whose token
+        # no longer matches the image:
+        journal = Journal(path + self.JOURNAL_SUFFIX, token, inodes)
+        if self._journal is not None:
+            self._journal.close()
+        journal.start()
+        self.__attach(journal)
+
+    @classmethod
+    def open(cls, path, dentry_cache_size=4096, dedup=False):
+        """Return a file system restored from the image at path.
+
+        The image is memory-mapped: only the nodes are built,
+        the content of a file is decoded when it is first read.
+        The changes in the journal of the image are replayed and
+        further changes are appended to it, as after save().
+
+        Building the nodes takes time linear in their number: the
+        links of the contents and the available size are counted
+        from them, and the directories, shared with the forks, are
+        not decoded on demand. The garbage collector is paused
+        meanwhile, as by apply().
+
+        Raises:
+            ValueError: When path is not an image or its journal
+                        does not replay onto it.
+        """
+        with open(path, 'rb') as image:
+            memory = MemoryMap(image.fileno(), 0, access=ACCESS_READ)
+        magic, size, token, contents_count, nodes_count, offset = \
+            cls.IMAGE_HEADER.unpack_from(memory)
+        if magic != cls.IMAGE_MAGIC:
+            raise ValueError('{} is not a FileSystem image'.format(path))
+        file_system = cls(size, dentry_cache_size, dedup)
+        collecting = gc.isenabled()
+        if collecting:
+            gc.disable()
+        try:
+            inodes = file_system.__load(memory, size, contents_count,
+                                        nodes_count, offset)
+        finally:
+            if collecting:
+                gc.enable()
+        file_system.__resume(Journal(path + cls.JOURNAL_SUFFIX, token,
+                                     inodes))
+        return file_system
+
+    def __load(self, memory, size, contents_count, nodes_count, offset):
+        """Build the nodes of the image mapped at memory, return its inodes."""
+        inodes = []
+        for _ in range(contents_count):
+            inodes.append(Inode(MappedContent(
+                memory, *self.IMAGE_CONTENT.unpack_from(memory, offset),
+                blobs=self._blobs
+            ), self._generation))
+            offset += self.IMAGE_CONTENT.size
+        strings = offset + nodes_count * self.IMAGE_NODE.size
+
+        def string(start, length):
+            return memory[strings + start:strings + start + length].decode()
+
+        nodes = [self._root]
+        records = memoryview(memory)[offset:strings]
+        used = self._root.size
+        for kind, parent, name_offset, name_size, data, data_size \
+                in self.IMAGE_NODE.iter_unpack(records[self.IMAGE_NODE.size:]):
+            name = string(name_offset, name_size)
+            if kind == self.IMAGE_DIRECTORY:
+                node = self._directory(name)
+            elif kind == self.IMAGE_FILE:
+                node = File(name, inodes[data], self)
+                inodes[data].own(self._generation).links += 1
+            else:
+                node = SymbolicLink(name, string(data, data_size), self)
+            nodes[parent]._add(node)
+            nodes.append(node)
+            used += 1
+        records.release()
+        used += sum(inode.version(self._generation).length
+                    for inode in inodes)
+        self._available_size = size - used
+        return inodes
+
+    def __resume(self, journal):
+        """Replay the records of journal, then log to it."""
+        logged = journal.records()
+        self.__attach(journal)
+        if logged is None:
+            journal.start()
+            return
+        records, length = logged
+        for record in records:
+            try:
+                self.__replay(*record)
+            except (FileSystemError, LookupError, TypeError) as error:
+                raise ValueError('the journal {} does not replay: {!r}'.format(
+                    journal.path, error
+                )) from error
+        journal.start(length)
+
+    def __attach(self, journal):
+        self._journal = journal
+        self._journaling = self._journal_lock
+        if self._concurrent:
+            def acquire():
+                self._journal_lock.acquire()
+                self._space_lock.acquire()
+
+            def release():
+                self._space_lock.release()
+                self._journal_lock.release()
+            self._content_lock = _Guard(acquire, release)
+
+    def __replay(self, operation, *arguments):
+        """Redo a change logged in the journal."""
+        if operation in ('create', 'remove', 'move', 'apply'):
+            getattr(self, operation)(*arguments)
+        elif operation == 'link':
+            source, destination, symbolic = arguments
+            if not symbolic:
+                self.link(source, destination, symbolic=False)
+                return
+            # The source was checked when the link was made,
+            # maybe through a mount which is not there any more:
+            self.__add(split_path(destination), 1,
+                       lambda name: SymbolicLink(name, source, self))
+        elif operation in ('append', 'truncate'):
+            inode_id, text = arguments
+            content = self._journal.inode(inode_id).own(self._generation)
+            if operation == 'append':
+                self._allocate(len(text))
+                content.append(text)
+            else:
+                self._allocate(len(text) - content.length)
+                content.replace(text)
+        elif operation == 'import':
+            destination, tree = arguments
+            target = self.__directory(split_path(destination),
+                                      DestinationNodeDoesNotExistError,
+                                      DestinationNotADirectoryError)
+            root, size = self.__build(tree)
+            self._allocate(size)
+            target._add(root)
+        else:
+            raise LookupError('unknown operation {!r}'.format(operation))
+
+    def snapshot(self):
+        """Return a read-only view of the current state in O(1)."""
+        return self.__fork(read_only=True)
+
+    def clone(self):
+        """Return a writable fork of the current state in O(1).
+
+        The file system and its forks share the contents of the
+        directories and the files, each side copying one when it
+        first changes it. The nodes obtained from the file system
+        stay valid, the fork has nodes of its own, made when first
+        reached. Mounted file systems are shared.
+        """
+        return self.__fork(read_only=False)
+
+    def __fork(self, read_only):
+        fork = type(self)(self._size, self._dentries.maxsize,
+                          concurrent=self._concurrent)
+        # No content or space is changed while the fork is taken:
+        with self._namespace_lock, self._space_lock:
+            fork._generation = Generation(self._generation)
+            fork._root = fork._handle(self._root)
+            fork._available_size = self._available_size
+            fork._mounts = self._mounts.copy()
+            fork._blobs = self._blobs
+            fork._read_only = read_only
+        return fork
+
+    def dedup_info(self):
+        """Return the sizes of the file contents with and without dedup.
+
+        The sizes are in characters. Returns None unless the file
+        system was created with dedup=True. The store is shared with
+        the forks of the file system, so their contents are counted
+        too until they are dropped.
+        """
+        if self._blobs is None:
+            return None
+        blobs = self._blobs
+        return DedupInfo(
+            blobs=len(blobs),
+            references=blobs.references,
+            logical_size=blobs.logical_size,
+            physical_size=blobs.physical_size,
+            saved_size=blobs.logical_size - blobs.physical_size
+        )
+
+    def dentry_cache_info(self):
+        """Return hit, miss and eviction counters of the path cache."""
+        return DentryCacheInfo(
+            maxsize=self._dentries.maxsize,
+            currsize=len(self._dentries),
+            **self._dentries.stats
+        )
+
     def get_node(self, path):
         """Return File/Directory object found at path.
 
@@ -52,8 +1317,94 @@ class FileSystem:
         Raises:
             NodeDoesNotExistError: If no file/directory at path is found.
         """
-        pass
+        node = self._dentries.get(path)
+        if node is not None:
+            return node
+        return self._resolve(split_path(path))
+
+    def walk(self, path='/'):
+        """Yield (path, directories, files) for each directory under path.
+
+        The directories are visited top-down, as by os.walk: removing
+        a directory from the yielded list prunes its subtree. Mounted
+        file systems are walked into, symbolic links are not followed.
+
+        Raises:
+            NodeDoesNotExistError: If path does not exist.
+        """
+        file_system, relative = self._route(split_path(path))
+        directory = file_system._resolve(relative)
+        if not directory.is_directory:
+            return
+        stack = [(file_system, relative, directory, split_path(path))]
+        while stack:
+            file_system, relative, directory, components = stack.pop()
+            directories = list(directory.directories)
+            yield join_path(components), directories, list(directory.files)
+            for child in reversed(directories):
+                stack.append(file_system._descend(relative, child) +
+                             (components + (child.name,),))
+
+    def glob(self, pattern):
+        """Yield the paths matching the absolute pattern.
 
+        Each component of the pattern is matched as by fnmatch, '**'
+        matches any number of directories. Names starting with '.'
+        are matched only explicitly. Only the directories matching
+        a prefix of the pattern are listed, components without
+        wildcards are looked up directly.
+        """
+        parts = split_path(pattern)
+        matchers = [
+            part if part == '**' or not has_wildcards(part)
+            else re.compile(fnmatch.translate(part)).match
+            for part in parts
+        ]
+        file_system, relative = self._route(())
+        stack = [(file_system, relative, file_system._resolve(relative),
+                  (), 0)]
+        # Several '**' can reach the same path, a single one can not:
+        seen = set() if parts.count('**') > 1 else None
+        while stack:
+            file_system, relative, node, components, index = stack.pop()
+            if index == len(parts):
+                path = join_path(components)
+                if seen is None:
+                    yield path
+                elif path not in seen:
+                    seen.add(path)
+                    yield path
+                continue
+            matcher = matchers[index]
+            if matcher == '**':
+                if node.is_directory:
+                    stack.extend(
+                        file_system._descend(relative, child) +
+                        (components + (child.name,), index)
+                        for child in reversed(node.nodes)
+                        if not child.name.startswith('.')
+                    )
+                # Matching no more directories is tried first:
+                stack.append((file_system, relative, node, components,
+                              index + 1))
+            elif not node.is_directory:
+                continue
+            elif isinstance(matcher, str):
+                child = node._child(matcher)
+                if child is not None:
+                    stack.append(file_system._descend(relative, child) +
+                                 (components + (matcher,), index + 1))
+            else:
+                hidden = parts[index].startswith('.')
+                stack.extend(
+                    file_system._descend(relative, child) +
+                    (components + (child.name,), index + 1)
+                    for child in reversed(node.nodes)
+                    if matcher(child.name) and
+                    (hidden or not child.name.startswith('.'))
+                )
+
+    @__check_writable
     def create(self, path, directory=False, content=''):
         """Creates file or directory at the given path.
 
@@ -67,10 +1418,27 @@ class FileSystem:
                 When an attempt to create a file/directory
                 larger than the available space is made.
 
-            DestinationNodeExistError: When file/directory already exist.
+            DestinationNodeExistsError: When file/directory already exist.
         """
-        pass
+        file_system, components = self._route(split_path(path))
+        if file_system is not self:
+            return file_system.create(join_path(components),
+                                      directory, content)
+        with self._journaling:
+            if directory:
+                self.__add(components, 1, self._directory)
+            else:
+                _, node = self.__add(
+                    components, len(content) + 1, lambda name: File(
+                        name,
+                        Inode(Content(content, self._blobs), self._generation),
+                        self
+                    )
+                )
+                self.__identify(node._inode)
+            self._record('create', join_path(components), directory, content)
 
+    @__check_writable
     def remove(self, path, directory=False, force=True):
         """Deletes file/directory at path.
 
@@ -87,13 +1455,223 @@ class FileSystem:
                 When the file/directory to be deleted
                 does not exist.
         """
-        pass
+        file_system, components = self._route(split_path(path))
+        if file_system is not self:
+            return file_system.remove(join_path(components), directory, force)
+        with self._journaling:
+            _, node = self.__detach(components, directory, force)
+            # The node is detached, its subtree is released without
+            # holding the lock of the parent:
+            self.__release(node)
+            self._record('remove', join_path(components), directory, force)
+
+    @__check_writable
+    def apply(self, manifest, pause_gc=False):
+        """Apply the operations of manifest all at once or not at all.
 
+        Args:
+            manifest: Iterable of tuples of the name of an operation
+                      followed by its arguments, as for the methods:
+                      ('create', path, directory=False, content=''),
+                      ('remove', path, directory=False, force=True) or
+                      ('link', source, destination, symbolic=True).
+
+        The removals are applied first, children before parents, then
+        the creations, parents before children, and the links last.
+        The space needed is taken up front and each parent is resolved
+        once. A failed operation undoes the ones applied before it.
+
+        With pause_gc the garbage collector, which would walk the
+        growing tree again and again, is disabled meanwhile. That
+        holds for the whole process.
+
+        Raises:
+            NotEnoughSpaceError:
+                When the operations need more than the available
+                space. Nothing is changed then.
+
+            FileSystemError:
+                When a path is in a mounted file system, or any error
+                of the failed operation, after undoing the others.
+
+            ValueError:
+                When an operation is unknown or a path is removed after
+                an operation which creates or links something in it,
+                as the removal would run first. Nothing is changed then.
+        """
+        if self._journal is not None:
+            # The manifest is logged once it is applied:
+            manifest = list(manifest)
+        with self._journaling:
+            for _, node in self.__apply(manifest, pause_gc):
+                if isinstance(node, File):
+                    self.__identify(node._inode)
+            self._record('apply', manifest)
+
+    def __apply(self, manifest, pause_gc):
+        """Apply manifest, returning (parent, node) of the added nodes."""
+        removals, creations, links = [], [], []
+        # Paths of the creations and links so far and their parents:
+        used = set()
+
+        def use(components):
+            for end in range(1, len(components) + 1):
+                used.add(components[:end])
+
+        def create(path, directory=False, content=''):
+            size = 1 if directory else len(content) + 1
+            components = self.__own_path(path)
+            use(components)
+            creations.append((components, directory, content, size))
+
+        def remove(path, directory=False, force=True):
+            components = self.__own_path(path)
+            if components in used:
+                raise ValueError(
+                    'the manifest removes {} after using it'.format(path)
+                )
+            removals.append((components, directory, force))
+
+        def link(source, destination, symbolic=True):
+            components = self.__own_path(destination)
+            use(components)
+            if source.startswith('/'):
+                use(split_path(source))
+            links.append((source, components, symbolic))
+
+        operations = {'create': create, 'remove': remove, 'link': link}
+        for name, *arguments in manifest:
+            try:
+                operation = operations[name]
+            except KeyError:
+                raise ValueError('unknown operation {!r}'.format(name))
+            operation(*arguments)
+        removals.sort(key=lambda removal: len(removal[0]), reverse=True)
+        creations.sort(key=lambda creation: len(creation[0]))
+
+        needed = sum(creation[3] for creation in creations) + len(links)
+        freed = self.__removed_size(components
+                                    for components, _, _ in removals)
+        reserved = max(needed - freed, 0)
+        self._allocate(reserved)
+        # (parent, node) of the detached and of the added nodes:
+        detached, added = [], []
+        collecting = pause_gc and gc.isenabled()
+        if collecting:
+            gc.disable()
+        try:
+            for components, directory, force in removals:
+                detached.append(self.__detach(components, directory, force))
+            parents = {}
+            for components, directory, content, size in creations:
+                parent = parents.get(components[:-1])
+                if directory:
+                    make_node = self._directory
+                else:
+                    make_node = lambda name, content=content: File(
+                        name,
+                        Inode(Content(content, self._blobs), self._generation),
+                        self
+                    )
+                parent, node = self.__add(components, 0, make_node, parent)
+                parents[components[:-1]] = parent
+                if directory:
+                    parents[components] = node
+                added.append((parent, node))
+            for source, components, symbolic in links:
+                added.append(self.__link(source, components, symbolic, 0))
+        except BaseException:
+            self.__undo(detached, added)
+            with self._space_lock:
+                self._available_size += reserved
+            raise
+        finally:
+            if collecting:
+                gc.enable()
+        released = sum(self.__free(node) for _, node in detached)
+        with self._space_lock:
+            # The reservation counted on the freed space already:
+            self._available_size += released + reserved - needed
+        return added
+
+    def __own_path(self, path):
+        """Return the components of path, unless it is in a mount."""
+        file_system, components = self._route(split_path(path))
+        if file_system is not self:
+            raise FileSystemError(
+                'cannot apply a manifest to mounted {}'.format(path)
+            )
+        return components
+
+    def __removed_size(self, paths):
+        """Return the space freed by removing the nodes at paths."""
+        freed, seen, removed_links = 0, set(), {}
+        stack = [self._resolve(components) for components in paths]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            freed += 1
+            if node.is_directory:
+                stack.extend(node.nodes)
+            elif isinstance(node, File):
+                removed_links[node._inode] = \
+                    removed_links.get(node._inode, 0) + 1
+        for inode, count in removed_links.items():
+            content = inode.version(self._generation)
+            if count >= content.links:
+                freed += content.length
+        return freed
+
+    def __undo(self, detached, added):
+        """Revert the additions and then the detachments, newest first."""
+        for parent, node in reversed(added):
+            with parent._lock.writing:
+                parent._discard(node)
+            if isinstance(node, File):
+                with self._space_lock:
+                    content = node._inode.own(self._generation)
+                    content.links -= 1
+                    if not content.links:
+                        content.release()
+        for parent, node in reversed(detached):
+            with parent._lock.writing:
+                parent._add(node)
+        self._dentries.clear()
+
+    def __detach(self, components, directory, force):
+        """Detach the node at components from its parent.
+
+        Returns the parent and the node, whose space is not released.
+        """
+        path = join_path(components)
+        if not components:
+            raise FileSystemError('cannot remove the root directory')
+        parent = self.__directory(components[:-1], NodeDoesNotExistError)
+        with parent._lock.writing:
+            node = parent._child(components[-1])
+            if node is None:
+                raise NodeDoesNotExistError(path)
+            if node.is_directory:
+                if not directory:
+                    raise NonExplicitDirectoryDeletionError(path)
+                if node._nodes and not force:
+                    raise NonEmptyDirectoryDeletionError(path)
+                if self.__contains_mount(components):
+                    raise FileSystemMountError(
+                        '{} contains a mount point'.format(path)
+                    )
+            parent._discard(node)
+        self._dentries.invalidate(components)
+        return parent, node
+
+    @__check_writable
     def move(self, source, destination):
         """ Moves the file/directory from source to destination.
 
         Raises:
-            SourceDoesNotExistError:
+            SourceNodeDoesNotExistError:
                 When source does not exists in the file system.
 
             DestinationNodeDoesNotExistError:
@@ -102,12 +1680,37 @@ class FileSystem:
             DestinationNotADirectoryError:
                 When destination exists, but is not a directory.
 
-            DestinationNodeExistError:
+            DestinationNodeExistsError:
                 When destination is a directory, but already contains
                 file/directory with name of source.
         """
-        pass
+        source_system, source_components = self._route(split_path(source))
+        target_system, target_components = self._route(
+            split_path(destination)
+        )
+        if not source_components:
+            raise FileSystemError('cannot move the root directory')
+        if source_system is not target_system:
+            # Both journals are taken in the same order everywhere:
+            first, second = sorted((source_system, target_system), key=id)
+            with first._journaling, second._journaling:
+                return source_system.__transfer(
+                    source_components, target_system, target_components
+                )
+        if source_system is not self:
+            return source_system.move(join_path(source_components),
+                                      join_path(target_components))
+        with self._journaling:
+            renaming = False
+            while not self.__move(source_components, target_components,
+                                  renaming):
+                # A directory is moved, retry holding the rename lock:
+                renaming = True
+            self._dentries.invalidate(source_components)
+            self._record('move', join_path(source_components),
+                         join_path(target_components))
 
+    @__check_writable
     def link(self, source, destination, symbolic=True):
         """Creates link with path destination pointing to source.
 
@@ -116,15 +1719,29 @@ class FileSystem:
                       or hard.
 
         Raises:
-            NodeDoesNotExistsError:
+            NodeDoesNotExistError:
                 When source does not exists and symbolic=True.
 
+            DirectoryHardLinkError:
+                When source is a directory and symbolic=False.
+
             SourceNodeDoesNotExistError:
                 When an attempt to create a hard link to
                 non-existent file is made.
         """
-        pass
+        file_system, components = self._route(split_path(destination))
+        source_system, source_components = self._route(split_path(source))
+        if file_system is not self and source_system is file_system:
+            # Both paths are in the same mounted file system:
+            return file_system.link(join_path(source_components),
+                                    join_path(components), symbolic)
+        if file_system is not self:
+            raise FileSystemError('cannot link across mounted file systems')
+        with self._journaling:
+            self.__link(source, components, symbolic, 1)
+            self._record('link', source, join_path(components), symbolic)
 
+    @__check_writable
     def mount(self, file_system, path):
         """Mounts file_system to path.
 
@@ -144,8 +1761,23 @@ class FileSystem:
             MountPointDoesNotExistError:
                 When path does not exist.
         """
-        pass
+        components = split_path(path)
+        owner, relative = self._route(components)
+        if owner is not self:
+            if not relative:
+                # A file system is already mounted there:
+                raise MountPointNotEmptyError(path)
+            return owner.mount(file_system, join_path(relative))
+        node = self._resolve(components, MountPointDoesNotExistError)
+        if not node.is_directory:
+            raise MountPointNotADirectoryError(path)
+        with node._lock.writing, self._namespace_lock:
+            if node._nodes:
+                raise MountPointNotEmptyError(path)
+            self._mounts.add(components, file_system)
+        self._dentries.invalidate(components)
 
+    @__check_writable
     def unmount(self, path):
         """Unmounts mounted file system.
 
@@ -153,7 +1785,528 @@ class FileSystem:
             NodeDoesNotExistError:
                 When path does not exist.
 
-            NotAMountPointError:
+            NotAMountpointError:
                 When path does not contain mounted file system.
         """
-        pass
+        components = split_path(path)
+        with self._namespace_lock:
+            mounted = self._mounts.pop(components)
+        if mounted is not None:
+            self._dentries.invalidate(components)
+            return
+        if components:
+            # The mount point belongs to the file system of its parent:
+            file_system, relative = self._route(components[:-1])
+            if file_system is not self:
+                return file_system.unmount(
+                    join_path(relative + components[-1:])
+                )
+        self._resolve(components)
+        raise NotAMountpointError(path)
+
+    def _route(self, components):
+        """
+        Return the file system holding components and the path
+        to it relative to that file system, crossing mount points.
+        """
+        if not self._mounts:
+            return self, components
+        mounted, depth = self._mounts.lookup(components)
+        if mounted is None:
+            return self, components
+        return mounted._route(components[depth:])
+
+    def _resolve(self, components, error=NodeDoesNotExistError, hops=0,
+                 trace=None, follow=False):
+        """Return the node at components or raise error.
+
+        Symbolic links before the last component are followed, and
+        the last one too if follow is true. hops counts the links
+        followed so far, the followed links are appended to trace,
+        unless it is None.
+        """
+        path = join_path(components)
+        node = self._dentries.get(path)
+        if node is None:
+            file_system, relative = self._route(components)
+            if file_system is not self:
+                return file_system._resolve(relative, error, hops, trace,
+                                            follow)
+            node = self.__walk(components, path, error, hops, trace)
+        if follow and isinstance(node, SymbolicLink):
+            return self.__through_link(node, (), error, hops, trace, path,
+                                       follow)
+        return node
+
+    def __walk(self, components, path, error, hops, trace):
+        """Return the node at components, walking from the root."""
+        self._dentries.stats['misses'] += 1
+        version = self._dentries.version
+        # Looking a name up in a directory is a single dict access,
+        # only changing a directory takes its lock:
+        node = self._root
+        for index, name in enumerate(components):
+            if not node.is_directory:
+                if isinstance(node, SymbolicLink):
+                    # Paths through links are not cached, the
+                    # resolution restarts from the target of the link:
+                    return self.__through_link(node, components[index:],
+                                               error, hops, trace, path)
+                raise error(path)
+            child = node._child(name)
+            if child is None:
+                raise error(path)
+            node = child
+        self._dentries.put(path, components, node, version)
+        return node
+
+    def _follow(self, link, hops=0):
+        """
+        Return the file system and the components of the node at the
+        end of the chain of links starting with link, found here.
+
+        The result is cached on link, if it belongs to this file
+        system, until any path it was resolved through changes.
+
+        Raises:
+            LinkPathError: If a link of the chain points nowhere.
+            SymbolicLinkLoopError:
+                If more than MAX_LINK_HOPS links are to be followed.
+        """
+        if link._resolved is not None and link._file_system is self:
+            return link._resolved
+        # (file system, components, cache version) of resolved paths:
+        watched, trace = [], []
+        file_system, node = self, link
+        while True:
+            hops += 1
+            if hops > self.MAX_LINK_HOPS:
+                raise SymbolicLinkLoopError(link.link_path)
+            components = split_path(node.link_path)
+            watched.append(
+                (file_system, components, file_system._dentries.version)
+            )
+            file_system, components = file_system._route(components)
+            watched.append(
+                (file_system, components, file_system._dentries.version)
+            )
+            node = file_system._resolve(components, LinkPathError, hops,
+                                        trace)
+            if not isinstance(node, SymbolicLink):
+                break
+            if node._resolved is not None and \
+                    node._file_system is file_system:
+                # The rest of the chain is cached:
+                trace.append(node)
+                file_system, components = node._resolved
+                break
+        resolved = file_system, components
+        if link._file_system is self:
+            link._resolved = resolved
+            for followed in trace:
+                followed._add_dependent(link)
+            for watching, watched_components, version in watched:
+                if not watching._dentries.watch(watched_components, link,
+                                                version):
+                    # A path changed while the chain was resolved:
+                    link._forget_target()
+            if any(followed._resolved is None for followed in trace):
+                link._forget_target()
+        return resolved
+
+    def __through_link(self, link, remaining, error, hops, trace, path,
+                       follow=False):
+        """Return the node at remaining components below link."""
+        try:
+            file_system, components = self._follow(link, hops)
+        except SymbolicLinkLoopError:
+            raise
+        except LinkPathError:
+            raise error(path)
+        if trace is not None:
+            trace.append(link)
+        return file_system._resolve(components + remaining, error,
+                                    hops + 1, trace, follow)
+
+    def _descend(self, relative, child):
+        """
+        Return the file system, the relative components and the node
+        of child of the directory at relative, crossing a mount point.
+        """
+        relative = relative + (child.name,)
+        if child.is_directory and self._mounts:
+            mounted, depth = self._mounts.lookup(relative)
+            if mounted is not None and depth == len(relative):
+                file_system, relative = mounted._route(())
+                return file_system, relative, file_system._resolve(relative)
+        return self, relative, child
+
+    def _directory(self, name):
+        """Return new directory of this file system."""
+        return Directory(name, self)
+
+    def _handle(self, node):
+        """Return the node of this file system for node of a parent."""
+        handle = self._handles.get(node)
+        if handle is None:
+            handle = self._handles.setdefault(node, node._copy(self))
+        return handle
+
+    def __directory(self, components, error, not_a_directory=None):
+        """
+        Return the directory of this file system at components,
+        following links, or raise error. Raises not_a_directory,
+        if given, when something else is found there.
+        """
+        node = self._resolve(components, error, follow=True)
+        if not node.is_directory:
+            raise (not_a_directory or error)(join_path(components))
+        if node._file_system is not self:
+            raise FileSystemError('{} links to another file system'.format(
+                join_path(components)
+            ))
+        return node
+
+    def _allocate(self, size):
+        """Take size bytes of the available space."""
+        with self._space_lock:
+            if size > self._available_size:
+                raise NotEnoughSpaceError(
+                    '{} bytes requested, {} available'.format(
+                        size, self._available_size
+                    )
+                )
+            self._available_size -= size
+
+    def __add(self, components, size, make_node, parent=None):
+        """Add the node returned by make_node(name) at components.
+
+        Returns the parent, which is resolved unless given, and the node.
+        """
+        if not components:
+            raise DestinationNodeExistsError(join_path(components))
+        if parent is None:
+            parent = self.__directory(components[:-1],
+                                      DestinationNodeDoesNotExistError)
+        name = components[-1]
+        with parent._lock.writing:
+            if parent._removed:
+                raise DestinationNodeDoesNotExistError(join_path(components))
+            if name in parent._nodes:
+                raise DestinationNodeExistsError(join_path(components))
+            with self._space_lock:
+                self._allocate(size)
+                try:
+                    node = make_node(name)
+                except FileSystemError:
+                    self._available_size += size
+                    raise
+                if isinstance(node, File):
+                    node._inode.own(self._generation).links += 1
+            parent._add(node)
+        return parent, node
+
+    def __move(self, source_components, target_components, renaming):
+        """
+        Move source_components into target_components. Returns False,
+        without moving, if a directory is to be moved between two
+        directories and renaming (the rename lock is held) is False.
+        """
+        source = join_path(source_components)
+        destination = join_path(target_components)
+        with self._rename_lock if renaming else nullcontext():
+            source_parent = self.__directory(source_components[:-1],
+                                             SourceNodeDoesNotExistError)
+            target = self.__directory(target_components,
+                                      DestinationNodeDoesNotExistError,
+                                      DestinationNotADirectoryError)
+            # Lock both directories in a fixed order against deadlocks:
+            if source_parent is target:
+                first, second = target, None
+            else:
+                first, second = sorted((source_parent, target), key=id)
+            with first._lock.writing, \
+                    second._lock.writing if second else nullcontext():
+                node = source_parent._child(source_components[-1])
+                if node is None or source_parent._removed:
+                    raise SourceNodeDoesNotExistError(source)
+                if target._removed:
+                    raise DestinationNodeDoesNotExistError(destination)
+                if node.name in target._nodes:
+                    raise DestinationNodeExistsError(destination)
+                if node.is_directory:
+                    if not renaming:
+                        return False
+                    if target_components[:len(source_components)] == \
+                            source_components:
+                        raise FileSystemError(
+                            'cannot move a directory into itself'
+                        )
+                    if self.__contains_mount(source_components):
+                        raise FileSystemMountError(
+                            '{} contains a mount point'.format(source)
+                        )
+                source_parent._discard(node)
+                target._add(node)
+        return True
+
+    def __transfer(self, source_components, target_system,
+                   target_components):
+        """
+        Move source_components into the directory target_components
+        of another file system. The subtree is copied into the target
+        in a single pass, its space is taken from the target at once,
+        and then it is detached and released here, so that no path is
+        resolved per file. Symbolic links keep their paths, which are
+        resolved in the target file system from then on.
+        """
+        if target_system._read_only:
+            raise ReadOnlyFileSystemError('the file system is a snapshot')
+        source = join_path(source_components)
+        destination = join_path(target_components)
+        source_parent = self.__directory(source_components[:-1],
+                                         SourceNodeDoesNotExistError)
+        target = target_system.__directory(target_components,
+                                           DestinationNodeDoesNotExistError,
+                                           DestinationNotADirectoryError)
+        name = source_components[-1]
+        while True:
+            # The subtree is copied under the locks of all its
+            # directories. They are taken with the two parents in the
+            # same order as everywhere else, by id, against deadlocks:
+            directories = {id(directory): directory for directory in
+                           self.__directories(source_parent._child(name))}
+            directories[id(source_parent)] = source_parent
+            directories[id(target)] = target
+            with ExitStack() as stack:
+                for key in sorted(directories):
+                    stack.enter_context(directories[key]._lock.writing)
+                node = source_parent._child(name)
+                if node is None or source_parent._removed:
+                    raise SourceNodeDoesNotExistError(source)
+                if target._removed:
+                    raise DestinationNodeDoesNotExistError(destination)
+                if node.name in target._nodes:
+                    raise DestinationNodeExistsError(destination)
+                subtree = self.__directories(node, directories)
+                if subtree is None:
+                    # The subtree changed before it was locked:
+                    continue
+                if node.is_directory and \
+                        self.__contains_mount(source_components):
+                    raise FileSystemMountError(
+                        '{} contains a mount point'.format(source)
+                    )
+                copied, size, contents = target_system.__import(node)
+                try:
+                    target_system._allocate(size)
+                except NotEnoughSpaceError:
+                    for content in contents:
+                        content.release()
+                    raise
+                source_parent._discard(node)
+                target._add(copied)
+                # Nothing can be moved out of the copied subtree
+                # once its locks are released:
+                for directory in subtree:
+                    directory._removed = True
+            break
+        self._dentries.invalidate(source_components)
+        self.__release(node)
+        self._record('remove', source, True, True)
+        if target_system._journal is not None:
+            target_system._record('import', destination,
+                                  target_system.__describe(copied))
+
+    @staticmethod
+    def __directories(node, locked=None):
+        """
+        List the directories of the subtree of node, if any. With the
+        ids of the directories whose locks are held in locked, return
+        None instead if the subtree has another directory.
+        """
+        directories, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            if node is None or not node.is_directory:
+                continue
+            directories.append(node)
+            if locked is None:
+                with node._lock.reading:
+                    stack.extend(node._children())
+            elif id(node) in locked:
+                stack.extend(node._children())
+            else:
+                return None
+        return directories
+
+    def __import(self, node):
+        """
+        Return a copy of the subtree of node owned by this file system,
+        its size and the copied contents. Hard links in the subtree
+        share their copied content, like the originals. The caller
+        holds the locks of the directories of the subtree.
+        """
+        root, size, inodes = None, 0, {}
+        stack = [(node, None)]
+        while stack:
+            node, parent = stack.pop()
+            if node.is_directory:
+                copied = self._directory(node.name)
+                stack.extend((child, copied) for child in node._children())
+            elif isinstance(node, File):
+                inode = inodes.get(node._inode)
+                if inode is None:
+                    content = node._content
+                    inode = inodes[node._inode] = Inode(
+                        Content(content.text, self._blobs), self._generation
+                    )
+                    size += content.length
+                inode.own(self._generation).links += 1
+                copied = File(node.name, inode, self)
+            else:
+                copied = node._copy(self)
+            size += 1
+            if parent is None:
+                root = copied
+            else:
+                parent._add(copied)
+        contents = [inode.own(self._generation) for inode in inodes.values()]
+        return root, size, contents
+
+    def __link(self, source, components, symbolic, size):
+        """Add a link to source at components, taking size bytes.
+
+        Returns the parent and the link.
+        """
+        error = NodeDoesNotExistError if symbolic \
+            else SourceNodeDoesNotExistError
+        try:
+            node = self.get_node(source)
+        except NodeDoesNotExistError:
+            raise error(source)
+        if symbolic:
+            return self.__add(components, size,
+                              lambda name: SymbolicLink(name, source, self))
+        if isinstance(node, SymbolicLink):
+            # A hard link is made to the target of the source:
+            try:
+                node = node._target()
+            except LinkPathError:
+                raise SourceNodeDoesNotExistError(source)
+        if node.is_directory:
+            raise DirectoryHardLinkError(source)
+        if node._file_system is not self:
+            # The shared content belongs to the file system of the source:
+            raise FileSystemError('cannot link across mounted file systems')
+        return self.__add(components, size,
+                          lambda name: self.__hard_link(name, node))
+
+    def __hard_link(self, name, node):
+        if not node._inode.own(self._generation).links:
+            # The space of the content was freed with its last link:
+            raise SourceNodeDoesNotExistError(node.name)
+        return File(name, node._inode, self)
+
+    def __contains_mount(self, components):
+        with self._namespace_lock:
+            return self._mounts.contains(components)
+
+    def __release(self, node):
+        """Free the space of the detached node and its children."""
+        freed = self.__free(node)
+        with self._space_lock:
+            self._available_size += freed
+
+    def __free(self, node):
+        """
+        Mark the detached node and its children as removed and
+        return their space, without making it available.
+        """
+        freed, stack = 0, [node]
+        while stack:
+            node = stack.pop()
+            if node.is_directory:
+                # Nothing can be added to the directory from now on:
+                with node._lock.writing:
+                    node._removed = True
+                    stack.extend(node._children())
+                freed += node.size
+            elif isinstance(node, File):
+                with self._space_lock:
+                    content = node._inode.own(self._generation)
+                    content.links -= 1
+                    freed += 1
+                    if not content.links:
+                        freed += content.length
+                        content.release()
+                        if self._journal is not None:
+                            self._journal.forget(node._inode)
+            else:
+                freed += node.size
+        return freed
+
+    def _record(self, *record):
+        """Log a change made under _journaling, if journaled."""
+        if self._journal is not None:
+            self._journal.write(record)
+
+    def _record_content(self, operation, inode, text):
+        self._journal.write((operation, self._journal.identify(inode), text))
+
+    def __identify(self, inode):
+        if self._journal is not None:
+            self._journal.identify(inode)
+
+    def __describe(self, root):
+        """
+        Return the subtree of root as nested lists, in the order in
+        which __build() makes it again, identifying its inodes.
+        """
+        described, indexes = [], {}
+        stack = [(root, described)]
+        while stack:
+            node, siblings = stack.pop()
+            if node.is_directory:
+                children = []
+                siblings.append(['d', node.name, children])
+                stack.extend((child, children) for child in node._children())
+            elif isinstance(node, File):
+                index = indexes.get(node._inode)
+                if index is None:
+                    indexes[node._inode] = len(indexes)
+                    self.__identify(node._inode)
+                    siblings.append(['f', node.name, node.content])
+                else:
+                    # A hard link to a file described before:
+                    siblings.append(['h', node.name, index])
+            else:
+                siblings.append(['l', node.name, node.link_path])
+        return described[0]
+
+    def __build(self, tree):
+        """Return the subtree described by __describe() and its size."""
+        root, size, inodes = None, 0, []
+        stack = [(tree, None)]
+        while stack:
+            (kind, name, data), parent = stack.pop()
+            if kind == 'd':
+                node = self._directory(name)
+                stack.extend((entry, node) for entry in reversed(data))
+            elif kind == 'l':
+                node = SymbolicLink(name, data, self)
+            else:
+                if kind == 'f':
+                    inodes.append(Inode(Content(data, self._blobs),
+                                        self._generation))
+                    self.__identify(inodes[-1])
+                    size += len(data)
+                inode = inodes[-1] if kind == 'f' else inodes[data]
+                inode.own(self._generation).links += 1
+                node = File(name, inode, self)
+            size += 1
+            if parent is None:
+                root = node
+            else:
+                parent._add(node)
+        return root, size
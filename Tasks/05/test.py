@@ -0,0 +1,887 @@
+import gc
+import os
+import sys
+import random
+import tempfile
+import threading
+import unittest
+
+import solution
+
+
+class TestFileSystem(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(100)
+
+    def test_available_size(self):
+        fs = solution.FileSystem(22)
+        self.assertEqual(fs.size, 22)
+        self.assertEqual(fs.available_size, 21)
+        fs.create('/data', content='Nineteen characters')
+        self.assertEqual(fs.available_size, 1)
+        with self.assertRaises(solution.DestinationNodeDoesNotExistError):
+            fs.create('/home/gosho')
+        fs.create('/home', directory=True)
+        with self.assertRaises(solution.NotEnoughSpaceError):
+            fs.create('/home/gosho')
+        self.assertEqual(fs.available_size, 0)
+
+    def test_create_and_get_node(self):
+        self.fs.create('/home', directory=True)
+        home = self.fs.get_node('/home')
+        self.fs.create('/home/evstati', directory=True)
+        evstati = self.fs.get_node('/home/evstati')
+        self.assertIn(evstati, home.directories)
+        self.fs.create('/home/evstati/.vimrc', content='syntax on')
+        vimrc = self.fs.get_node('/home/evstati/.vimrc')
+        self.assertIn(vimrc, evstati)
+        self.assertNotIn(vimrc, home)
+        self.assertIn(vimrc, evstati.nodes)
+        self.assertEqual(vimrc.content, 'syntax on')
+        self.assertIs(self.fs.get_node('//home/./evstati/'), evstati)
+        with self.assertRaises(solution.DestinationNodeExistsError):
+            self.fs.create('/home/evstati')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/home/gosho')
+
+    def test_remove(self):
+        self.fs.create('/home', directory=True)
+        self.fs.create('/home/file', content='text')
+        with self.assertRaises(solution.NonExplicitDirectoryDeletionError):
+            self.fs.remove('/home')
+        with self.assertRaises(solution.NonEmptyDirectoryDeletionError):
+            self.fs.remove('/home', directory=True, force=False)
+        self.fs.remove('/home', directory=True)
+        self.assertEqual(self.fs.available_size, 99)
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.remove('/home/file')
+
+    def test_move(self):
+        self.fs.create('/home', directory=True)
+        self.fs.create('/music', directory=True)
+        self.fs.create('/home/song.mp3', content='la')
+        song = self.fs.get_node('/home/song.mp3')
+        self.fs.move('/home/song.mp3', '/music')
+        self.assertIs(self.fs.get_node('/music/song.mp3'), song)
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/home/song.mp3')
+        with self.assertRaises(solution.SourceNodeDoesNotExistError):
+            self.fs.move('/home/song.mp3', '/music')
+        with self.assertRaises(solution.DestinationNotADirectoryError):
+            self.fs.move('/home', '/music/song.mp3')
+        self.fs.create('/home/song.mp3')
+        with self.assertRaises(solution.DestinationNodeExistsError):
+            self.fs.move('/home/song.mp3', '/music')
+
+    def test_links(self):
+        fs = solution.FileSystem(32)
+        fs.create('/such_file', content='Twentyone characters.')
+        self.assertEqual(fs.available_size, 9)
+        fs.link('/such_file', '/much_file')
+        self.assertEqual(fs.available_size, 8)
+        self.assertEqual(fs.get_node('/much_file').content,
+                         'Twentyone characters.')
+        fs.link('/such_file', '/hard_file', symbolic=False)
+        self.assertEqual(fs.available_size, 7)
+        data, handle = fs.get_node('/such_file'), fs.get_node('/hard_file')
+        self.assertIsNot(data, handle)
+        data.append('!')
+        self.assertIs(data.content, handle.content)
+        fs.remove('/such_file')
+        self.assertEqual(handle.content, 'Twentyone characters.!')
+        self.assertEqual(fs.available_size, 7)
+        with self.assertRaises(solution.LinkPathError):
+            fs.get_node('/much_file').content
+        with self.assertRaises(solution.DirectoryHardLinkError):
+            fs.link('/', '/root', symbolic=False)
+        with self.assertRaises(solution.SourceNodeDoesNotExistError):
+            fs.link('/such_file', '/other', symbolic=False)
+
+    def test_hard_link_to_symbolic_link(self):
+        self.fs.create('/home', directory=True)
+        self.fs.create('/home/file', content='data')
+        self.fs.link('/home/file', '/soft')
+        self.fs.link('/home', '/soft_home')
+        self.fs.link('/soft', '/hard', symbolic=False)
+        self.fs.get_node('/hard').append('!')
+        self.assertEqual(self.fs.get_node('/home/file').content, 'data!')
+        with self.assertRaises(solution.DirectoryHardLinkError):
+            self.fs.link('/soft_home', '/other', symbolic=False)
+        self.fs.remove('/home/file')
+        with self.assertRaises(solution.SourceNodeDoesNotExistError):
+            self.fs.link('/soft', '/other', symbolic=False)
+
+    def test_append_and_truncate(self):
+        self.fs.create('/log', content='start')
+        log = self.fs.get_node('/log')
+        for number in range(10):
+            log.append(str(number))
+        self.assertEqual(log.size, 16)
+        self.assertEqual(self.fs.available_size, 83)
+        self.assertEqual(log.content, 'start0123456789')
+        self.assertIs(log.content, log.content)
+        log.truncate('end')
+        self.assertEqual(log.content, 'end')
+        self.assertEqual(self.fs.available_size, 95)
+        with self.assertRaises(solution.NotEnoughSpaceError):
+            log.append('x' * 96)
+        self.assertEqual(log.size, 4)
+
+    def test_mount(self):
+        other = solution.FileSystem(10)
+        self.fs.create('/mnt', directory=True)
+        self.fs.create('/mnt/other', directory=True)
+        self.fs.mount(other, '/mnt/other')
+        self.assertIs(self.fs.get_node('/mnt/other'), other.get_node('/'))
+        self.fs.create('/mnt/other/file', content='1234')
+        self.assertEqual(other.available_size, 4)
+        self.assertIs(self.fs.get_node('/mnt/other/file'),
+                      other.get_node('/file'))
+        with self.assertRaises(solution.MountPointNotEmptyError):
+            self.fs.mount(solution.FileSystem(10), '/mnt')
+        with self.assertRaises(solution.MountPointDoesNotExistError):
+            self.fs.mount(solution.FileSystem(10), '/media')
+        self.fs.unmount('/mnt/other')
+        self.assertEqual(self.fs.get_node('/mnt/other').nodes, [])
+        with self.assertRaises(solution.NotAMountpointError):
+            self.fs.unmount('/mnt/other')
+
+
+class TestMounts(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(100)
+        self.usb = solution.FileSystem(50)
+        self.card = solution.FileSystem(20)
+        self.fs.create('/mnt', directory=True)
+        self.fs.create('/mnt/usb', directory=True)
+        self.fs.mount(self.usb, '/mnt/usb')
+        self.fs.create('/mnt/usb/card', directory=True)
+        self.fs.mount(self.card, '/mnt/usb/card')
+
+    def test_nested_routing(self):
+        self.fs.create('/mnt/usb/card/photo', content='12345')
+        self.assertIs(self.fs.get_node('/mnt/usb/card/photo'),
+                      self.card.get_node('/photo'))
+        self.assertIs(self.usb.get_node('/card/photo'),
+                      self.card.get_node('/photo'))
+        self.assertEqual(self.card.available_size, 13)
+        self.assertEqual(self.usb.available_size, 48)
+        self.assertEqual(self.fs.available_size, 97)
+        self.fs.unmount('/mnt/usb/card')
+        self.assertEqual(self.fs.get_node('/mnt/usb/card').nodes, [])
+
+    def test_move_across_mounts(self):
+        self.fs.create('/docs', directory=True)
+        self.fs.create('/docs/a', content='aaaa')
+        self.fs.link('/docs/a', '/docs/b', symbolic=False)
+        self.fs.link('/docs/a', '/docs/c')
+        self.fs.move('/docs', '/mnt/usb')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/docs')
+        self.assertEqual(self.fs.available_size, 97)
+        # A directory, two hard links sharing 4 bytes and a symbolic link:
+        self.assertEqual(self.usb.available_size, 49 - 1 - 1 - 5 - 1 - 1)
+        self.usb.get_node('/docs/a').append('!')
+        self.assertEqual(self.usb.get_node('/docs/b').content, 'aaaa!')
+        self.assertEqual(self.usb.get_node('/docs/c').link_path, '/docs/a')
+
+    def test_move_across_mounts_without_space(self):
+        self.fs.create('/big', content='x' * 30)
+        with self.assertRaises(solution.NotEnoughSpaceError):
+            self.fs.move('/big', '/mnt/usb/card')
+        self.assertEqual(self.fs.get_node('/big').size, 31)
+        self.assertEqual(self.card.available_size, 19)
+        self.fs.move('/big', '/mnt/usb')
+        self.assertEqual(self.fs.available_size, 97)
+        self.assertEqual(self.usb.available_size, 17)
+
+    def test_move_mount_point_across_mounts(self):
+        self.fs.create('/empty', directory=True)
+        with self.assertRaises(solution.FileSystemMountError):
+            self.fs.move('/mnt', '/empty')
+        with self.assertRaises(solution.FileSystemError):
+            self.fs.move('/mnt/usb', '/empty')
+
+    def test_links_in_mounted_file_system(self):
+        self.fs.create('/mnt/usb/a', content='a')
+        self.fs.link('/mnt/usb/a', '/mnt/usb/b', symbolic=False)
+        self.fs.link('/mnt/usb/a', '/mnt/usb/c')
+        self.assertEqual(self.usb.get_node('/b').content, 'a')
+        self.assertEqual(self.usb.get_node('/c').content, 'a')
+        with self.assertRaises(solution.FileSystemError):
+            self.fs.link('/mnt/usb/a', '/d', symbolic=False)
+
+
+class TestApply(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(100, dedup=True)
+        self.fs.create('/etc', directory=True)
+        self.fs.create('/etc/passwd', content='root')
+
+    def test_parents_before_children(self):
+        self.fs.apply([
+            ('create', '/home/user/.vimrc', False, 'syntax on'),
+            ('link', '/home/user/.vimrc', '/vimrc', False),
+            ('create', '/home/user', True),
+            ('create', '/home', True),
+            ('remove', '/etc/passwd'),
+            ('remove', '/etc', True),
+        ])
+        self.assertEqual(self.fs.get_node('/vimrc').content, 'syntax on')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/etc')
+        self.assertEqual(self.fs.available_size, 99 - 2 - 10 - 1)
+
+    def test_not_enough_space(self):
+        with self.assertRaises(solution.NotEnoughSpaceError):
+            self.fs.apply([('create', '/a', False, 'a' * 50),
+                           ('create', '/b', False, 'b' * 50)])
+        self.assertEqual(self.fs.available_size, 93)
+        self.assertEqual(self.fs.get_node('/').nodes,
+                         [self.fs.get_node('/etc')])
+
+    def test_removals_free_space_for_creations(self):
+        self.fs.create('/big', content='x' * 80)
+        self.fs.apply([('remove', '/big'),
+                       ('create', '/bigger', False, 'y' * 85)])
+        self.assertEqual(self.fs.available_size, 7)
+
+    def test_rollback(self):
+        self.fs.apply([('remove', '/etc/passwd'),
+                       ('create', '/etc/passwd', False, 'root:x'),
+                       ('create', '/etc/hosts', False, 'localhost')])
+        self.assertEqual(self.fs.get_node('/etc/passwd').content, 'root:x')
+        available = self.fs.available_size
+        dedup = self.fs.dedup_info()
+        passwd = self.fs.get_node('/etc/passwd')
+        with self.assertRaises(solution.DestinationNodeExistsError):
+            self.fs.apply([('remove', '/etc/hosts'),
+                           ('create', '/tmp', True),
+                           ('create', '/tmp/log', False, 'log'),
+                           ('link', '/tmp/log', '/etc/passwd', False)])
+        self.assertEqual(self.fs.available_size, available)
+        self.assertEqual(self.fs.dedup_info(), dedup)
+        self.assertIs(self.fs.get_node('/etc/passwd'), passwd)
+        self.assertEqual(self.fs.get_node('/etc/hosts').content, 'localhost')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/tmp')
+
+    def test_unknown_operation(self):
+        with self.assertRaises(ValueError):
+            self.fs.apply([('chmod', '/etc')])
+
+    def test_removal_after_use(self):
+        available = self.fs.available_size
+        for manifest in ([('create', '/q'), ('remove', '/q')],
+                         [('create', '/etc/hosts'),
+                          ('remove', '/etc', True)],
+                         [('link', '/etc/passwd', '/p'),
+                          ('remove', '/etc/passwd')]):
+            with self.assertRaises(ValueError):
+                self.fs.apply(manifest)
+        self.assertEqual(self.fs.available_size, available)
+        self.assertEqual(self.fs.get_node('/').nodes,
+                         [self.fs.get_node('/etc')])
+        # Replacing a path keeps working:
+        self.fs.apply([('remove', '/etc/passwd'),
+                       ('create', '/etc/passwd', False, 'root:x')])
+        self.assertEqual(self.fs.get_node('/etc/passwd').content, 'root:x')
+
+    def test_garbage_collector(self):
+        self.addCleanup(gc.enable)
+        self.fs.apply([('create', '/a')])
+        self.assertTrue(gc.isenabled())
+        self.fs.apply([('create', '/b')], pause_gc=True)
+        self.assertTrue(gc.isenabled())
+        gc.disable()
+        self.fs.apply([('create', '/c')], pause_gc=True)
+        self.assertFalse(gc.isenabled())
+
+
+class TestWalkAndGlob(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(1000)
+        self.usb = solution.FileSystem(100)
+        for path in ['/home', '/home/a', '/home/b', '/mnt', '/mnt/usb']:
+            self.fs.create(path, directory=True)
+        self.fs.create('/home/a/.vimrc', content='syntax on')
+        self.fs.create('/home/a/notes.txt', content='a')
+        self.fs.create('/home/b/todo.txt', content='b')
+        self.fs.mount(self.usb, '/mnt/usb')
+        self.usb.create('/backup.txt', content='usb')
+
+    def test_listings_follow_changes(self):
+        home = self.fs.get_node('/home')
+        self.assertIs(home.nodes, home.nodes)
+        self.fs.create('/home/c', directory=True)
+        self.assertEqual([node.name for node in home.directories],
+                         ['a', 'b', 'c'])
+        self.fs.move('/home/a/notes.txt', '/home')
+        self.assertEqual([node.name for node in home.files], ['notes.txt'])
+        self.assertNotIn(self.fs.get_node('/home/notes.txt'),
+                         self.fs.get_node('/home/a').nodes)
+        self.fs.remove('/home/c', directory=True)
+        self.assertEqual(len(home.nodes), 3)
+
+    def test_walk(self):
+        walked = [(path, [node.name for node in directories],
+                   [node.name for node in files])
+                  for path, directories, files in self.fs.walk('/')]
+        self.assertEqual(walked, [
+            ('/', ['home', 'mnt'], []),
+            ('/home', ['a', 'b'], []),
+            ('/home/a', [], ['.vimrc', 'notes.txt']),
+            ('/home/b', [], ['todo.txt']),
+            ('/mnt', ['usb'], []),
+            ('/mnt/usb', [], ['backup.txt']),
+        ])
+
+    def test_walk_pruning(self):
+        paths = []
+        for path, directories, files in self.fs.walk('/'):
+            paths.append(path)
+            directories[:] = [node for node in directories
+                              if node.name != 'home']
+        self.assertEqual(paths, ['/', '/mnt', '/mnt/usb'])
+        self.assertEqual(len(self.fs.get_node('/').directories), 2)
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            list(self.fs.walk('/nothing'))
+
+    def test_glob(self):
+        self.assertEqual(list(self.fs.glob('/home/*/*.txt')),
+                         ['/home/a/notes.txt', '/home/b/todo.txt'])
+        self.assertEqual(list(self.fs.glob('/home/*/.*')),
+                         ['/home/a/.vimrc'])
+        self.assertEqual(list(self.fs.glob('/**/*.txt')),
+                         ['/home/a/notes.txt', '/home/b/todo.txt',
+                          '/mnt/usb/backup.txt'])
+        self.assertEqual(list(self.fs.glob('/**/**/*.txt')),
+                         list(self.fs.glob('/**/*.txt')))
+        self.assertEqual(list(self.fs.glob('/home/[ab]')),
+                         ['/home/a', '/home/b'])
+        self.assertEqual(list(self.fs.glob('/home/a/notes.txt/*')), [])
+        self.assertEqual(list(self.fs.glob('/etc/*')), [])
+
+
+class TestSymbolicLinks(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(1000)
+        for path in ['/a', '/b', '/a/sub', '/b/sub']:
+            self.fs.create(path, directory=True)
+        self.fs.create('/a/sub/file', content='a')
+        self.fs.create('/b/sub/file', content='b')
+
+    def test_links_are_followed_in_paths(self):
+        self.fs.link('/a', '/l0')
+        for number in range(1, 10):
+            self.fs.link('/l{}'.format(number - 1), '/l{}'.format(number))
+        self.assertEqual(self.fs.get_node('/l9/sub/file').content, 'a')
+        self.fs.create('/l9/sub/new', content='new')
+        self.assertEqual(self.fs.get_node('/a/sub/new').content, 'new')
+        self.fs.move('/l9/sub/new', '/l5')
+        self.assertEqual(self.fs.get_node('/a/new').content, 'new')
+        self.fs.remove('/l9/new')
+        self.assertEqual(len(self.fs.get_node('/l9').nodes), 1)
+
+    def test_cached_targets_follow_changes(self):
+        self.fs.link('/a', '/l0')
+        self.fs.link('/l0', '/l1')
+        self.fs.link('/l1/sub', '/l2')
+        self.assertEqual(self.fs.get_node('/l2/file').content, 'a')
+        self.fs.remove('/l0')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/l2/file')
+        with self.assertRaises(solution.LinkPathError):
+            self.fs.get_node('/l2').content
+        self.fs.link('/b', '/l0')
+        self.assertEqual(self.fs.get_node('/l2/file').content, 'b')
+        self.fs.move('/b/sub/file', '/a')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/l2/file')
+
+    def test_loops(self):
+        self.fs.link('/a', '/x')
+        self.fs.link('/a', '/y')
+        self.fs.remove('/x')
+        self.fs.link('/y', '/x')
+        self.fs.remove('/y')
+        self.fs.link('/x', '/y')
+        with self.assertRaises(solution.SymbolicLinkLoopError):
+            self.fs.get_node('/x').content
+        with self.assertRaises(solution.SymbolicLinkLoopError):
+            self.fs.get_node('/y/sub')
+        self.assertTrue(issubclass(solution.SymbolicLinkLoopError,
+                                   solution.LinkPathError))
+        self.fs.link('/a', '/a/self')
+        self.assertEqual(self.fs.get_node('/a/self/self/sub/file').content,
+                         'a')
+
+    def test_links_into_mounted_file_systems(self):
+        usb = solution.FileSystem(100)
+        self.fs.create('/mnt', directory=True)
+        self.fs.mount(usb, '/mnt')
+        usb.create('/docs', directory=True)
+        usb.create('/docs/readme', content='usb')
+        self.fs.link('/mnt/docs', '/docs')
+        self.assertEqual(self.fs.get_node('/docs/readme').content, 'usb')
+        with self.assertRaises(solution.FileSystemError):
+            self.fs.create('/docs/new')
+        self.fs.unmount('/mnt')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/docs/readme')
+
+
+class TestImage(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'image')
+        self.fs = solution.FileSystem(100)
+        self.fs.create('/home', directory=True)
+        self.fs.create('/home/notes', content='кирилица')
+        self.fs.link('/home/notes', '/hard', symbolic=False)
+        self.fs.link('/home', '/soft')
+        self.fs.create('/empty', directory=True)
+        self.fs.save(self.path)
+
+    def test_open(self):
+        fs = solution.FileSystem.open(self.path)
+        self.assertEqual(fs.size, 100)
+        self.assertEqual(fs.available_size, self.fs.available_size)
+        notes = fs.get_node('/home/notes')
+        self.assertEqual(notes.content, 'кирилица')
+        self.assertIs(notes.content, fs.get_node('/hard').content)
+        self.assertEqual(fs.get_node('/soft').link_path, '/home')
+        self.assertEqual(fs.get_node('/soft').files, [notes])
+        self.assertEqual(fs.get_node('/empty').nodes, [])
+
+    def test_image_mode(self):
+        umask = os.umask(0o022)
+        os.umask(umask)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o666 & ~umask)
+
+    def test_changes_after_open(self):
+        fs = solution.FileSystem.open(self.path)
+        fs.get_node('/hard').append('!')
+        fs.create('/home/new', content='new')
+        self.assertEqual(fs.get_node('/home/notes').content, 'кирилица!')
+        fs.save(self.path)
+        fs = solution.FileSystem.open(self.path)
+        self.assertEqual(fs.get_node('/home/notes').size, 10)
+        self.assertEqual(fs.get_node('/home/new').content, 'new')
+        self.assertEqual(fs.available_size, self.fs.available_size - 5)
+
+    def test_journal_replay(self):
+        fs = solution.FileSystem.open(self.path)
+        handle = fs.get_node('/hard')
+        fs.create('/home/new', content='new')
+        fs.get_node('/home/new').append('er')
+        handle.append('!')
+        fs.move('/home/new', '/empty')
+        fs.link('/empty/new', '/empty/again', symbolic=False)
+        fs.link('/home/notes', '/dangling')
+        fs.remove('/home/notes')
+        fs.remove('/soft')
+        fs.apply([('create', '/docs', True), ('create', '/docs/a', False, 'a'),
+                  ('link', '/docs/a', '/docs/b', False)])
+        fs.get_node('/docs/b').truncate('bb')
+        handle.truncate('кир')
+        # Reopened without saving, as after a crash:
+        reopened = solution.FileSystem.open(self.path)
+        self.assertEqual(reopened.get_node('/hard').content, 'кир')
+        self.assertEqual(reopened.get_node('/empty/again').content, 'newer')
+        self.assertIs(reopened.get_node('/empty/again').content,
+                      reopened.get_node('/empty/new').content)
+        self.assertEqual(reopened.get_node('/docs/a').content, 'bb')
+        self.assertEqual(reopened.get_node('/dangling').link_path,
+                         '/home/notes')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            reopened.get_node('/soft')
+        self.assertEqual(reopened.available_size, fs.available_size)
+        # Changes after the replay are appended to the journal:
+        reopened.get_node('/docs/a').append('!')
+        reopened = solution.FileSystem.open(self.path)
+        self.assertEqual(reopened.get_node('/docs/b').content, 'bb!')
+
+    def test_save_compacts_journal(self):
+        def records():
+            with open(self.path + solution.FileSystem.JOURNAL_SUFFIX) as file:
+                return len(file.readlines()) - 1
+
+        self.assertEqual(records(), 0)
+        fs = solution.FileSystem.open(self.path)
+        for _ in range(10):
+            fs.get_node('/hard').append('!')
+        self.assertEqual(records(), 10)
+        fs.save(self.path)
+        self.assertEqual(records(), 0)
+        fs = solution.FileSystem.open(self.path)
+        self.assertEqual(fs.get_node('/home/notes').content,
+                         'кирилица' + '!' * 10)
+
+    def test_journal_of_older_image(self):
+        journal = self.path + solution.FileSystem.JOURNAL_SUFFIX
+        fs = solution.FileSystem.open(self.path)
+        fs.create('/old', directory=True)
+        with open(journal, 'rb') as file:
+            old = file.read()
+        fs.save(self.path)
+        # As if the save crashed before starting the new journal:
+        with open(journal, 'wb') as file:
+            file.write(old)
+        fs = solution.FileSystem.open(self.path)
+        self.assertEqual(fs.get_node('/old').nodes, [])
+
+    def test_record_cut_short(self):
+        journal = self.path + solution.FileSystem.JOURNAL_SUFFIX
+        fs = solution.FileSystem.open(self.path)
+        fs.create('/kept', directory=True)
+        with open(journal, 'ab') as file:
+            file.write(b'["create", "/lost"')
+        fs = solution.FileSystem.open(self.path)
+        fs.create('/after', directory=True)
+        fs = solution.FileSystem.open(self.path)
+        self.assertEqual(
+            sorted(node.name for node in fs.get_node('/').directories),
+            ['after', 'empty', 'home', 'kept']
+        )
+
+    def test_move_between_journaled_file_systems(self):
+        usb_path = self.path + '-usb'
+        usb = solution.FileSystem(50)
+        usb.save(usb_path)
+        fs = solution.FileSystem.open(self.path)
+        fs.create('/mnt', directory=True)
+        fs.mount(usb, '/mnt')
+        fs.move('/home', '/mnt')
+        usb.get_node('/home/notes').append('!')
+        usb = solution.FileSystem.open(usb_path)
+        self.assertEqual(usb.get_node('/home/notes').content, 'кирилица!')
+        fs = solution.FileSystem.open(self.path)
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            fs.get_node('/home')
+        self.assertEqual(fs.get_node('/hard').content, 'кирилица')
+
+    def test_not_an_image(self):
+        with open(self.path, 'wb') as image:
+            image.write(bytes(64))
+        with self.assertRaises(ValueError):
+            solution.FileSystem.open(self.path)
+
+
+class TestForks(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(100)
+        self.fs.create('/home', directory=True)
+        self.fs.create('/home/file', content='data')
+        self.fs.link('/home/file', '/hard', symbolic=False)
+        self.fs.link('/home', '/soft')
+
+    def test_snapshot(self):
+        handle = self.fs.get_node('/home/file')
+        home = self.fs.get_node('/home')
+        snapshot = self.fs.snapshot()
+        handle.append('!')
+        self.fs.create('/home/new', directory=True)
+        self.assertEqual(snapshot.get_node('/home/file').content, 'data')
+        self.assertEqual(snapshot.get_node('/hard').content, 'data')
+        self.assertEqual(self.fs.get_node('/hard').content, 'data!')
+        self.assertEqual(len(snapshot.get_node('/soft').nodes), 1)
+        self.assertEqual(snapshot.available_size,
+                         self.fs.available_size + 2)
+        # Handles obtained before the snapshot stay with the file system:
+        self.assertIs(self.fs.get_node('/home/file'), handle)
+        self.assertIs(self.fs.get_node('/home'), home)
+        self.assertEqual([node.name for node in home.nodes], ['file', 'new'])
+        self.assertEqual(snapshot.get_node('/home').nodes,
+                         [snapshot.get_node('/home/file')])
+        self.assertIs(snapshot.get_node('/home'), snapshot.get_node('/home'))
+        with self.assertRaises(solution.ReadOnlyFileSystemError):
+            snapshot.create('/other')
+        with self.assertRaises(solution.ReadOnlyFileSystemError):
+            snapshot.get_node('/hard').truncate('')
+
+    def test_clone(self):
+        clone = self.fs.clone()
+        clone.get_node('/hard').append('!')
+        clone.remove('/home', directory=True)
+        clone.create('/home', content='now a file')
+        self.assertEqual(self.fs.get_node('/home/file').content, 'data')
+        self.assertEqual(clone.get_node('/hard').content, 'data!')
+        self.assertEqual(clone.available_size, 100 - 1 - 6 - 1 - 11)
+        self.assertEqual(self.fs.available_size, 100 - 1 - 1 - 5 - 1 - 1)
+        self.assertEqual(clone.get_node('/soft').content, 'now a file')
+        self.assertEqual(self.fs.get_node('/soft').nodes,
+                         [self.fs.get_node('/home/file')])
+
+    def test_reading_does_not_copy(self):
+        self.fs.create('/home/more', content='more')
+        snapshot = self.fs.snapshot()
+        home = snapshot.get_node('/home')
+        self.assertEqual(len(home.nodes), 2)
+        self.assertIs(home._entry, self.fs.get_node('/home')._entry)
+        self.assertNotIn(home._entry, snapshot._generation.states)
+        self.fs.remove('/home/more')
+        self.assertIn(home._entry, snapshot._generation.states)
+        self.assertEqual(len(snapshot.get_node('/home').nodes), 2)
+        self.assertEqual(len(self.fs.get_node('/home').nodes), 1)
+
+    def test_dropped_forks_release_shared_texts(self):
+        fs = solution.FileSystem(100, dedup=True)
+        fs.create('/a', content='hello')
+        fs.create('/b', content='hello')
+        clone = fs.clone()
+        clone.create('/c', content='hello')
+        fs.get_node('/a').truncate('bye')
+        # /b, the copy of /a kept for the clone, /c and 'bye':
+        self.assertEqual(fs.dedup_info().references, 4)
+        del clone
+        gc.collect()
+        self.assertEqual(fs.dedup_info().references, 2)
+        fs.remove('/a')
+        fs.remove('/b')
+        self.assertEqual(fs.dedup_info(), (0, 0, 0, 0, 0))
+
+    def test_dropped_forks_free_their_copies(self):
+        handle = self.fs.get_node('/home/file')
+        generation = self.fs._generation
+        for number in range(5):
+            snapshot = self.fs.snapshot()
+            clone = self.fs.clone()
+            clone.create('/home/new', content='new')
+            clone.get_node('/hard').append('!')
+            handle.truncate(str(number))
+            self.assertEqual(snapshot.get_node('/hard').content,
+                             'data' if not number else str(number - 1))
+            del snapshot, clone
+            gc.collect()
+            self.assertEqual(generation.children, [])
+        self.assertEqual(handle.content, '4')
+        self.assertEqual(
+            [node.name for node in self.fs.get_node('/home').nodes], ['file']
+        )
+        # Only the state of the file system itself is left:
+        state = handle._inode.own(generation)
+        self.assertIs(handle._inode.version(generation), state)
+        self.assertEqual(generation.states, {})
+
+    def test_clone_of_clone(self):
+        first = self.fs.clone()
+        first.get_node('/hard').append('1')
+        second = first.clone()
+        second.get_node('/home/file').append('2')
+        first.get_node('/home/file').append('3')
+        self.assertEqual(self.fs.get_node('/hard').content, 'data')
+        self.assertEqual(first.get_node('/hard').content, 'data13')
+        self.assertEqual(second.get_node('/hard').content, 'data12')
+        second.remove('/hard')
+        second.remove('/home/file')
+        self.assertEqual(second.available_size, self.fs.available_size + 6)
+
+
+class TestDedup(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(1000, dedup=True)
+        for name in ('first', 'second', 'third'):
+            self.fs.create('/' + name, content='template')
+
+    def test_equal_contents_are_shared(self):
+        first = self.fs.get_node('/first')
+        self.assertIs(first.content, self.fs.get_node('/third').content)
+        self.assertEqual(self.fs.available_size, 1000 - 1 - 3 * 9)
+        info = self.fs.dedup_info()
+        self.assertEqual(info.blobs, 1)
+        self.assertEqual(info.logical_size, 24)
+        self.assertEqual(info.physical_size, 8)
+        self.assertEqual(info.saved_size, 16)
+
+    def test_copy_on_write(self):
+        self.fs.get_node('/first').append('!')
+        self.fs.get_node('/second').truncate('other')
+        self.assertEqual(self.fs.get_node('/first').content, 'template!')
+        self.assertEqual(self.fs.get_node('/third').content, 'template')
+        self.fs.create('/fourth', content='template!')
+        self.assertIs(self.fs.get_node('/fourth').content,
+                      self.fs.get_node('/first').content)
+        self.assertEqual(self.fs.dedup_info().saved_size, 9)
+        self.fs.remove('/first')
+        self.fs.remove('/fourth')
+        info = self.fs.dedup_info()
+        self.assertEqual(info.blobs, 2)
+        self.assertEqual(info.saved_size, 0)
+
+    def test_without_dedup(self):
+        self.assertIsNone(solution.FileSystem(10).dedup_info())
+
+
+class TestConcurrentFileSystem(unittest.TestCase):
+    def setUp(self):
+        # Switch threads often, so that the operations interleave:
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+
+    def used_size(self, fs):
+        used, contents, stack = 0, set(), [fs.get_node('/')]
+        while stack:
+            node = stack.pop()
+            used += 1
+            if node.is_directory:
+                stack.extend(node.nodes)
+            elif hasattr(node, '_inode'):
+                contents.add(node._content)
+        return used + sum(content.length for content in contents)
+
+    def test_stress(self):
+        fs = solution.FileSystem(5000, concurrent=True)
+        directories = ['/a', '/b', '/c', '/a/d', '/b/e']
+        for directory in directories:
+            fs.create(directory, directory=True)
+        errors = []
+
+        def work(seed):
+            rng = random.Random(seed)
+            for _ in range(2000):
+                directory = rng.choice(directories)
+                path = '{}/{}'.format(directory, rng.randrange(20))
+                operation = rng.randrange(6)
+                try:
+                    if operation == 0:
+                        fs.create(path, content='x' * rng.randrange(50))
+                    elif operation == 1:
+                        fs.create(path, directory=True)
+                    elif operation == 2:
+                        fs.remove(path, directory=True)
+                    elif operation == 3:
+                        fs.move(path, rng.choice(directories))
+                    elif operation == 4:
+                        fs.get_node(path).append('y' * rng.randrange(20))
+                    else:
+                        fs.link(path, rng.choice(directories) + '/link',
+                                symbolic=False)
+                except solution.FileSystemError:
+                    pass
+                except AttributeError:
+                    # Appending to a directory
+                    pass
+                except Exception as error:
+                    errors.append(error)
+
+        threads = [threading.Thread(target=work, args=(seed,))
+                   for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+            self.assertFalse(thread.is_alive(), 'deadlock')
+        self.assertEqual(errors, [])
+        self.assertEqual(fs.size - fs.available_size, self.used_size(fs))
+        self.assertGreaterEqual(fs.available_size, 0)
+
+    def test_space_is_never_overcommitted(self):
+        fs = solution.FileSystem(1 + 100 * 10, concurrent=True)
+        created = []
+
+        def work(thread):
+            for number in range(50):
+                try:
+                    fs.create('/{}-{}'.format(thread, number),
+                              content='123456789')
+                    created.append(number)
+                except solution.NotEnoughSpaceError:
+                    pass
+
+        threads = [threading.Thread(target=work, args=(thread,))
+                   for thread in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(created), 100)
+        self.assertEqual(fs.available_size, 0)
+
+    def test_move_to_mount_while_moving_out_of_the_subtree(self):
+        for _ in range(20):
+            fs = solution.FileSystem(1000, concurrent=True)
+            usb = solution.FileSystem(1000, concurrent=True)
+            fs.create('/mnt', directory=True)
+            fs.mount(usb, '/mnt')
+            fs.create('/src', directory=True)
+            fs.create('/src/dir', directory=True)
+            for number in range(20):
+                fs.create('/src/dir/{}'.format(number))
+
+            def transfer():
+                fs.move('/src/dir', '/mnt')
+
+            def move_out():
+                for number in range(20):
+                    try:
+                        fs.move('/src/dir/{}'.format(number), '/src')
+                    except solution.SourceNodeDoesNotExistError:
+                        pass
+
+            threads = [threading.Thread(target=transfer),
+                       threading.Thread(target=move_out)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(timeout=60)
+                self.assertFalse(thread.is_alive(), 'deadlock')
+            names = [node.name for node in fs.get_node('/src').nodes] + \
+                [node.name for node in fs.get_node('/mnt/dir').nodes]
+            self.assertCountEqual(names, [str(n) for n in range(20)])
+            fs.unmount('/mnt')
+            self.assertEqual(fs.size - fs.available_size, self.used_size(fs))
+            self.assertEqual(usb.size - usb.available_size,
+                             self.used_size(usb))
+
+
+class TestDentryCache(unittest.TestCase):
+    def setUp(self):
+        self.fs = solution.FileSystem(100, dentry_cache_size=4)
+        self.fs.create('/a', directory=True)
+        self.fs.create('/a/b', directory=True)
+        self.fs.create('/a/b/c', content='c')
+        self.fs.create('/d', directory=True)
+
+    def test_hits_and_misses(self):
+        before = self.fs.dentry_cache_info()
+        node = self.fs.get_node('/a/b/c')
+        self.assertIs(self.fs.get_node('/a/b/c'), node)
+        self.assertIs(self.fs.get_node('/a//b/c/'), node)
+        info = self.fs.dentry_cache_info()
+        self.assertEqual(info.misses - before.misses, 1)
+        self.assertEqual(info.hits - before.hits, 2)
+        self.assertEqual(info.maxsize, 4)
+
+    def test_eviction(self):
+        for path in ['/', '/a', '/a/b', '/a/b/c', '/d']:
+            self.fs.get_node(path)
+        info = self.fs.dentry_cache_info()
+        self.assertEqual(info.currsize, 4)
+        self.assertGreaterEqual(info.evictions, 1)
+
+    def test_invalidation_by_subtree(self):
+        self.fs.get_node('/a/b/c')
+        self.fs.get_node('/d')
+        self.fs.move('/a/b', '/d')
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/a/b/c')
+        self.assertEqual(self.fs.get_node('/d/b/c').content, 'c')
+        hits = self.fs.dentry_cache_info().hits
+        self.fs.get_node('/d')
+        self.assertEqual(self.fs.dentry_cache_info().hits, hits + 1)
+        self.fs.remove('/d/b', directory=True)
+        with self.assertRaises(solution.NodeDoesNotExistError):
+            self.fs.get_node('/d/b/c')
+
+    def test_invalidation_on_mount(self):
+        self.fs.get_node('/d')
+        other = solution.FileSystem(10)
+        self.fs.mount(other, '/d')
+        self.assertIs(self.fs.get_node('/d'), other.get_node('/'))
+
+
+if __name__ == '__main__':
+    unittest.main()